@@ -1,1460 +1,98 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-from datetime import datetime, timedelta
-import os
-from io import BytesIO
-import json
-
-# Intentar importar gspread para Google Sheets
-try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-    GSPREAD_AVAILABLE = True
-except ImportError:
-    GSPREAD_AVAILABLE = False
-
-# Intentar importar Google Generative AI (Gemini)
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-
-# --- CONFIGURACIÓN PÁGINA ---
-st.set_page_config(
-    page_title="Finanzas Proactivas €", 
-    layout="wide", 
-    page_icon="💶",
-    initial_sidebar_state="collapsed"  # Colapsado por defecto
-)
-
-# --- CSS PERSONALIZADO BASADO EN DISEÑO PROPORCIONADO ---
-st.markdown("""
-<link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet"/>
-<link href="https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined:wght@100..700,0..1&display=swap" rel="stylesheet"/>
-<link href="https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined:wght,FILL@100..700,0..1&display=swap" rel="stylesheet"/>
-<style>
-    /* Importar fuente Inter */
-    * {
-        font-family: 'Inter', sans-serif;
-        -webkit-font-smoothing: antialiased;
-    }
-    
-    /* Variables de color del diseño */
-    :root {
-        --primary: #7980e7;
-        --background-dark: #121320;
-        --background-light: #f6f6f8;
-        --card-bg: rgba(255, 255, 255, 0.05);
-        --card-border: rgba(255, 255, 255, 0.1);
-        --text-primary: #ffffff;
-        --text-secondary: rgba(255, 255, 255, 0.7);
-        --text-muted: rgba(255, 255, 255, 0.5);
-        --input-bg: #1d1d26;
-        --input-border: #3d3f51;
-        --modal-bg: #1c1d2b;
-    }
-    
-    /* Fondo general */
-    .stApp {
-        background: var(--background-dark) !important;
-    }
-    
-    .main .block-container {
-        padding-top: 0 !important;
-        padding-bottom: 2rem;
-        max-width: 100% !important;
-    }
-    
-    /* Ocultar header nativo de Streamlit */
-    header[data-testid="stHeader"] {
-        display: none !important;
-    }
-    
-    /* Ocultar sidebar completamente */
-    section[data-testid="stSidebar"] {
-        display: none !important;
-    }
-    
-    /* Ocultar botón de toggle sidebar */
-    button[data-testid="baseButton-header"] {
-        display: none !important;
-    }
-    
-    /* Header personalizado estilo glass */
-    .top-header {
-        position: sticky !important;
-        top: 0 !important;
-        z-index: 50 !important;
-        backdrop-filter: blur(10px) !important;
-        background: rgba(18, 19, 32, 0.8) !important;
-        border-bottom: 1px solid rgba(255, 255, 255, 0.05) !important;
-        padding: 0.75rem 1rem !important;
-        margin: -1rem -1rem 1rem -1rem !important;
-        display: flex !important;
-        align-items: center !important;
-        justify-content: space-between !important;
-        gap: 0.5rem;
-    }
-    
-    .top-header h2, .top-header h3 {
-        color: white !important;
-        font-size: 1.125rem !important;
-        font-weight: 700 !important;
-        margin: 0 !important;
-        line-height: 1.25 !important;
-        letter-spacing: -0.025em !important;
-    }
-    
-    /* Botón Nuevo estilo primario */
-    .btn-nuevo-header {
-        background: var(--primary) !important;
-        color: white !important;
-        border: none !important;
-        border-radius: 0.5rem !important;
-        padding: 0.375rem 0.75rem !important;
-        font-size: 0.875rem !important;
-        font-weight: 700 !important;
-        display: flex !important;
-        align-items: center !important;
-        gap: 0.25rem !important;
-        transition: all 0.2s !important;
-    }
-    
-    .btn-nuevo-header:hover {
-        background: rgba(121, 128, 231, 0.9) !important;
-    }
-    
-    /* Botón menú */
-    .btn-menu-header {
-        color: white !important;
-        background: transparent !important;
-        border: none !important;
-        padding: 0.25rem !important;
-    }
-    
-    /* Cards de métricas estilo diseño */
-    [data-testid="stMetricContainer"] {
-        background: var(--card-bg) !important;
-        border: 1px solid var(--card-border) !important;
-        border-radius: 0.75rem !important;
-        padding: 1rem !important;
-        min-width: 200px !important;
-    }
-    
-    [data-testid="stMetricValue"] {
-        color: var(--text-primary) !important;
-        font-size: 1.25rem !important;
-        font-weight: 700 !important;
-    }
-    
-    [data-testid="stMetricLabel"] {
-        color: var(--text-secondary) !important;
-        font-size: 0.75rem !important;
-        font-weight: 600 !important;
-        text-transform: uppercase !important;
-        letter-spacing: 0.05em !important;
-    }
-    
-    /* Contenedor de métricas con scroll horizontal */
-    .metrics-scroll-container {
-        overflow-x: auto;
-        display: flex;
-        gap: 1rem;
-        padding: 1rem;
-        scrollbar-width: none;
-        -ms-overflow-style: none;
-    }
-    
-    .metrics-scroll-container::-webkit-scrollbar {
-        display: none;
-    }
-    
-    /* Títulos de sección */
-    h2 {
-        color: var(--text-primary) !important;
-        font-size: 1.25rem !important;
-        font-weight: 700 !important;
-        line-height: 1.25 !important;
-        letter-spacing: -0.025em !important;
-        display: flex !important;
-        align-items: center !important;
-        gap: 0.5rem !important;
-        margin-top: 1.5rem !important;
-        margin-bottom: 1rem !important;
-        padding-left: 1rem !important;
-    }
-    
-    /* Cards de recomendaciones */
-    .recommendation-card {
-        background: var(--card-bg) !important;
-        border: 1px solid var(--card-border) !important;
-        border-radius: 0.75rem !important;
-        padding: 1rem !important;
-        display: flex !important;
-        gap: 1rem !important;
-        align-items: flex-start !important;
-        margin-bottom: 0.75rem !important;
-    }
-    
-    .recommendation-icon {
-        padding: 0.5rem !important;
-        border-radius: 0.5rem !important;
-        display: flex !important;
-        align-items: center !important;
-        justify-content: center !important;
-    }
-    
-    .recommendation-content h4 {
-        color: var(--text-primary) !important;
-        font-weight: 700 !important;
-        margin: 0 0 0.25rem 0 !important;
-    }
-    
-    .recommendation-content p {
-        color: var(--text-secondary) !important;
-        font-size: 0.875rem !important;
-        line-height: 1.5 !important;
-        margin: 0 !important;
-    }
-    
-    /* Inputs estilo diseño */
-    .stTextInput > div > div > input,
-    .stNumberInput > div > div > input,
-    .stSelectbox > div > div > select,
-    .stDateInput > div > div > input {
-        background: var(--input-bg) !important;
-        border: 1px solid var(--input-border) !important;
-        border-radius: 0.5rem !important;
-        color: var(--text-primary) !important;
-        padding: 0.75rem 1rem !important;
-        font-size: 1rem !important;
-        min-height: 48px !important;
-    }
-    
-    .stTextInput > div > div > input:focus,
-    .stNumberInput > div > div > input:focus,
-    .stSelectbox > div > div > select:focus,
-    .stDateInput > div > div > input:focus {
-        border-color: var(--primary) !important;
-        outline: none !important;
-        box-shadow: 0 0 0 1px var(--primary) !important;
-    }
-    
-    .stTextInput > div > div > input::placeholder {
-        color: rgba(255, 255, 255, 0.3) !important;
-    }
-    
-    /* Labels de inputs */
-    label {
-        color: #9fa1b7 !important;
-        font-size: 0.75rem !important;
-        font-weight: 700 !important;
-        text-transform: uppercase !important;
-        letter-spacing: 0.05em !important;
-        margin-bottom: 0.5rem !important;
-    }
-    
-    /* Botones estilo diseño */
-    .stButton > button {
-        border-radius: 0.75rem !important;
-        font-weight: 700 !important;
-        transition: all 0.2s !important;
-        min-height: 56px !important;
-    }
-    
-    .stButton > button[kind="primary"] {
-        background: var(--primary) !important;
-        color: white !important;
-    }
-    
-    .stButton > button[kind="primary"]:hover {
-        background: rgba(121, 128, 231, 0.9) !important;
-    }
-    
-    .stButton > button:not([kind="primary"]) {
-        background: #2a2b37 !important;
-        color: #9fa1b7 !important;
-    }
-    
-    .stButton > button:not([kind="primary"]):hover {
-        background: #323344 !important;
-    }
-    
-    /* Radio buttons estilo toggle */
-    .stRadio > div {
-        background: #2a2b37 !important;
-        border-radius: 0.5rem !important;
-        padding: 0.25rem !important;
-        display: flex !important;
-        height: 44px !important;
-    }
-    
-    .stRadio > div > label {
-        flex: 1 !important;
-        display: flex !important;
-        align-items: center !important;
-        justify-content: center !important;
-        padding: 0.5rem !important;
-        border-radius: 0.5rem !important;
-        color: #9fa1b7 !important;
-        font-size: 0.875rem !important;
-        font-weight: 600 !important;
-        transition: all 0.2s !important;
-    }
-    
-    .stRadio > div > label:has(input:checked) {
-        background: #121217 !important;
-        color: white !important;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.3) !important;
-    }
-    
-    /* Checkboxes personalizados */
-    .stCheckbox > label {
-        display: flex !important;
-        align-items: center !important;
-        gap: 0.75rem !important;
-        cursor: pointer !important;
-    }
-    
-    .stCheckbox > label > div:first-child {
-        width: 24px !important;
-        height: 24px !important;
-        border: 2px solid var(--input-border) !important;
-        border-radius: 0.25rem !important;
-        background: transparent !important;
-    }
-    
-    .stCheckbox > label > input:checked + div {
-        background: var(--primary) !important;
-        border-color: var(--primary) !important;
-    }
-    
-    /* Modal estilo bottom sheet - Compatible con todas las versiones */
-    .modal-overlay-new {
-        position: fixed !important;
-        top: 0 !important;
-        left: 0 !important;
-        right: 0 !important;
-        bottom: 0 !important;
-        background: rgba(0, 0, 0, 0.7) !important;
-        backdrop-filter: blur(4px) !important;
-        z-index: 99999 !important;
-        display: flex !important;
-        flex-direction: column !important;
-        justify-content: flex-end !important;
-        align-items: center !important;
-        padding: 0 1rem 2.5rem 1rem !important;
-    }
-    
-    .modal-content-new {
-        width: 100% !important;
-        max-width: 480px !important;
-        background: var(--modal-bg) !important;
-        border-radius: 0.75rem !important;
-        box-shadow: 0 20px 25px -5px rgba(0, 0, 0, 0.5) !important;
-        border: 1px solid rgba(255, 255, 255, 0.05) !important;
-        overflow: hidden !important;
-        animation: slideInFromBottom 0.3s ease !important;
-        position: relative !important;
-        z-index: 100000 !important;
-    }
-    
-    @keyframes slideInFromBottom {
-        from {
-            transform: translateY(100%);
-            opacity: 0;
-        }
-        to {
-            transform: translateY(0);
-            opacity: 1;
-        }
-    }
-    
-    /* Handle del bottom sheet */
-    .modal-handle {
-        height: 24px !important;
-        width: 100% !important;
-        display: flex !important;
-        align-items: center !important;
-        justify-content: center !important;
-        padding-top: 0.5rem !important;
-    }
-    
-    .modal-handle::before {
-        content: '' !important;
-        width: 48px !important;
-        height: 6px !important;
-        background: #3d3f51 !important;
-        border-radius: 9999px !important;
-    }
-    
-    /* Formulario dentro del modal */
-    .modal-content-new .stForm {
-        padding: 0.5rem 1.25rem 2rem 1.25rem !important;
-        background: transparent !important;
-        border: none !important;
-        box-shadow: none !important;
-    }
-    
-    /* Campo de importe destacado */
-    .importe-field .stNumberInput > div > div > input {
-        border: 2px solid rgba(121, 128, 231, 0.3) !important;
-        height: 56px !important;
-        font-size: 1.5rem !important;
-        font-weight: 700 !important;
-        text-align: right !important;
-        color: var(--primary) !important;
-    }
-    
-    .importe-field label {
-        color: var(--primary) !important;
-    }
-    
-    /* Gasto conjunto en contenedor especial */
-    .gasto-conjunto-container {
-        background: rgba(42, 43, 55, 0.3) !important;
-        border-radius: 0.5rem !important;
-        padding: 0.25rem !important;
-        margin-bottom: 1.5rem !important;
-    }
-    
-    /* Botón cerrar modal */
-    .btn-cerrar-modal {
-        width: 100% !important;
-        max-width: 480px !important;
-        height: 56px !important;
-        background: rgba(239, 68, 68, 0.1) !important;
-        border: 1px solid rgba(239, 68, 68, 0.2) !important;
-        color: #ef4444 !important;
-        font-weight: 700 !important;
-        border-radius: 0.75rem !important;
-        margin-top: 1rem !important;
-        transition: all 0.2s !important;
-    }
-    
-    .btn-cerrar-modal:hover {
-        background: rgba(239, 68, 68, 0.2) !important;
-    }
-    
-    /* Chat messages estilo diseño */
-    .stChatMessage[data-testid="user"] > div {
-        background: var(--primary) !important;
-        border-radius: 1rem 1rem 1rem 0 !important;
-        padding: 0.75rem !important;
-        max-width: 85% !important;
-        margin-left: auto !important;
-    }
-    
-    .stChatMessage[data-testid="assistant"] > div {
-        background: var(--card-bg) !important;
-        border: 1px solid var(--card-border) !important;
-        border-radius: 1rem 1rem 0 1rem !important;
-        padding: 0.75rem !important;
-        max-width: 85% !important;
-    }
-    
-    /* Chips de preguntas sugeridas */
-    .suggestion-chip {
-        background: var(--card-bg) !important;
-        border: 1px solid var(--card-border) !important;
-        border-radius: 9999px !important;
-        padding: 0.375rem 0.75rem !important;
-        font-size: 0.75rem !important;
-        font-weight: 500 !important;
-        color: var(--text-secondary) !important;
-        white-space: nowrap !important;
-        transition: all 0.2s !important;
-    }
-    
-    .suggestion-chip:hover {
-        background: rgba(255, 255, 255, 0.1) !important;
-    }
-    
-    /* Scrollbar oculto */
-    .scrollbar-hide {
-        scrollbar-width: none;
-        -ms-overflow-style: none;
-    }
-    
-    .scrollbar-hide::-webkit-scrollbar {
-        display: none;
-    }
-    
-    /* Móvil optimizaciones */
-    @media (max-width: 768px) {
-        .main .block-container {
-            padding-left: 0 !important;
-            padding-right: 0 !important;
-            padding-top: 0 !important;
-        }
-        
-        .top-header {
-            padding: 0.75rem 1rem !important;
-        }
-        
-        .metrics-scroll-container {
-            padding: 1rem 0.75rem !important;
-        }
-        
-        h2 {
-            padding-left: 1rem !important;
-        }
-        
-        .recommendation-card {
-            margin-left: 1rem !important;
-            margin-right: 1rem !important;
-        }
-        
-        .modal-overlay-new {
-            padding: 0 0.5rem 1rem 0.5rem !important;
-        }
-        
-        .stTextInput > div > div > input,
-        .stNumberInput > div > div > input,
-        .stSelectbox > div > div > select,
-        .stDateInput > div > div > input {
-            font-size: 16px !important; /* Evita zoom en iOS */
-        }
-    }
-        
-        /* Contenedor interno de la sidebar */
-        section[data-testid="stSidebar"] > div {
-            height: auto !important;
-            min-height: 100% !important;
-            padding-bottom: 2rem !important;
-        }
-        
-        /* Cuando sidebar está abierta, oscurecer fondo */
-        section[data-testid="stSidebar"]::after {
-            content: '';
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background: rgba(0, 0, 0, 0.5);
-            z-index: -1;
-            pointer-events: none;
-        }
-        
-        /* Contenedor principal cuando sidebar está abierta */
-        .main .block-container {
-            width: 100% !important;
-        }
-        
-        /* Mejorar inputs en móvil - Chrome Android */
-        .stTextInput > div > div > input,
-        .stNumberInput > div > div > input,
-        .stSelectbox > div > div > select {
-            font-size: 16px !important;
-            padding: 0.625rem 0.75rem !important;
-            min-height: 44px !important;
-        }
-        
-        /* Mejorar botones en móvil */
-        .stButton > button {
-            width: 100% !important;
-            margin-bottom: 0.5rem;
-            min-height: 44px !important;
-            font-size: 0.95rem !important;
-            padding: 0.625rem 1rem !important;
-        }
-        
-        /* Tabs más compactos y accesibles */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 0.25rem !important;
-            flex-wrap: wrap;
-        }
-        
-        .stTabs [data-baseweb="tab"] {
-            padding: 0.5rem 0.75rem !important;
-            font-size: 0.85rem !important;
-            min-width: auto !important;
-        }
-        
-        /* Métricas en una sola columna en móvil */
-        [data-testid="stMetricContainer"] {
-            margin-bottom: 0.75rem !important;
-        }
-        
-        /* Columnas se apilan en móvil */
-        .stColumn {
-            width: 100% !important;
-            margin-bottom: 0.5rem;
-        }
-        
-        /* Headers más pequeños */
-        h1 {
-            font-size: 1.5rem !important;
-            margin-bottom: 0.75rem !important;
-        }
-        
-        h2 {
-            font-size: 1.25rem !important;
-            margin-top: 1rem !important;
-            margin-bottom: 0.5rem !important;
-        }
-        
-        h3 {
-            font-size: 1.1rem !important;
-        }
-        
-        /* Formularios más compactos */
-        .stForm {
-            padding: 0.75rem !important;
-            margin-bottom: 0.75rem !important;
-        }
-        
-        /* Radio buttons más compactos */
-        .stRadio > div {
-            gap: 0.5rem !important;
-            flex-wrap: wrap;
-        }
-        
-        .stRadio > div > label {
-            padding: 0.5rem 0.75rem !important;
-            font-size: 0.9rem !important;
-        }
-        
-        /* Selectbox más compacto */
-        .stSelectbox {
-            margin-bottom: 0.5rem !important;
-        }
-        
-        /* Chat messages más compactos */
-        .stChatMessage {
-            padding: 0.75rem !important;
-            margin-bottom: 0.5rem !important;
-            font-size: 0.9rem !important;
-        }
-        
-        /* Tablas más compactas */
-        .stDataFrame {
-            font-size: 0.85rem !important;
-        }
-        
-        /* Espaciado entre elementos reducido */
-        .element-container {
-            margin-bottom: 0.75rem !important;
-        }
-        
-        /* Info boxes más compactos */
-        .stInfo, .stSuccess, .stWarning, .stError {
-            padding: 0.75rem !important;
-            font-size: 0.9rem !important;
-            margin-bottom: 0.5rem !important;
-        }
-    }
-    
-    /* Mejorar el date input para móviles - Chrome Android */
-    @media (max-width: 768px) {
-        /* Asegurar que el calendario sea visible y centrado */
-        div[data-baseweb="popover"] {
-            z-index: 10000 !important;
-            position: fixed !important;
-            top: 50% !important;
-            left: 50% !important;
-            transform: translate(-50%, -50%) !important;
-            max-width: 95vw !important;
-            max-height: 85vh !important;
-            overflow-y: auto !important;
-            background: var(--background-color) !important;
-            border-radius: 0.75rem !important;
-            box-shadow: 0 8px 32px rgba(0,0,0,0.3) !important;
-        }
-        
-        /* Input de fecha optimizado para móvil - SOLO LECTURA para evitar teclado */
-        .stDateInput > div > div > input {
-            font-size: 16px !important;
-            padding: 0.625rem 0.75rem !important;
-            min-height: 44px !important;
-            cursor: pointer !important;
-            -webkit-user-select: none !important;
-            user-select: none !important;
-        }
-        
-        /* Asegurar que el calendario sea clickeable y no abra teclado */
-        .stDateInput input {
-            cursor: pointer !important;
-            readonly: true !important;
-            -webkit-user-select: none !important;
-            user-select: none !important;
-        }
-        
-        /* Prevenir que el input de fecha abra el teclado en móvil */
-        .stDateInput input:focus {
-            outline: none !important;
-        }
-        
-        /* Calendario más accesible en móvil */
-        .rdp {
-            font-size: 1rem !important;
-        }
-        
-        .rdp-day {
-            width: 2.5rem !important;
-            height: 2.5rem !important;
-        }
-        
-        /* Asegurar que la sidebar sea scrollable en móvil */
-        section[data-testid="stSidebar"] {
-            overflow-y: auto !important;
-            overflow-x: hidden !important;
-            -webkit-overflow-scrolling: touch !important;
-            max-height: 100vh !important;
-        }
-        
-        /* Permitir scroll en contenido de sidebar */
-        section[data-testid="stSidebar"] .css-1d391kg,
-        section[data-testid="stSidebar"] [data-testid="stSidebarContent"] {
-            overflow-y: visible !important;
-            height: auto !important;
-            max-height: none !important;
-        }
-        
-        /* Asegurar que los elementos dentro de la sidebar no bloqueen el scroll */
-        section[data-testid="stSidebar"] form,
-        section[data-testid="stSidebar"] .stForm {
-            position: relative !important;
-            overflow: visible !important;
-        }
-        
-        /* Botón de toggle sidebar más visible */
-        button[data-testid="baseButton-header"] {
-            min-width: 44px !important;
-            min-height: 44px !important;
-        }
-        
-        /* Prevenir que el formulario se oculte al seleccionar fecha */
-        form[data-testid="stForm"] {
-            position: relative !important;
-            z-index: 1 !important;
-        }
-    }
-    
-    /* Mejorar diseño del chat */
-    .stChatMessage {
-        padding: 1rem;
-        border-radius: 0.5rem;
-        margin-bottom: 0.5rem;
-    }
-    
-    /* Mejorar formularios */
-    .stForm {
-        border: 1px solid rgba(250, 250, 250, 0.2);
-        border-radius: 0.75rem;
-        padding: 1.25rem;
-        background: rgba(255, 255, 255, 0.03);
-        margin-bottom: 1rem;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-    }
-    
-    /* Mejoras visuales en la sidebar */
-    section[data-testid="stSidebar"] {
-        background: linear-gradient(180deg, #1e1e2e 0%, #2a2a3e 100%);
-    }
-    
-    /* Botones más atractivos */
-    .stButton > button {
-        border-radius: 0.5rem;
-        font-weight: 500;
-        transition: all 0.3s ease;
-    }
-    
-    /* Inputs mejorados */
-    .stTextInput > div > div > input,
-    .stNumberInput > div > div > input,
-    .stSelectbox > div > div > select {
-        border-radius: 0.5rem;
-        border: 1px solid rgba(255, 255, 255, 0.2);
-        transition: all 0.3s ease;
-    }
-    
-    .stTextInput > div > div > input:focus,
-    .stNumberInput > div > div > input:focus,
-    .stSelectbox > div > div > select:focus {
-        border-color: #667eea;
-        box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
-    }
-    
-    /* Radio buttons mejorados */
-    .stRadio > div {
-        gap: 1rem;
-    }
-    
-    .stRadio > div > label {
-        border-radius: 0.5rem;
-        padding: 0.5rem 1rem;
-        transition: all 0.3s ease;
-    }
-    
-    /* Tabs más atractivos */
-    .stTabs [data-baseweb="tab-list"] {
-        gap: 0.5rem;
-    }
-    
-    .stTabs [data-baseweb="tab"] {
-        border-radius: 0.5rem 0.5rem 0 0;
-        padding: 0.75rem 1.5rem;
-    }
-    
-    /* Mejorar visualización general en móvil */
-    @media (max-width: 768px) {
-        /* Viewport height fix para móviles */
-        html, body {
-            height: 100%;
-            overflow-x: hidden;
-        }
-        
-        /* Mejorar gráficos en móvil */
-        .js-plotly-plot {
-            width: 100% !important;
-        }
-        
-        /* Captions más pequeños */
-        .stCaption {
-            font-size: 0.8rem !important;
-        }
-        
-        /* Expandable sections más compactos */
-        .streamlit-expanderHeader {
-            font-size: 0.95rem !important;
-            padding: 0.75rem !important;
-        }
-    }
-    
-    /* Animaciones sutiles */
-    .stButton > button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 4px 12px rgba(0,0,0,0.3);
-        transition: all 0.3s ease;
-    }
-    
-    /* Mejorar espaciado entre elementos */
-    .element-container {
-        margin-bottom: 1rem;
-    }
-    
-    /* Mejorar contenedores principales - Aprovechar toda la pantalla */
-    .main .block-container {
-        max-width: 100% !important;
-        padding-left: 1rem !important;
-        padding-right: 1rem !important;
-        padding-top: 0.25rem !important;
-    }
-    
-    /* Eliminar espacio superior innecesario */
-    header[data-testid="stHeader"] {
-        padding-top: 0.5rem !important;
-        padding-bottom: 0.5rem !important;
-    }
-    
-    @media (max-width: 768px) {
-        .main .block-container {
-            padding-top: 0.1rem !important;
-            padding-left: 0.75rem !important;
-            padding-right: 0.75rem !important;
-        }
-        
-        header[data-testid="stHeader"] {
-            padding-top: 0.25rem !important;
-            padding-bottom: 0.25rem !important;
-        }
-    }
-    
-    /* Header fijo con botón de alta - Siempre visible */
-    .top-header {
-        position: sticky !important;
-        top: 0 !important;
-        z-index: 100 !important;
-        background: var(--background-color) !important;
-        padding: 0.5rem 1rem !important;
-        margin: -1rem -1rem 0.5rem -1rem !important;
-        border-bottom: 1px solid rgba(255, 255, 255, 0.1) !important;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.1) !important;
-        backdrop-filter: blur(10px);
-        display: flex !important;
-        align-items: center !important;
-        justify-content: space-between !important;
-        gap: 0.5rem;
-    }
-    
-    @media (max-width: 768px) {
-        .top-header {
-            padding: 0.4rem 0.75rem !important;
-            margin: -0.5rem -0.75rem 0.5rem -0.75rem !important;
-            flex-wrap: nowrap !important;
-        }
-        
-        .top-header h3 {
-            font-size: 1.1rem !important;
-            margin: 0 !important;
-            flex: 1 !important;
-        }
-        
-        .top-header .stButton > button {
-            font-size: 0.85rem !important;
-            padding: 0.4rem 0.75rem !important;
-            min-width: auto !important;
-        }
-        
-        /* Menú hamburger compacto */
-        .hamburger-menu-btn {
-            padding: 0.4rem 0.6rem !important;
-            font-size: 1.2rem !important;
-        }
-    }
-    
-    /* Aprovechar máximo espacio - reducir padding innecesario */
-    .main .block-container {
-        padding-top: 0.5rem !important;
-    }
-    
-    /* Eliminar padding superior del título si existe */
-    h1:first-of-type {
-        margin-top: 0 !important;
-        padding-top: 0 !important;
-    }
-    
-    /* Headers más atractivos */
-    h1 {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-        font-weight: 700;
-    }
-    
-    h2, h3 {
-        color: #667eea;
-        font-weight: 600;
-    }
-    
-    /* Mejorar info boxes */
-    .stInfo {
-        border-left: 4px solid #667eea;
-        border-radius: 0.5rem;
-    }
-    
-    .stSuccess {
-        border-left: 4px solid #00cc96;
-        border-radius: 0.5rem;
-    }
-    
-    .stWarning {
-        border-left: 4px solid #ff9800;
-        border-radius: 0.5rem;
-    }
-    
-    .stError {
-        border-left: 4px solid #ef553b;
-        border-radius: 0.5rem;
-    }
-    
-    /* Scrollbar personalizado */
-    ::-webkit-scrollbar {
-        width: 8px;
-        height: 8px;
-    }
-    
-    ::-webkit-scrollbar-track {
-        background: rgba(255, 255, 255, 0.05);
-        border-radius: 4px;
-    }
-    
-    ::-webkit-scrollbar-thumb {
-        background: rgba(102, 126, 234, 0.5);
-        border-radius: 4px;
-    }
-    
-    ::-webkit-scrollbar-thumb:hover {
-        background: rgba(102, 126, 234, 0.7);
-    }
-    
-    /* Estilos para el modal/popup - Arreglado para no bloquear */
-    .modal-overlay {
-        display: none;
-        position: fixed;
-        top: 0;
-        left: 0;
-        width: 100vw;
-        height: 100vh;
-        background: rgba(0, 0, 0, 0.75);
-        z-index: 99999 !important;
-        justify-content: center;
-        align-items: center;
-        overflow: hidden;
-    }
-    
-    .modal-overlay.show {
-        display: flex !important;
-    }
-    
-    .modal-content {
-        background: var(--background-color) !important;
-        border-radius: 1rem;
-        padding: 2rem;
-        max-width: 600px;
-        width: 90%;
-        max-height: 90vh;
-        overflow-y: auto;
-        overflow-x: hidden;
-        box-shadow: 0 10px 40px rgba(0,0,0,0.5);
-        position: relative;
-        margin: auto;
-        z-index: 100000 !important;
-    }
-    
-    /* Prevenir que el body se bloquee cuando el modal está abierto */
-    body.modal-open {
-        overflow: hidden;
-    }
-    
-    @media (max-width: 768px) {
-        .modal-content {
-            width: 95%;
-            padding: 1.25rem;
-            max-height: 95vh;
-            border-radius: 0.75rem;
-        }
-        
-        /* Formulario más compacto en móvil */
-        .modal-content .stForm {
-            padding: 0.75rem !important;
-        }
-        
-        /* Columnas se apilan en móvil dentro del modal */
-        .modal-content .stColumn {
-            width: 100% !important;
-        }
-    }
-    
-    /* Aprovechar mejor el espacio en desktop */
-    @media (min-width: 769px) {
-        .modal-content {
-            max-width: 700px;
-        }
-    }
-    
-    .modal-close {
-        position: absolute;
-        top: 1rem;
-        right: 1rem;
-        background: rgba(255, 255, 255, 0.1);
-        border: none;
-        border-radius: 50%;
-        width: 2.5rem;
-        height: 2.5rem;
-        cursor: pointer;
-        font-size: 1.5rem;
-        color: white;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        transition: all 0.3s ease;
-    }
-    
-    .modal-close:hover {
-        background: rgba(255, 255, 255, 0.2);
-        transform: rotate(90deg);
-    }
-    
-    /* Menú hamburger atractivo */
-    .hamburger-menu {
-        position: relative;
-        display: inline-block;
-    }
-    
-    .hamburger-btn {
-        background: rgba(102, 126, 234, 0.1);
-        border: 1px solid rgba(102, 126, 234, 0.3);
-        border-radius: 0.5rem;
-        padding: 0.5rem 0.75rem;
-        cursor: pointer;
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-        transition: all 0.3s ease;
-        color: #667eea;
-        font-weight: 500;
-    }
-    
-    .hamburger-btn:hover {
-        background: rgba(102, 126, 234, 0.2);
-        border-color: rgba(102, 126, 234, 0.5);
-        transform: translateY(-1px);
-    }
-    
-    .hamburger-icon {
-        display: flex;
-        flex-direction: column;
-        gap: 4px;
-        width: 20px;
-    }
-    
-    .hamburger-icon span {
-        display: block;
-        height: 2px;
-        width: 100%;
-        background: currentColor;
-        border-radius: 2px;
-        transition: all 0.3s ease;
-    }
-    
-    .hamburger-menu.active .hamburger-icon span:nth-child(1) {
-        transform: rotate(45deg) translate(5px, 5px);
-    }
-    
-    .hamburger-menu.active .hamburger-icon span:nth-child(2) {
-        opacity: 0;
-    }
-    
-    .hamburger-menu.active .hamburger-icon span:nth-child(3) {
-        transform: rotate(-45deg) translate(7px, -6px);
-    }
-    
-    .menu-dropdown {
-        display: none;
-        position: absolute;
-        top: calc(100% + 0.5rem);
-        right: 0;
-        background: var(--background-color);
-        border: 1px solid rgba(255, 255, 255, 0.2);
-        border-radius: 0.75rem;
-        box-shadow: 0 8px 32px rgba(0,0,0,0.3);
-        min-width: 250px;
-        z-index: 1000;
-        overflow: hidden;
-        animation: slideDown 0.3s ease;
-    }
-    
-    .hamburger-menu.active .menu-dropdown {
-        display: block;
-    }
-    
-    @keyframes slideDown {
-        from {
-            opacity: 0;
-            transform: translateY(-10px);
-        }
-        to {
-            opacity: 1;
-            transform: translateY(0);
-        }
-    }
-    
-    .menu-item {
-        padding: 0.75rem 1.25rem;
-        cursor: pointer;
-        transition: all 0.2s ease;
-        border-bottom: 1px solid rgba(255, 255, 255, 0.05);
-        display: flex;
-        align-items: center;
-        gap: 0.75rem;
-    }
-    
-    .menu-item:last-child {
-        border-bottom: none;
-    }
-    
-    .menu-item:hover {
-        background: rgba(102, 126, 234, 0.1);
-        padding-left: 1.5rem;
-    }
-    
-    .menu-item.active {
-        background: rgba(102, 126, 234, 0.2);
-        border-left: 3px solid #667eea;
-    }
-    
-    /* Botón de nuevo movimiento más pequeño e intuitivo */
-    .btn-nuevo-mov {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        border: none;
-        border-radius: 0.5rem;
-        padding: 0.5rem 1rem;
-        color: white;
-        font-weight: 500;
-        font-size: 0.9rem;
-        cursor: pointer;
-        transition: all 0.3s ease;
-        box-shadow: 0 2px 8px rgba(102, 126, 234, 0.3);
-    }
-    
-    .btn-nuevo-mov:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 4px 12px rgba(102, 126, 234, 0.4);
-    }
-    
-    @media (max-width: 768px) {
-        .menu-dropdown {
-            min-width: 200px;
-            right: -0.5rem;
-        }
-        
-        .menu-item {
-            padding: 0.625rem 1rem;
-            font-size: 0.9rem;
-        }
-    }
-    
-    /* Estilos adicionales según diseño HTML */
-    
-    /* Cards de métricas individuales estilo diseño */
-    .metric-card {
-        display: flex;
-        flex-direction: column;
-        gap: 0.75rem;
-        border-radius: 0.75rem;
-        border: 1px solid rgba(255, 255, 255, 0.1);
-        background: rgba(255, 255, 255, 0.05);
-        padding: 1rem;
-        margin-bottom: 0.75rem;
-        min-height: 120px;
-    }
-    
-    /* Asegurar que las métricas se vean bien en columnas */
-    .stColumn {
-        display: flex;
-        flex-direction: column;
-    }
-    
-    .metric-card-header {
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-    }
-    
-    .metric-card-icon {
-        font-size: 1.25rem;
-    }
-    
-    .metric-card-label {
-        color: rgba(255, 255, 255, 0.7);
-        font-size: 0.75rem;
-        font-weight: 600;
-        text-transform: uppercase;
-        letter-spacing: 0.05em;
-    }
-    
-    .metric-card-value {
-        color: white;
-        font-size: 1.25rem;
-        font-weight: 700;
-    }
-    
-    /* Card especial para Acumulado Conjunto */
-    .metric-card-highlight {
-        border: 1px solid rgba(121, 128, 231, 0.3);
-        background: rgba(121, 128, 231, 0.1);
-        padding: 1.5rem;
-        flex: 1;
-    }
-    
-    .metric-card-highlight .metric-card-label {
-        color: var(--primary);
-        font-weight: 600;
-    }
-    
-    .metric-card-highlight .metric-card-value {
-        font-size: 1.875rem;
-        line-height: 1.2;
-    }
-    
-    /* Cards de recomendaciones con iconos */
-    .rec-card-info {
-        background: rgba(59, 130, 246, 0.2);
-        color: #60a5fa;
-        padding: 0.5rem;
-        border-radius: 0.5rem;
-    }
-    
-    .rec-card-warning {
-        background: rgba(234, 179, 8, 0.2);
-        color: #fbbf24;
-        padding: 0.5rem;
-        border-radius: 0.5rem;
-    }
-    
-    .rec-card-error {
-        background: rgba(239, 68, 68, 0.2);
-        color: #f87171;
-        padding: 0.5rem;
-        border-radius: 0.5rem;
-    }
-    
-    /* Análisis de patrones - Barras de progreso */
-    .pattern-bar-container {
-        width: 100%;
-        background: rgba(255, 255, 255, 0.1);
-        height: 6px;
-        border-radius: 9999px;
-        overflow: hidden;
-    }
-    
-    .pattern-bar-fill {
-        height: 100%;
-        background: var(--primary);
-        border-radius: 9999px;
-        transition: width 0.3s ease;
-    }
-    
-    /* Gráfico de días de la semana */
-    .day-chart-container {
-        display: flex;
-        align-items: flex-end;
-        justify-content: space-between;
-        height: 96px;
-        gap: 0.5rem;
-    }
-    
-    .day-bar {
-        flex: 1;
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-        gap: 0.5rem;
-    }
-    
-    .day-bar-bg {
-        width: 100%;
-        background: rgba(255, 255, 255, 0.1);
-        border-radius: 0.125rem 0.125rem 0 0;
-        position: relative;
-    }
-    
-    .day-bar-fill {
-        position: absolute;
-        bottom: 0;
-        width: 100%;
-        background: rgba(121, 128, 231, 0.4);
-        border-radius: 0.125rem 0.125rem 0 0;
-    }
-    
-    .day-bar-fill.weekend {
-        background: rgba(239, 68, 68, 0.4);
-    }
-    
-    .day-label {
-        font-size: 0.625rem;
-        color: rgba(255, 255, 255, 0.4);
-    }
-    
-    .day-label.weekend {
-        color: #f87171;
-        font-weight: 700;
-    }
-    
-    /* Chat container mejorado */
-    .chat-container {
-        background: rgba(255, 255, 255, 0.05);
-        border: 1px solid rgba(255, 255, 255, 0.1);
-        border-radius: 0.75rem;
-        overflow: hidden;
-    }
-    
-    .chat-messages-area {
-        padding: 1rem;
-        max-height: 240px;
-        overflow-y: auto;
-        display: flex;
-        flex-direction: column;
-        gap: 1rem;
-    }
-    
-    .chat-input-area {
-        padding: 1rem;
-        border-top: 1px solid rgba(255, 255, 255, 0.1);
-        display: flex;
-        gap: 0.75rem;
-        align-items: center;
-    }
-    
-    .chat-input-wrapper {
-        flex: 1;
-        background: rgba(255, 255, 255, 0.05);
-        border-radius: 0.5rem;
-        border: 1px solid rgba(255, 255, 255, 0.1);
-        padding: 0.5rem 1rem;
-    }
-    
-    .chat-send-button {
-        background: var(--primary);
-        color: white;
-        padding: 0.5rem;
-        border-radius: 0.5rem;
-        border: none;
-        cursor: pointer;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-    }
-    
-    /* Chips de sugerencias mejorados */
-    .suggestion-chips-container {
-        display: flex;
-        gap: 0.5rem;
-        overflow-x: auto;
-        padding: 1rem 1rem 0 1rem;
-        scrollbar-width: none;
-    }
-    
-    .suggestion-chips-container::-webkit-scrollbar {
-        display: none;
-    }
-    
-    /* Selectbox con icono */
-    .stSelectbox > div > div {
-        position: relative;
-    }
-    
-    .stSelectbox > div > div::after {
-        content: 'expand_more';
-        font-family: 'Material Symbols Outlined';
-        position: absolute;
-        right: 0.75rem;
-        top: 50%;
-        transform: translateY(-50%);
-        color: #9fa1b7;
-        pointer-events: none;
-    }
-    
-    /* Date input con icono */
-    .stDateInput > div > div {
-        position: relative;
-    }
-    
-    .stDateInput > div > div::after {
-        content: 'calendar_today';
-        font-family: 'Material Symbols Outlined';
-        position: absolute;
-        right: 0.75rem;
-        top: 50%;
-        transform: translateY(-50%);
-        color: #9fa1b7;
-        pointer-events: none;
-    }
-    
-    /* Frecuencia select con icono */
-    .frecuencia-select::after {
-        content: 'repeat';
-        font-family: 'Material Symbols Outlined';
-    }
-    
-    /* Texto general */
-    body, .stApp {
-        color: white;
-    }
-    
-    p, span, div {
-        color: inherit;
-    }
-</style>
-""", unsafe_allow_html=True)
+from streamlit.errors import StreamlitAPIException
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+try:
+    from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+except ImportError:
+    SCRIPT_RUN_CONTEXT_ATTR_NAME = "streamlit_script_run_ctx"
+import pandas as pd
+from datetime import datetime, timedelta
+import os
+import importlib
+import importlib.util
+from io import BytesIO
+from difflib import SequenceMatcher
+import json
+import hashlib
+import threading
+import atexit
+import time
+import random
+import copy
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# load_data comparte un mismo DataFrame entre sesiones: solo es seguro con copy-on-write,
+# que es el comportamiento por defecto desde pandas 3 y hay que activar en pandas 2
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+# Dependencias pesadas (plotly, gspread, google-auth, Gemini, pyarrow): se importan en el primer uso,
+# no en cada arranque en frío. Sin importarlas solo se comprueba que estén instaladas.
+class _ModuloDiferido:
+    """Módulo que se importa la primera vez que se accede a uno de sus atributos"""
+    def __init__(self, nombre):
+        self._nombre = nombre
+
+    def __getattr__(self, atributo):
+        return getattr(importlib.import_module(self._nombre), atributo)
+
+def _instalado(*modulos):
+    """Comprueba que los módulos están instalados sin ejecutarlos"""
+    try:
+        return all(importlib.util.find_spec(m) is not None for m in modulos)
+    except (ImportError, ValueError):
+        return False
+
+px = _ModuloDiferido("plotly.express")
+go = _ModuloDiferido("plotly.graph_objects")
+
+# gspread para Google Sheets
+gspread = _ModuloDiferido("gspread")
+gspread_utils = _ModuloDiferido("gspread.utils")
+service_account = _ModuloDiferido("google.oauth2.service_account")
+GSPREAD_AVAILABLE = _instalado("gspread", "google.oauth2.service_account")
+
+# Google Generative AI (Gemini)
+genai = _ModuloDiferido("google.generativeai")
+GEMINI_AVAILABLE = _instalado("google.generativeai")
+
+# fcntl permite el lock entre procesos (no existe en Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# pyarrow para el almacenamiento columnar (Parquet / Arrow IPC)
+pa = _ModuloDiferido("pyarrow")
+pq = _ModuloDiferido("pyarrow.parquet")
+feather = _ModuloDiferido("pyarrow.feather")
+PYARROW_AVAILABLE = _instalado("pyarrow")
+
+# --- CONFIGURACIÓN PÁGINA ---
+st.set_page_config(
+    page_title="Finanzas Proactivas €", 
+    layout="wide", 
+    page_icon="💶",
+    initial_sidebar_state="collapsed"  # Colapsado por defecto
+)
+
+# --- CSS PERSONALIZADO BASADO EN DISEÑO PROPORCIONADO ---
+# El tema vive en static/estilos.css y se sirve como estático (enableStaticServing en
+# .streamlit/config.toml): el navegador lo descarga una vez y en cada rerun solo viaja el <link>.
+RUTA_ESTILOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "estilos.css")
+
+@st.cache_data
+def _version_estilos(modificado):
+    """Huella del CSS para la URL: cambia al editarlo y el navegador descarga la nueva versión"""
+    with open(RUTA_ESTILOS, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:10]
+
+if os.path.exists(RUTA_ESTILOS):
+    st.markdown(f'<link rel="stylesheet" href="app/static/estilos.css?v={_version_estilos(os.path.getmtime(RUTA_ESTILOS))}"/>',
+                unsafe_allow_html=True)
 
 # JavaScript para prevenir teclado en campo fecha
 st.components.v1.html("""
@@ -1505,11 +143,69 @@ REC_FILE_NAME = "recurrentes.csv"
 PRESUPUESTOS_FILE = "presupuestos.csv"
 HISTORIAL_FILE = "historial_cambios.csv"
 BACKUP_DIR = "backups"
+PARQUET_FILE_NAME = "finanzas.parquet"
+ARROW_FILE_NAME = "finanzas.arrow"
+JOURNAL_FILE = "finanzas_journal.csv"
+DB_FILE = "finanzas.db"
+PARTITION_DIR = "finanzas_mensual"
+LOCK_FILE = ".finanzas.lock"
+LOCK_COLA_FILE = ".finanzas_cola.lock"
+COLA_ESCRITURAS_DIR = "cola_escrituras"
+
+# Formato del almacenamiento local de movimientos: "csv" (por defecto), "parquet", "arrow",
+# "sqlite" (movimientos, recurrentes, categorías, presupuestos e historial en finanzas.db)
+# o "particionado" (un fichero por año-mes en PARTITION_DIR). Las particiones abaratan las altas
+# (solo se reescriben los meses afectados) y las lecturas de un mes (cargar_meses): el Asesor y
+# Presupuestos leen solo el mes en curso y el anterior; las tablas y gráficos siguen cargando el
+# histórico completo (load_data, cacheado por versión).
+# El CSV sigue disponible siempre como formato de exportación.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'csv').lower()
+
+# Segundos máximos que se espera a la carga inicial en paralelo de los datasets
+CARGA_TIMEOUT = float(os.getenv('CARGA_TIMEOUT', '20'))
+
+# Número de altas acumuladas en el journal a partir del cual se compacta en el fichero base
+JOURNAL_COMPACT_THRESHOLD = int(os.getenv('JOURNAL_COMPACT_THRESHOLD', '500'))
 
 # Configuración de Google Sheets (usar variables de entorno en Streamlit Cloud)
 GOOGLE_SHEETS_ENABLED = os.getenv('GOOGLE_SHEETS_ENABLED', 'false').lower() == 'true'
 GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID', '')
 GOOGLE_CREDENTIALS_JSON = os.getenv('GOOGLE_CREDENTIALS_JSON', '')
+# Tamaño máximo (bytes de JSON) de cada actualización por rango; por encima se trocea
+SHEETS_MAX_BYTES_LOTE = int(os.getenv('SHEETS_MAX_BYTES_LOTE', str(2 * 1024 * 1024)))
+# Llamadas máximas de una sincronización por diferencias; si se superan se reescribe la hoja
+SHEETS_MAX_LLAMADAS_DIFF = int(os.getenv('SHEETS_MAX_LLAMADAS_DIFF', '10'))
+# Segundos que se reutiliza un worksheet ya resuelto antes de volver a pedir sus metadatos
+SHEETS_TTL_METADATOS = int(os.getenv('SHEETS_TTL_METADATOS', '300'))
+# Lectura incremental: filas ya conocidas que se releen para comprobar que no han cambiado y
+# segundos tras los que se fuerza una lectura completa. Solo se comprueban las últimas
+# SHEETS_FILAS_SOLAPE filas: una edición manual anterior a ellas no se ve hasta la siguiente
+# lectura completa (como mucho SHEETS_RELECTURA_COMPLETA segundos)
+SHEETS_FILAS_SOLAPE = int(os.getenv('SHEETS_FILAS_SOLAPE', '5'))
+SHEETS_RELECTURA_COMPLETA = int(os.getenv('SHEETS_RELECTURA_COMPLETA', '600'))
+# Con Google Sheets como fuente de verdad, segundos tras los que las lecturas cacheadas se renuevan
+# para ver los cambios hechos directamente en la hoja o desde otra instancia de la app
+SHEETS_TTL_LECTURAS = int(os.getenv('SHEETS_TTL_LECTURAS', '60'))
+# Hojas de más de SHEETS_FILAS_BLOQUE filas se leen por bloques de ese tamaño, varios a la vez
+SHEETS_FILAS_BLOQUE = int(os.getenv('SHEETS_FILAS_BLOQUE', '10000'))
+SHEETS_LECTURAS_PARALELAS = int(os.getenv('SHEETS_LECTURAS_PARALELAS', '4'))
+# Cuota de la API compartida por todas las sesiones: peticiones por minuto (token bucket) y
+# reintentos con espera exponencial ante un 429 (cuota superada) o un 5xx transitorio
+SHEETS_PETICIONES_MINUTO = int(os.getenv('SHEETS_PETICIONES_MINUTO', '60'))
+SHEETS_REINTENTOS_CUOTA = int(os.getenv('SHEETS_REINTENTOS_CUOTA', '5'))
+# Modo local primero: el almacenamiento local es la fuente de verdad y un hilo replica los
+# cambios en Google Sheets con reintentos (espera exponencial entre BASE y MAX segundos)
+MODO_LOCAL_PRIMERO = os.getenv('MODO_LOCAL_PRIMERO', 'false').lower() == 'true'
+REPLICACION_FILE = "replicacion_sheets.json"
+LOCK_REPLICACION_FILE = ".finanzas_replicacion.lock"
+REPLICACION_ESPERA_BASE = float(os.getenv('REPLICACION_ESPERA_BASE', '2'))
+REPLICACION_ESPERA_MAX = float(os.getenv('REPLICACION_ESPERA_MAX', '300'))
+# Guardados completos en segundo plano (write-behind); ESCRITURA_DIFERIDA=0 los hace síncronos.
+# Con Google Sheets como fuente principal están desactivados por defecto: la cola vive en el disco
+# local y en un host efímero (Streamlit Cloud) un reinicio antes del volcado perdería el guardado.
+ESCRITURA_DIFERIDA = os.getenv(
+    'ESCRITURA_DIFERIDA', '0' if GOOGLE_SHEETS_ENABLED and not MODO_LOCAL_PRIMERO else '1'
+) == '1'
 
 # Configuración de Gemini (Google AI)
 # Intentar obtener API key de st.secrets primero, luego de os.getenv
@@ -1521,10 +217,85 @@ except:
 GEMINI_ENABLED = GEMINI_AVAILABLE and GEMINI_API_KEY != ''
 GEMINI_MODEL = None
 
-# Inicializar Gemini si está disponible
+# Modelo de Gemini: GEMINI_MODELO lo fija; si no, el detectado con list_models se recuerda en
+# disco durante GEMINI_MODELO_TTL segundos y solo se vuelve a detectar tras un error de modelo
+try:
+    GEMINI_MODELO = st.secrets.get('GEMINI_MODELO', '') or os.getenv('GEMINI_MODELO', '')
+except:
+    GEMINI_MODELO = os.getenv('GEMINI_MODELO', '')
+GEMINI_MODELO_FILE = "gemini_modelo.json"
+GEMINI_MODELO_TTL = int(os.getenv('GEMINI_MODELO_TTL', str(7 * 24 * 3600)))
+GEMINI_RESOLUCION = None  # (nombre del modelo, origen) tras inicializar_gemini
+
+def _huella_api_key():
+    """Identifica la API key sin guardarla: otra clave puede tener acceso a otros modelos"""
+    return hashlib.sha256(GEMINI_API_KEY.encode("utf-8")).hexdigest()[:12]
+
+def _modelo_gemini_recordado():
+    """Modelo detectado en un arranque anterior, si sigue vigente y es de la misma API key"""
+    try:
+        with open(GEMINI_MODELO_FILE, encoding="utf-8") as f:
+            datos = json.load(f)
+        if datos['clave'] == _huella_api_key() and time.time() - datos['resuelto'] < GEMINI_MODELO_TTL:
+            return datos['modelo']
+    except Exception:
+        pass
+    return None
+
+def _recordar_modelo_gemini(nombre):
+    def escribir(ruta):
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump({'modelo': nombre, 'resuelto': time.time(), 'clave': _huella_api_key()}, f)
+    try:
+        _escritura_atomica(GEMINI_MODELO_FILE, escribir)
+    except OSError:
+        pass
+
+def olvidar_modelo_gemini():
+    """Descarta el modelo recordado para que la próxima inicialización lo vuelva a detectar"""
+    global GEMINI_MODEL, GEMINI_RESOLUCION
+    GEMINI_MODEL = None
+    GEMINI_RESOLUCION = None
+    try:
+        os.remove(GEMINI_MODELO_FILE)
+    except OSError:
+        pass
+
+def _detectar_modelo_gemini():
+    """Elige el modelo con list_models (llamada de red). Devuelve (nombre, verificado)"""
+    # Intentar obtener la lista de modelos disponibles
+    try:
+        modelos_disponibles = [m.name.split('/')[-1] for m in genai.list_models() 
+                              if 'generateContent' in m.supported_generation_methods]
+        
+        # Priorizar modelos con "-latest" o modelos comunes
+        modelos_prioridad = [
+            'gemini-1.5-flash-latest',
+            'gemini-1.5-pro-latest',
+            'gemini-1.5-flash',
+            'gemini-1.5-pro',
+            'gemini-pro',
+            'models/gemini-pro',
+            'models/gemini-1.5-flash'
+        ]
+        
+        # Buscar primero en los modelos de prioridad
+        for modelo_pref in modelos_prioridad:
+            nombre_corto = modelo_pref.replace('models/', '')
+            if nombre_corto in modelos_disponibles:
+                return nombre_corto, True
+        
+        # Si no encontramos uno de prioridad, usar el primero disponible
+        if modelos_disponibles:
+            return modelos_disponibles[0], True
+        return None, False
+    except Exception:
+        # Si falla listar modelos, probar con un modelo común sin recordarlo
+        return 'gemini-pro', False
+
 def inicializar_gemini():
-    """Inicializa el modelo de Gemini, probando diferentes opciones"""
-    global GEMINI_MODEL, GEMINI_ENABLED
+    """Inicializa el modelo de Gemini: el configurado, el recordado o uno detectado"""
+    global GEMINI_MODEL, GEMINI_ENABLED, GEMINI_RESOLUCION
     
     if not GEMINI_ENABLED:
         return None
@@ -1532,63 +303,32 @@ def inicializar_gemini():
     try:
         genai.configure(api_key=GEMINI_API_KEY)
         
-        # Intentar obtener la lista de modelos disponibles
-        try:
-            modelos_disponibles = [m.name.split('/')[-1] for m in genai.list_models() 
-                                  if 'generateContent' in m.supported_generation_methods]
-            
-            # Priorizar modelos con "-latest" o modelos comunes
-            modelos_prioridad = [
-                'gemini-1.5-flash-latest',
-                'gemini-1.5-pro-latest',
-                'gemini-1.5-flash',
-                'gemini-1.5-pro',
-                'gemini-pro',
-                'models/gemini-pro',
-                'models/gemini-1.5-flash'
-            ]
-            
-            modelo_a_usar = None
-            
-            # Buscar primero en los modelos de prioridad
-            for modelo_pref in modelos_prioridad:
-                nombre_corto = modelo_pref.replace('models/', '')
-                if nombre_corto in modelos_disponibles:
-                    modelo_a_usar = nombre_corto
-                    break
-            
-            # Si no encontramos uno de prioridad, usar el primero disponible
-            if not modelo_a_usar and modelos_disponibles:
-                modelo_a_usar = modelos_disponibles[0]
-            
-            if modelo_a_usar:
-                GEMINI_MODEL = genai.GenerativeModel(modelo_a_usar)
-                return GEMINI_MODEL
-            else:
-                GEMINI_ENABLED = False
-                return None
-                
-        except Exception as e:
-            # Si falla listar modelos, intentar con modelos comunes directamente
-            modelos_comunes = ['gemini-pro', 'gemini-1.5-flash', 'gemini-1.5-pro']
-            for modelo_nombre in modelos_comunes:
-                try:
-                    GEMINI_MODEL = genai.GenerativeModel(modelo_nombre)
-                    return GEMINI_MODEL
-                except:
-                    continue
-            
-            GEMINI_ENABLED = False
-            return None
+        if GEMINI_MODELO:
+            nombre, origen = GEMINI_MODELO, "configurado"
+        else:
+            nombre, origen = _modelo_gemini_recordado(), "recordado"
+        if not nombre:
+            nombre, verificado = _detectar_modelo_gemini()
+            origen = "detectado" if verificado else "por defecto"
+            if verificado:
+                _recordar_modelo_gemini(nombre)
+        
+        if nombre:
+            GEMINI_MODEL = genai.GenerativeModel(nombre)
+            GEMINI_RESOLUCION = (nombre, origen)
+            return GEMINI_MODEL
+        GEMINI_ENABLED = False
+        return None
             
     except Exception as e:
         GEMINI_ENABLED = False
         GEMINI_MODEL = None
         return None
 
-# Inicializar al cargar el módulo
-if GEMINI_ENABLED:
-    inicializar_gemini()
+def _es_error_de_modelo(e):
+    """El modelo pedido ya no existe o no admite generateContent (404 de la API)"""
+    texto = str(e).lower()
+    return getattr(e, 'code', None) == 404 or 'not found' in texto or 'not supported' in texto
 
 # Nombres de las hojas en Google Sheets
 SHEET_FINANZAS = "Finanzas"
@@ -1603,7 +343,181 @@ MESES_ES_DICT = {
 COLUMNS = ["Fecha", "Tipo", "Categoría", "Concepto", "Importe", "Frecuencia", "Impacto_Mensual", "Es_Conjunto"]
 COLUMNS_REC = ["Tipo", "Categoría", "Concepto", "Importe", "Frecuencia", "Es_Conjunto"]
 
+def esquema_movimientos():
+    """Esquema tipado de COLUMNS para el almacenamiento columnar (importa pyarrow)"""
+    return pa.schema([
+        ("Fecha", pa.timestamp("s")),
+        ("Tipo", pa.string()),
+        ("Categoría", pa.string()),
+        ("Concepto", pa.string()),
+        ("Importe", pa.int64()),            # céntimos
+        ("Frecuencia", pa.string()),
+        ("Impacto_Mensual", pa.int64()),    # céntimos
+        ("Es_Conjunto", pa.bool_()),
+    ])
+
 # --- FUNCIONES DE GOOGLE SHEETS ---
+def sheets_primario():
+    """Google Sheets es la fuente de verdad: activo y sin modo local primero"""
+    return GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE and not MODO_LOCAL_PRIMERO
+
+def replicacion_activa():
+    """En modo local primero los cambios se replican en Google Sheets en segundo plano"""
+    return GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE and MODO_LOCAL_PRIMERO
+
+class ClienteSheets:
+    """Cliente compartido por todas las sesiones por el que pasan las llamadas a gspread.
+    Limita el ritmo con un token bucket, reintenta los 429 con espera exponencial, agrupa lecturas
+    idénticas simultáneas en una sola petición y acumula llamadas y latencias por operación."""
+    LECTURAS = {"open_by_key", "worksheet", "get", "batch_get", "get_all_records", "get_all_values", "values_batch_get"}
+
+    def __init__(self, peticiones_minuto, reintentos):
+        self.capacidad = max(peticiones_minuto, 1)
+        self.reintentos = reintentos
+        self.fichas = float(self.capacidad)
+        self.repuesto = time.monotonic()
+        self.lock = threading.Lock()
+        self.en_vuelo = {}
+        self.metricas = {}
+        # Sube al terminar cada escritura: una lectura pedida después no se agrupa con otra anterior
+        self.generacion = 0
+
+    def _tomar_ficha(self):
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                self.fichas = min(self.capacidad, self.fichas + (ahora - self.repuesto) * self.capacidad / 60)
+                self.repuesto = ahora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                espera = (1 - self.fichas) * 60 / self.capacidad
+            time.sleep(espera)
+
+    def _anotar(self, operacion, campo, valor=1):
+        with self.lock:
+            metrica = self.metricas.setdefault(operacion, {
+                'llamadas': 0, 'agrupadas': 0, 'reintentos': 0, 'errores': 0, 'segundos': 0.0, 'max': 0.0
+            })
+            metrica[campo] += valor
+            if campo == 'segundos':
+                metrica['max'] = max(metrica['max'], valor)
+
+    def _espera_cuota(self, error, intento):
+        """Segundos a esperar si el error es de cuota o transitorio; None si no se debe reintentar"""
+        respuesta = getattr(error, "response", None)
+        estado = getattr(respuesta, "status_code", None)
+        if estado != 429 and not (estado and 500 <= estado < 600):
+            return None
+        if estado == 429:
+            # La cuota es por minuto y compartida: se vacía el bucket para frenar a todas las sesiones
+            with self.lock:
+                self.fichas = 0.0
+        try:
+            return float(respuesta.headers.get("Retry-After"))
+        except (AttributeError, TypeError, ValueError):
+            return min(2 ** intento, 64) * random.uniform(0.5, 1.0)
+
+    def _ejecutar(self, operacion, funcion):
+        for intento in range(self.reintentos + 1):
+            self._tomar_ficha()
+            inicio = time.perf_counter()
+            try:
+                resultado = funcion()
+            except Exception as e:
+                self._anotar(operacion, 'segundos', time.perf_counter() - inicio)
+                espera = self._espera_cuota(e, intento) if intento < self.reintentos else None
+                if espera is None:
+                    self._anotar(operacion, 'errores')
+                    raise
+                self._anotar(operacion, 'reintentos')
+                time.sleep(espera)
+                continue
+            self._anotar(operacion, 'segundos', time.perf_counter() - inicio)
+            self._anotar(operacion, 'llamadas')
+            return resultado
+
+    def llamar(self, operacion, clave, funcion):
+        """Ejecuta funcion() respetando la cuota. Con clave (solo lecturas), las llamadas idénticas
+        que llegan mientras otra está en curso esperan y reciben una copia de su resultado."""
+        if clave is None:
+            try:
+                return self._ejecutar(operacion, funcion)
+            finally:
+                with self.lock:
+                    self.generacion += 1
+        with self.lock:
+            clave = (self.generacion,) + tuple(clave)
+            pendiente = self.en_vuelo.get(clave)
+            lider = pendiente is None
+            if lider:
+                pendiente = self.en_vuelo[clave] = {'listo': threading.Event()}
+        if not lider:
+            pendiente['listo'].wait()
+            self._anotar(operacion, 'agrupadas')
+            if 'error' in pendiente:
+                raise pendiente['error']
+            resultado = pendiente['resultado']
+            # Los datos se copian; los objetos de gspread (libro, hoja) se comparten
+            return copy.deepcopy(resultado) if isinstance(resultado, (list, dict)) else resultado
+        try:
+            pendiente['resultado'] = self._ejecutar(operacion, funcion)
+            return pendiente['resultado']
+        except Exception as e:
+            pendiente['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.en_vuelo[clave]
+            pendiente['listo'].set()
+
+    def informe(self):
+        """Llamadas, lecturas agrupadas, reintentos, errores y latencias por operación"""
+        with self.lock:
+            filas = [
+                {'Operación': op, 'Llamadas': m['llamadas'], 'Agrupadas': m['agrupadas'],
+                 'Reintentos': m['reintentos'], 'Errores': m['errores'],
+                 'Media (ms)': round(1000 * m['segundos'] / max(m['llamadas'] + m['reintentos'] + m['errores'], 1), 1),
+                 'Máx (ms)': round(1000 * m['max'], 1)}
+                for op, m in sorted(self.metricas.items())
+            ]
+        return pd.DataFrame(filas)
+
+class ObjetoSheets:
+    """Proxy de un Spreadsheet o Worksheet de gspread: cada método pasa por el ClienteSheets.
+    Los atributos (title, row_count...) se leen directamente del objeto envuelto."""
+    DEVUELVEN_HOJA = {"worksheet", "add_worksheet"}
+
+    def __init__(self, objeto, cliente):
+        self._objeto = objeto
+        self._cliente = cliente
+
+    def __getattr__(self, nombre):
+        if nombre.startswith("_"):
+            raise AttributeError(nombre)
+        atributo = getattr(self._objeto, nombre)
+        if not callable(atributo):
+            return atributo
+
+        def llamada(*args, **kwargs):
+            clave = None
+            if nombre in ClienteSheets.LECTURAS:
+                clave = (id(self._objeto), nombre, repr(args), repr(sorted(kwargs.items())))
+            resultado = self._cliente.llamar(nombre, clave, lambda: atributo(*args, **kwargs))
+            if nombre in self.DEVUELVEN_HOJA:
+                return ObjetoSheets(resultado, self._cliente)
+            return resultado
+        return llamada
+
+@st.cache_resource
+def cliente_sheets():
+    return ClienteSheets(SHEETS_PETICIONES_MINUTO, SHEETS_REINTENTOS_CUOTA)
+
+def _abrir_libro(client):
+    cliente = cliente_sheets()
+    libro = cliente.llamar("open_by_key", ("open_by_key", GOOGLE_SHEET_ID), lambda: client.open_by_key(GOOGLE_SHEET_ID))
+    return ObjetoSheets(libro, cliente)
+
 @st.cache_resource
 def get_google_sheet():
     """Inicializa y retorna la conexión a Google Sheets"""
@@ -1659,104 +573,1370 @@ def get_google_sheet():
                 'https://www.googleapis.com/auth/spreadsheets',
                 'https://www.googleapis.com/auth/drive'
             ]
-            creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
+            creds = service_account.Credentials.from_service_account_info(creds_dict, scopes=scopes)
             client = gspread.authorize(creds)
-            return client.open_by_key(GOOGLE_SHEET_ID)
+            return _abrir_libro(client)
         elif os.path.exists('credentials.json') and GOOGLE_SHEET_ID:
             # Fallback: usar archivo de credenciales local (útil para desarrollo)
             scopes = [
                 'https://www.googleapis.com/auth/spreadsheets',
                 'https://www.googleapis.com/auth/drive'
             ]
-            creds = Credentials.from_service_account_file('credentials.json', scopes=scopes)
+            creds = service_account.Credentials.from_service_account_file('credentials.json', scopes=scopes)
             client = gspread.authorize(creds)
-            return client.open_by_key(GOOGLE_SHEET_ID)
+            return _abrir_libro(client)
     except Exception as e:
         st.error(f"Error conectando a Google Sheets: {str(e)}")
         return None
     
     return None
 
+@st.cache_resource
+def _hojas_resueltas():
+    """Worksheets ya obtenidos por nombre y el momento en que se pidieron sus metadatos"""
+    return {}
+
 def get_or_create_worksheet(sheet, sheet_name, headers):
-    """Obtiene o crea una hoja de cálculo con los encabezados"""
+    """Obtiene o crea una hoja de cálculo con los encabezados.
+    El worksheet se reutiliza durante SHEETS_TTL_METADATOS sin volver a pedir metadatos."""
+    resuelta = _hojas_resueltas().get(sheet_name)
+    if resuelta and time.time() - resuelta[1] < SHEETS_TTL_METADATOS:
+        return resuelta[0]
     try:
         worksheet = sheet.worksheet(sheet_name)
-        return worksheet
     except gspread.exceptions.WorksheetNotFound:
         # Crear nueva hoja
         worksheet = sheet.add_worksheet(title=sheet_name, rows=1000, cols=20)
         if headers:
             worksheet.append_row(headers)
-        return worksheet
+        recordar_hoja(sheet_name, [])
     except Exception as e:
         st.error(f"Error obteniendo hoja {sheet_name}: {str(e)}")
         return None
+    _hojas_resueltas()[sheet_name] = (worksheet, time.time())
+    return worksheet
+
+def _tras_cambio_de_filas(titulo):
+    """append_rows, insert_rows y delete_rows cambian el número de filas sin que el worksheet en
+    caché lo sepa: se descarta para que escribir_hoja no dimensione add_rows y batch_clear con un
+    row_count equivocado (dejaría filas sobrantes o limpiaría de menos)"""
+    _hojas_resueltas().pop(titulo, None)
+
+def _tras_error_sheets(error):
+    """Ante un error estructural (hoja borrada o renombrada, rango fuera de la cuadrícula)
+    descarta los worksheets en caché para que la siguiente llamada pida metadatos frescos"""
+    if isinstance(error, gspread.exceptions.WorksheetNotFound):
+        _hojas_resueltas().clear()
+    elif isinstance(error, gspread.exceptions.APIError):
+        respuesta = getattr(error, "response", None)
+        if getattr(respuesta, "status_code", None) in (400, 404):
+            _hojas_resueltas().clear()
+
+def _valores_hoja(df, columnas):
+    """Filas de valores serializables (tipos nativos, NaN -> "") para Google Sheets"""
+    df_filas = df.reindex(columns=columnas).astype(object)
+    return df_filas.where(df_filas.notna(), "").values.tolist()
+
+def _lotes_por_tamano(filas, max_bytes):
+    """Agrupa filas en lotes cuyo JSON no supere max_bytes"""
+    lote, tamano = [], 0
+    for fila in filas:
+        tamano_fila = len(json.dumps(fila, default=str))
+        if lote and tamano + tamano_fila > max_bytes:
+            yield lote
+            lote, tamano = [], 0
+        lote.append(fila)
+        tamano += tamano_fila
+    if lote:
+        yield lote
+
+def escribir_hoja(worksheet, cabecera, filas):
+    """Sustituye el contenido de la hoja con actualizaciones por rango en lugar de una llamada por fila.
+    Normalmente son dos llamadas (valores y limpieza de filas sobrantes); solo se trocea si el
+    payload supera SHEETS_MAX_BYTES_LOTE."""
+    valores = [list(cabecera)] + [list(f) for f in filas]
+    n_cols = len(cabecera)
+    if len(valores) > worksheet.row_count:
+        worksheet.add_rows(len(valores) - worksheet.row_count)
+    fila_inicio = 1
+    for lote in _lotes_por_tamano(valores, SHEETS_MAX_BYTES_LOTE):
+        fila_fin = fila_inicio + len(lote) - 1
+        worksheet.update(range_name=f"A{fila_inicio}:{gspread_utils.rowcol_to_a1(fila_fin, n_cols)}", values=lote)
+        fila_inicio = fila_fin + 1
+    # Borrar lo que quede de un contenido anterior más largo
+    if worksheet.row_count >= fila_inicio:
+        worksheet.batch_clear([f"A{fila_inicio}:{gspread_utils.rowcol_to_a1(worksheet.row_count, max(n_cols, worksheet.col_count))}"])
+
+# Última copia conocida de cada hoja (filas normalizadas, sin cabecera), tal como quedó tras
+# la última lectura o escritura. Permite enviar solo las filas que cambian.
+@st.cache_resource
+def _instantaneas_hojas():
+    return {}
+
+@st.cache_resource
+def _instantaneas_verificadas():
+    """Momento en que cada copia se tomó de la hoja completa (lectura o reescritura entera)"""
+    return {}
+
+def _celda_normalizada(valor):
+    """Representación comparable de una celda, igual si viene de una escritura o de get_all_records"""
+    if isinstance(valor, bool):
+        return "TRUE" if valor else "FALSE"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+def _normalizar_filas(filas):
+    return [tuple(_celda_normalizada(v) for v in fila) for fila in filas]
+
+def recordar_hoja(titulo, filas):
+    """Registra el contenido actual de la hoja (sin cabecera) como base del próximo diff"""
+    _instantaneas_hojas()[titulo] = _normalizar_filas(filas)
+    _instantaneas_verificadas()[titulo] = time.time()
+
+def _filas_desde(worksheet, n_cols, fila):
+    """Filas de datos desde `fila` hasta el final de la hoja (una lectura), con los números
+    convertidos como en get_all_records"""
+    ultima_col = "".join(c for c in gspread_utils.rowcol_to_a1(1, n_cols) if c.isalpha())
+    return [gspread_utils.numericise_all((list(f) + [""] * n_cols)[:n_cols])
+            for f in worksheet.get(f"A{fila}:{ultima_col}")]
+
+def _instantanea_vigente(worksheet, n_cols, viejas, tramos):
+    """Comprueba con una lectura que la hoja sigue igual que la copia en los tramos de filas que el
+    diff va a tocar [(inicio, fin) de datos, base 0] y al final: mismo número de filas y mismas
+    últimas filas. Si alguien ha insertado, borrado o editado ahí, las posiciones ya no valen."""
+    solape = min(SHEETS_FILAS_SOLAPE, len(viejas))
+    tramos = [t for t in tramos if t[1] > t[0]] + [(len(viejas) - solape, None)]
+    ultima_col = "".join(c for c in gspread_utils.rowcol_to_a1(1, n_cols) if c.isalpha())
+    rangos = [f"A{inicio + 2}:{ultima_col}{fin + 1}" if fin is not None else f"A{inicio + 2}:{ultima_col}"
+              for inicio, fin in tramos]
+    for (inicio, fin), valores in zip(tramos, worksheet.batch_get(rangos)):
+        filas = [gspread_utils.numericise_all((list(f) + [""] * n_cols)[:n_cols]) for f in valores]
+        if _normalizar_filas(filas) != viejas[inicio:len(viejas) if fin is None else fin]:
+            return False
+    return True
+
+def _operaciones_diff(viejas, nuevas):
+    """Diff por filas: actualizaciones en coordenadas antiguas y altas/bajas de filas"""
+    actualizaciones, estructurales = [], []
+    # Recortar prefijo y sufijo comunes: las ediciones suelen ser locales y así el diff es barato
+    prefijo = 0
+    while prefijo < min(len(viejas), len(nuevas)) and viejas[prefijo] == nuevas[prefijo]:
+        prefijo += 1
+    sufijo = 0
+    while (sufijo < min(len(viejas), len(nuevas)) - prefijo
+           and viejas[len(viejas) - 1 - sufijo] == nuevas[len(nuevas) - 1 - sufijo]):
+        sufijo += 1
+    medio_viejas = viejas[prefijo:len(viejas) - sufijo]
+    medio_nuevas = nuevas[prefijo:len(nuevas) - sufijo]
+    for op, i1, i2, j1, j2 in SequenceMatcher(None, medio_viejas, medio_nuevas, autojunk=False).get_opcodes():
+        if op == 'equal':
+            continue
+        i1, i2, j1, j2 = i1 + prefijo, i2 + prefijo, j1 + prefijo, j2 + prefijo
+        comunes = min(i2 - i1, j2 - j1)
+        if comunes:
+            actualizaciones.append((i1, j1, j1 + comunes))
+        if i2 - i1 > comunes:
+            estructurales.append(('borrar', i1 + comunes, i2))
+        if j2 - j1 > comunes:
+            estructurales.append(('insertar', i2, (j1 + comunes, j2)))
+    return actualizaciones, estructurales
+
+def sincronizar_hoja(worksheet, cabecera, filas):
+    """Lleva la hoja al contenido `filas` enviando solo las filas que difieren de la última copia
+    conocida. Las posiciones del diff solo valen si la copia sigue siendo la hoja: antes se comprueban
+    en una lectura las filas que el diff toca y el final de la hoja (número de filas y últimas filas)
+    y, si la copia no se ha tomado de la hoja completa en SHEETS_RELECTURA_COMPLETA segundos, se relee
+    entera. Una edición ajena en otras filas que no cambie el número de filas se conserva. Sin copia
+    previa, si la hoja no coincide o si el diff costaría más llamadas que reescribir, usa escribir_hoja."""
+    instantaneas = _instantaneas_hojas()
+    viejas = instantaneas.pop(worksheet.title, None)
+    nuevas = _normalizar_filas(filas)
+    n_cols = len(cabecera)
+    verificada = False
+    if viejas is not None and time.time() - _instantaneas_verificadas().get(worksheet.title, 0) >= SHEETS_RELECTURA_COMPLETA:
+        viejas = _normalizar_filas(_filas_desde(worksheet, n_cols, 2))
+        _instantaneas_verificadas()[worksheet.title] = time.time()
+        verificada = True
+    if viejas is not None:
+        actualizaciones, estructurales = _operaciones_diff(viejas, nuevas)
+        if (1 if actualizaciones else 0) + len(estructurales) > SHEETS_MAX_LLAMADAS_DIFF:
+            viejas = None
+    if viejas is not None and not verificada:
+        tramos = [(i, i + j2 - j1) for i, j1, j2 in actualizaciones]
+        tramos += [(posicion, extra) for op, posicion, extra in estructurales if op == 'borrar']
+        tramos += [(posicion, posicion + 1) for op, posicion, _ in estructurales if op == 'insertar' and posicion < len(viejas)]
+        if not _instantanea_vigente(worksheet, n_cols, viejas, tramos):
+            viejas = None
+    if viejas is None:
+        escribir_hoja(worksheet, cabecera, filas)
+        recordar_hoja(worksheet.title, filas)
+        return
+    # Fila de datos i (base 0) = fila i + 2 de la hoja. Primero las actualizaciones, todas en una
+    # llamada y con las posiciones antiguas; después altas y bajas de abajo arriba para que
+    # las posiciones pendientes sigan siendo válidas.
+    if actualizaciones:
+        worksheet.batch_update([
+            {'range': f"A{i + 2}:{gspread_utils.rowcol_to_a1(i + 1 + (j2 - j1), n_cols)}", 'values': [list(f) for f in filas[j1:j2]]}
+            for i, j1, j2 in actualizaciones
+        ])
+    for op, posicion, extra in sorted(estructurales, key=lambda o: o[1], reverse=True):
+        if op == 'borrar':
+            worksheet.delete_rows(posicion + 2, extra + 1)
+        elif posicion >= len(viejas):
+            worksheet.append_rows([list(f) for f in filas[extra[0]:extra[1]]])
+        else:
+            worksheet.insert_rows([list(f) for f in filas[extra[0]:extra[1]]], row=posicion + 2)
+    if estructurales:
+        _tras_cambio_de_filas(worksheet.title)
+    instantaneas[worksheet.title] = nuevas
+
+# Marca de agua de la última lectura de cada hoja: número de filas, hash de las últimas filas y
+# el DataFrame leído. Una lectura posterior solo descarga las filas añadidas desde entonces.
+@st.cache_resource
+def _marcas_hojas():
+    return {}
+
+def _hash_filas(filas):
+    return hashlib.sha1(json.dumps(_normalizar_filas(filas)).encode("utf-8")).hexdigest()
+
+def marcar_hoja(titulo, cabecera, filas, df, lectura_completa=True):
+    """Registra el contenido conocido de la hoja como punto de partida de la siguiente lectura"""
+    anterior = _marcas_hojas().get(titulo, {})
+    _marcas_hojas()[titulo] = {
+        'cabecera': list(cabecera),
+        'filas': len(filas),
+        'hash_solape': _hash_filas(filas[max(len(filas) - SHEETS_FILAS_SOLAPE, 0):]),
+        'df': df,
+        'lectura_completa': time.time() if lectura_completa else anterior.get('lectura_completa', 0),
+    }
+
+def leer_hoja_incremental(worksheet, columnas):
+    """Registros de la hoja como DataFrame. Si las últimas filas conocidas no han cambiado, solo
+    descarga las añadidas después (una lectura por rango); si no, o si la última lectura completa
+    es más antigua que SHEETS_RELECTURA_COMPLETA, lee la hoja entera. Solo se releen las últimas
+    SHEETS_FILAS_SOLAPE filas conocidas: una edición manual de una fila anterior que no cambie el
+    número de filas no aparece hasta la siguiente lectura completa. Las escrituras por diferencias
+    no dependen de esto (sincronizar_hoja comprueba las filas que toca)."""
+    marca = _marcas_hojas().get(worksheet.title)
+    if marca and time.time() - marca['lectura_completa'] < SHEETS_RELECTURA_COMPLETA:
+        solape = min(SHEETS_FILAS_SOLAPE, marca['filas'])
+        cabecera = marca['cabecera']
+        ultima_col = "".join(c for c in gspread_utils.rowcol_to_a1(1, len(cabecera)) if c.isalpha())
+        valores = worksheet.get(f"A{marca['filas'] - solape + 2}:{ultima_col}")
+        filas = [
+            [dict(zip(cabecera, gspread_utils.numericise_all(list(f) + [""] * (len(cabecera) - len(f))))).get(c, "") for c in columnas]
+            for f in valores
+        ]
+        if len(filas) >= solape and _hash_filas(filas[:solape]) == marca['hash_solape']:
+            nuevas = filas[solape:]
+            if not nuevas:
+                return marca['df']
+            df = pd.concat([marca['df'], pd.DataFrame(nuevas, columns=columnas)], ignore_index=True)
+            marca.update(filas=marca['filas'] + len(nuevas), hash_solape=_hash_filas(filas[-SHEETS_FILAS_SOLAPE:]), df=df)
+            if worksheet.title in _instantaneas_hojas():
+                _instantaneas_hojas()[worksheet.title] += _normalizar_filas(nuevas)
+            return df
+    
+    if worksheet.row_count > SHEETS_FILAS_BLOQUE:
+        return leer_hoja_por_bloques(worksheet, columnas)
+    return registrar_lectura_completa(worksheet.title, columnas, worksheet.get_all_records())
+
+@st.cache_resource
+def _pool_lecturas_sheets():
+    """Hilos para leer en paralelo los bloques de una hoja grande"""
+    return ThreadPoolExecutor(max_workers=SHEETS_LECTURAS_PARALELAS, thread_name_prefix="sheets")
+
+def leer_hoja_por_bloques(worksheet, columnas):
+    """Lectura completa de una hoja grande: bloques de SHEETS_FILAS_BLOQUE filas pedidos en paralelo
+    como valores crudos, sin el dict por fila de get_all_records. El último bloque queda abierto
+    por abajo para no perder filas si row_count (de la caché de metadatos) se ha quedado corto."""
+    ultima_col = "".join(c for c in gspread_utils.rowcol_to_a1(1, worksheet.col_count) if c.isalpha())
+    inicios = list(range(1, worksheet.row_count + 1, SHEETS_FILAS_BLOQUE))
+    rangos = [f"A{i}:{ultima_col}{i + SHEETS_FILAS_BLOQUE - 1}" for i in inicios[:-1]]
+    rangos.append(f"A{inicios[-1]}:{ultima_col}")
+    bloques = list(_pool_lecturas_sheets().map(worksheet.get, rangos))
+    valores = []
+    for bloque in bloques[:-1]:
+        # La API omite las filas vacías del final de cada rango: se rellenan para no desplazar las siguientes
+        valores.extend(list(bloque) + [[]] * (SHEETS_FILAS_BLOQUE - len(bloque)))
+    valores.extend(bloques[-1])
+    while valores and not any(valores[-1]):
+        valores.pop()
+    return registrar_valores(worksheet.title, columnas, valores)
+
+def registrar_valores(titulo, columnas, valores):
+    """Como registrar_lectura_completa, pero construye el DataFrame por columnas a partir de los
+    valores crudos (cabecera + filas); los números se convierten igual que en get_all_records"""
+    if len(valores) < 2:
+        return registrar_lectura_completa(titulo, columnas, [])
+    cabecera = list(valores[0])
+    df = pd.DataFrame(valores[1:], dtype=object).reindex(columns=range(len(cabecera))).fillna("")
+    df.columns = cabecera
+    for col in cabecera:
+        numeros = pd.to_numeric(df[col], errors="coerce")
+        if numeros.notna().any():
+            # Como numericise: enteros como int y el resto como float
+            convertidos = numeros.astype(object)
+            enteros = numeros.notna() & (numeros % 1 == 0)
+            convertidos[enteros] = numeros[enteros].astype("int64").astype(object)
+            df[col] = df[col].where(numeros.isna(), convertidos)
+    filas = df.reindex(columns=columnas, fill_value="").values.tolist()
+    marcar_hoja(titulo, cabecera, filas, df)
+    recordar_hoja(titulo, filas)
+    return df
+
+def registrar_lectura_completa(titulo, columnas, records):
+    """DataFrame de una lectura completa; la registra como marca de agua y copia para el diff"""
+    filas = [[r.get(c, "") for c in columnas] for r in records]
+    df = pd.DataFrame(records) if records else pd.DataFrame(columns=columnas)
+    marcar_hoja(titulo, list(records[0].keys()) if records else columnas, filas, df)
+    recordar_hoja(titulo, filas)
+    return df
+
+# Precarga: al arrancar el proceso se leen todas las hojas en una única petición values_batch_get
+# y cada cargador consume la suya en lugar de resolver el worksheet y leerlo por separado.
+HOJAS_PRECARGA = {
+    "movimientos": SHEET_FINANZAS,
+    "recurrentes": SHEET_RECURRENTES,
+    "categorias": SHEET_CATEGORIAS,
+    "presupuestos": "Presupuestos",
+}
+
+@st.cache_resource
+def _precarga_hojas():
+    """titulo -> (valores, momento) de todas las hojas, leídas una sola vez por proceso"""
+    sheet = get_google_sheet()
+    if not sheet:
+        return {}
+    try:
+        respuesta = sheet.values_batch_get([f"'{titulo}'" for titulo in HOJAS_PRECARGA.values()])
+    except Exception as e:
+        # Por ejemplo, si aún falta alguna hoja: cada cargador la leerá (o creará) por su cuenta
+        _tras_error_sheets(e)
+        return {}
+    ahora = time.time()
+    return {
+        titulo: (rango.get('values', []), ahora)
+        for titulo, rango in zip(HOJAS_PRECARGA.values(), respuesta.get('valueRanges', []))
+    }
+
+def valores_precargados(dataset):
+    """Valores crudos (cabecera + filas) de la precarga del dataset; se consumen una sola vez.
+    None si no hay precarga, ha caducado o la hoja está vacía: el cargador lee la hoja."""
+    precarga = _precarga_hojas().pop(HOJAS_PRECARGA[dataset], None)
+    if precarga is None:
+        return None
+    valores, momento = precarga
+    if len(valores) < 2 or time.time() - momento > SHEETS_TTL_METADATOS:
+        return None
+    return valores
+
+def registros_precargados(dataset):
+    """Registros (como get_all_records) de la precarga del dataset"""
+    valores = valores_precargados(dataset)
+    if valores is None:
+        return None
+    cabecera = valores[0]
+    return [dict(zip(cabecera, gspread_utils.numericise_all(list(f) + [""] * (len(cabecera) - len(f))))) for f in valores[1:]]
+
+def descartar_precarga(dataset):
+    """Tras una escritura la precarga del dataset ya no es válida"""
+    if dataset in HOJAS_PRECARGA and sheets_primario():
+        _precarga_hojas().pop(HOJAS_PRECARGA[dataset], None)
+
+# --- ESCRITURAS ATÓMICAS Y BLOQUEO ---
+class ConflictoVersionError(Exception):
+    """Otra sesión ha guardado el dataset desde que se cargó"""
+    def __init__(self, dataset):
+        super().__init__(f"Los datos de {dataset} han cambiado en otra sesión")
+        self.dataset = dataset
+
+@st.cache_resource
+def _lock_proceso(nombre):
+    """Lock compartido por todas las sesiones del proceso"""
+    return threading.Lock()
+
+@contextmanager
+def _bloqueo_fichero(ruta_lock):
+    """Lock exclusivo entre sesiones (threading) y entre procesos (flock sobre ruta_lock)"""
+    with _lock_proceso(ruta_lock):
+        with open(ruta_lock, "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+def _bloqueo_escritura():
+    """Lock exclusivo sobre el directorio de datos"""
+    return _bloqueo_fichero(LOCK_FILE)
+
+def _escritura_atomica(ruta, escribir):
+    """Escribe en un temporal del mismo directorio y lo renombra: nadie lee un fichero a medias"""
+    directorio = os.path.dirname(ruta) or "."
+    fd, ruta_tmp = tempfile.mkstemp(prefix=".tmp-", suffix=os.path.splitext(ruta)[1], dir=directorio)
+    os.close(fd)
+    try:
+        escribir(ruta_tmp)
+        os.replace(ruta_tmp, ruta)
+    except BaseException:
+        if os.path.exists(ruta_tmp):
+            os.remove(ruta_tmp)
+        raise
+
+def _anadir_a_fichero(ruta, texto):
+    """Añade texto al final de un fichero con una única escritura"""
+    with open(ruta, "a", encoding="utf-8", newline="") as f:
+        f.write(texto)
+
+def _comprobar_version(dataset, version_esperada):
+    """Control optimista: falla si el dataset ya no está en la versión sobre la que se editó"""
+    if version_esperada is None:
+        return
+    actual = _version_logica(version_datos(dataset))
+    # Volcar la cola o compactar el journal cambia la versión pero no los datos: se siguen los
+    # alias registrados (puede haber varios seguidos) hasta la versión actual
+    logica = _version_logica(version_esperada)
+    alias, vistas = _alias_versiones(), set()
+    while logica != actual and (dataset, logica) in alias and logica not in vistas:
+        vistas.add(logica)
+        logica = _version_logica(alias[(dataset, logica)])
+    if logica != actual:
+        raise ConflictoVersionError(dataset)
+
+def _version_logica(version):
+    """Con un guardado en cola, los datos los define ese fichero aunque cambie el resto de la firma"""
+    contador, firma = version
+    pendiente = firma[-1]
+    return pendiente if pendiente[1] is not None else version
+
+def version_base_editor(clave_editor, dataset, version_mostrada=None):
+    """Versión del dataset sobre la que el usuario empezó a editar en un st.data_editor.
+    version_mostrada es la de los datos que se pintan en el editor (ver cargar_datasets): si son
+    de reserva y ya hay una versión más nueva, guardar dará conflicto en lugar de pisarla."""
+    clave_version = f"version_base_{clave_editor}"
+    estado = st.session_state.get(clave_editor) or {}
+    sin_cambios = not any(estado.get(k) for k in ("edited_rows", "added_rows", "deleted_rows"))
+    if sin_cambios or clave_version not in st.session_state:
+        st.session_state[clave_version] = version_mostrada if version_mostrada is not None else version_datos(dataset)
+    return st.session_state[clave_version]
+
+# --- ESQUEMA TIPADO DE MOVIMIENTOS ---
+# Todas las fuentes (Google Sheets, CSV, journal, Parquet/Arrow, particiones y SQLite) pasan
+# por _aplicar_esquema, que deja el mismo tipo en cada columna de COLUMNS.
+FORMATO_FECHA = "%d/%m/%Y"
+COLUMNAS_CATEGORICAS = ["Tipo", "Categoría", "Frecuencia"]
+COLUMNAS_IMPORTE = ["Importe", "Impacto_Mensual"]
+
+def _a_bool(serie):
+    """Normaliza booleanos que llegan como bool, 0/1 o "TRUE"/"FALSE" (Google Sheets)"""
+    if pd.api.types.is_bool_dtype(serie):
+        return serie
+    return serie.astype(str).str.upper().isin(["TRUE", "1", "1.0", "VERDADERO"])
+
+def _parsear_fechas(serie):
+    """Fechas con formato fijo dd/mm/aaaa; solo las que no encajan pasan por la inferencia lenta"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.astype("datetime64[ns]")
+    fechas = pd.to_datetime(serie, format=FORMATO_FECHA, errors='coerce')
+    pendientes = fechas.isna() & serie.notna()
+    if pendientes.any():
+        fechas[pendientes] = pd.to_datetime(serie[pendientes], dayfirst=True, errors='coerce')
+    return fechas.astype("datetime64[ns]")
+
+def _a_centimos(serie):
+    """Importes en euros a céntimos enteros (Int64 admite nulos)"""
+    return (pd.to_numeric(serie, errors='coerce') * 100).round().astype("Int64")
+
+def _desde_centimos(df):
+    """Convierte a euros las columnas de importe guardadas en céntimos"""
+    for col in COLUMNAS_IMPORTE:
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = df[col].astype("float64") / 100
+    return df
+
+def _aplicar_esquema(df):
+    """Aplica el esquema tipado de COLUMNS: fechas, categorías, booleano e importes redondeados a
+    céntimos. En memoria los importes siguen siendo euros en float64; solo el almacenamiento
+    columnar los guarda como céntimos enteros."""
+    df = df.reindex(columns=COLUMNS)
+    df['Fecha'] = _parsear_fechas(df['Fecha'])
+    for col in COLUMNAS_CATEGORICAS:
+        df[col] = df[col].astype("category")
+    for col in COLUMNAS_IMPORTE:
+        df[col] = _a_centimos(df[col]).astype("float64") / 100
+    df['Es_Conjunto'] = _a_bool(df['Es_Conjunto'])
+    return df.dropna(subset=['Fecha']).reset_index(drop=True)
+
+@st.cache_resource
+def _informes_carga():
+    """Último informe de carga (tiempo y memoria) por dataset, compartido entre sesiones"""
+    return {}
+
+def _registrar_informe_carga(dataset, origen, inicio, df_bruto, df):
+    _informes_carga()[dataset] = {
+        'origen': origen,
+        'filas': len(df),
+        'segundos': time.perf_counter() - inicio,
+        'memoria_antes': int(df_bruto.memory_usage(deep=True).sum()),
+        'memoria_despues': int(df.memory_usage(deep=True).sum()),
+    }
+
+# --- ALMACENAMIENTO COLUMNAR (PARQUET / ARROW) ---
+def usar_almacenamiento_columnar():
+    """Indica si los movimientos se guardan localmente en Parquet o Arrow IPC"""
+    return PYARROW_AVAILABLE and STORAGE_BACKEND in ("parquet", "arrow")
+
+def _tabla_movimientos(df):
+    """Convierte el DataFrame de movimientos a una tabla Arrow con el esquema tipado"""
+    df_tab = df.reindex(columns=COLUMNS).copy()
+    df_tab['Fecha'] = _parsear_fechas(df_tab['Fecha'])
+    for col in ["Tipo", "Categoría", "Concepto", "Frecuencia"]:
+        df_tab[col] = df_tab[col].astype("string")
+    for col in COLUMNAS_IMPORTE:
+        df_tab[col] = _a_centimos(df_tab[col])
+    df_tab['Es_Conjunto'] = _a_bool(df_tab['Es_Conjunto'])
+    return pa.Table.from_pandas(df_tab, schema=esquema_movimientos(), preserve_index=False)
+
+def _leer_movimientos_columnar():
+    """Lee los movimientos del fichero Parquet/Arrow; None si no existe o no se puede leer"""
+    ruta = PARQUET_FILE_NAME if STORAGE_BACKEND == "parquet" else ARROW_FILE_NAME
+    if not os.path.exists(ruta):
+        return None
+    try:
+        if STORAGE_BACKEND == "parquet":
+            tabla = pq.read_table(ruta)
+        else:
+            tabla = feather.read_table(ruta)
+        df = _desde_centimos(tabla.to_pandas())
+        df['Fecha'] = df['Fecha'].astype("datetime64[ns]")
+        return df.dropna(subset=['Fecha'])
+    except Exception as e:
+        st.warning(f"Error leyendo {ruta}: {str(e)}. Usando archivo CSV.")
+        return None
+
+def _escribir_movimientos_columnar(df):
+    """Escribe los movimientos en Parquet o Arrow IPC según STORAGE_BACKEND"""
+    tabla = _tabla_movimientos(df)
+    if STORAGE_BACKEND == "parquet":
+        _escritura_atomica(PARQUET_FILE_NAME, lambda ruta: pq.write_table(tabla, ruta))
+    else:
+        _escritura_atomica(ARROW_FILE_NAME, lambda ruta: feather.write_feather(tabla, ruta))
+
+# --- ALMACENAMIENTO SQLITE ---
+def usar_sqlite():
+    """Indica si el almacenamiento local es la base SQLite"""
+    return STORAGE_BACKEND == "sqlite"
+
+def consultas_en_sqlite():
+    """Las consultas se pueden resolver en SQL cuando SQLite es la fuente de verdad"""
+    return usar_sqlite() and not sheets_primario()
+
+COLUMNS_HIST = ["Fecha", "Tipo", "Descripcion", "Usuario"]
+COLUMNS_PRES = ["Categoría", "Presupuesto_Mensual"]
+
+ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS movimientos (
+    id INTEGER PRIMARY KEY,
+    "Fecha" TEXT NOT NULL,
+    "Tipo" TEXT,
+    "Categoría" TEXT,
+    "Concepto" TEXT,
+    "Importe" REAL,
+    "Frecuencia" TEXT,
+    "Impacto_Mensual" REAL,
+    "Es_Conjunto" INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_movimientos_fecha ON movimientos("Fecha");
+CREATE INDEX IF NOT EXISTS idx_movimientos_categoria ON movimientos("Categoría");
+CREATE INDEX IF NOT EXISTS idx_movimientos_tipo ON movimientos("Tipo");
+CREATE TABLE IF NOT EXISTS recurrentes (
+    id INTEGER PRIMARY KEY,
+    "Tipo" TEXT,
+    "Categoría" TEXT,
+    "Concepto" TEXT,
+    "Importe" REAL,
+    "Frecuencia" TEXT,
+    "Es_Conjunto" INTEGER
+);
+CREATE TABLE IF NOT EXISTS categorias (
+    id INTEGER PRIMARY KEY,
+    "Categoría" TEXT
+);
+CREATE TABLE IF NOT EXISTS presupuestos (
+    id INTEGER PRIMARY KEY,
+    "Categoría" TEXT,
+    "Presupuesto_Mensual" REAL
+);
+CREATE TABLE IF NOT EXISTS historial (
+    id INTEGER PRIMARY KEY,
+    "Fecha" TEXT,
+    "Tipo" TEXT,
+    "Descripcion" TEXT,
+    "Usuario" TEXT
+);
+CREATE TABLE IF NOT EXISTS versiones (
+    tabla TEXT PRIMARY KEY,
+    n INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+def _columnas_sql(columnas):
+    return ", ".join(f'"{c}"' for c in columnas)
+
+# Versión del esquema en PRAGMA user_version: la importación de los CSV es una migración que se
+# hace una sola vez, no cada vez que una tabla se queda vacía (borrar todos los movimientos no debe
+# resucitar los del CSV antiguo)
+VERSION_ESQUEMA_SQLITE = 1
+
+def _incrementar_contador_sqlite(con, clave):
+    con.execute("INSERT INTO versiones (tabla, n) VALUES (?, 1) ON CONFLICT(tabla) DO UPDATE SET n = n + 1", (clave,))
+
+def _insertar_filas_sqlite(con, tabla, columnas, filas):
+    marcadores = ", ".join("?" for _ in columnas)
+    con.executemany(f"INSERT INTO {tabla} ({_columnas_sql(columnas)}) VALUES ({marcadores})", filas)
+    # Toda escritura pasa por aquí (reemplazar una tabla también inserta): nueva versión de la tabla
+    _incrementar_contador_sqlite(con, tabla)
+
+def _filas_sqlite(df, columnas):
+    """Convierte un DataFrame a filas para SQLite (fechas ISO, booleanos 0/1, NaN -> NULL)"""
+    df_sql = df.reindex(columns=columnas).copy()
+    if "Fecha" in columnas and pd.api.types.is_datetime64_any_dtype(df_sql['Fecha']):
+        df_sql['Fecha'] = df_sql['Fecha'].dt.strftime("%Y-%m-%d")
+    if "Es_Conjunto" in columnas:
+        df_sql['Es_Conjunto'] = _a_bool(df_sql['Es_Conjunto']).astype(int)
+    df_sql = df_sql.astype(object).where(df_sql.notna(), None)
+    return df_sql.values.tolist()
+
+@st.cache_resource
+def _inicializar_sqlite():
+    """Crea el esquema e importa los CSV existentes la primera vez que se usa la base (una base
+    anterior a VERSION_ESQUEMA_SQLITE solo recibe los CSV en las tablas que sigan vacías).
+    Si falla lanza la excepción: st.cache_resource no la guarda y se reintenta en el siguiente uso."""
+    con = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        con.execute("PRAGMA journal_mode=WAL")
+        with con:
+            con.executescript(ESQUEMA_SQLITE)
+            if con.execute("PRAGMA user_version").fetchone()[0] >= VERSION_ESQUEMA_SQLITE:
+                return True
+            if con.execute("SELECT COUNT(*) FROM movimientos").fetchone()[0] == 0 and os.path.exists(FILE_NAME):
+                df = pd.read_csv(FILE_NAME)
+                df['Fecha'] = _parsear_fechas(df['Fecha'])
+                if "Es_Conjunto" not in df.columns: df["Es_Conjunto"] = False
+                _insertar_filas_sqlite(con, "movimientos", COLUMNS, _filas_sqlite(df.dropna(subset=['Fecha']), COLUMNS))
+            for tabla, fichero, columnas in [("recurrentes", REC_FILE_NAME, COLUMNS_REC),
+                                             ("categorias", CAT_FILE_NAME, ["Categoría"]),
+                                             ("presupuestos", PRESUPUESTOS_FILE, COLUMNS_PRES),
+                                             ("historial", HISTORIAL_FILE, COLUMNS_HIST)]:
+                if con.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0] == 0 and os.path.exists(fichero):
+                    _insertar_filas_sqlite(con, tabla, columnas, _filas_sqlite(pd.read_csv(fichero), columnas))
+            con.execute(f"PRAGMA user_version = {VERSION_ESQUEMA_SQLITE}")
+    finally:
+        con.close()
+    return True
+
+@contextmanager
+def _sqlite():
+    """Conexión a la base SQLite dentro de una transacción. Si la base no se puede inicializar
+    lanza el error: seguir con una base sin esquema o sin migrar daría datos vacíos."""
+    _inicializar_sqlite()
+    con = sqlite3.connect(DB_FILE, timeout=30)
+    try:
+        with con:
+            yield con
+    finally:
+        con.close()
+
+def _leer_tabla_sqlite(tabla, columnas):
+    with _sqlite() as con:
+        df = pd.read_sql_query(f"SELECT {_columnas_sql(columnas)} FROM {tabla} ORDER BY id", con)
+    if "Es_Conjunto" in columnas:
+        df['Es_Conjunto'] = df['Es_Conjunto'].fillna(0).astype(bool)
+    return df
+
+def _reemplazar_tabla_sqlite(tabla, columnas, df):
+    with _sqlite() as con:
+        con.execute(f"DELETE FROM {tabla}")
+        _insertar_filas_sqlite(con, tabla, columnas, _filas_sqlite(df, columnas))
+        # Con filas borradas o cambiadas ya no vale leer solo las nuevas (ver _leer_movimientos_sqlite)
+        _incrementar_contador_sqlite(con, f"{tabla}_reescrituras")
+
+@st.cache_resource
+def _marca_movimientos_sqlite():
+    """Última lectura de movimientos de la base (filas, último id leído) y su lock"""
+    return threading.Lock(), {}
+
+def _leer_movimientos_sqlite():
+    """Movimientos de la base. Las altas solo añaden filas con id mayor, así que mientras la tabla
+    no se haya reescrito desde la última lectura solo se leen las filas nuevas."""
+    lock, marca = _marca_movimientos_sqlite()
+    with lock:
+        with _sqlite() as con:
+            # Contador y filas de la misma instantánea de la base
+            con.execute("BEGIN")
+            fila = con.execute("SELECT n FROM versiones WHERE tabla = 'movimientos_reescrituras'").fetchone()
+            clave = (os.path.abspath(DB_FILE), fila[0] if fila else 0)
+            if marca.get('clave') != clave:
+                marca.update(clave=clave, ultimo_id=0, df=None)
+            nuevas = pd.read_sql_query(
+                f'SELECT id, {_columnas_sql(COLUMNS)} FROM movimientos WHERE id > ? ORDER BY id',
+                con, params=(marca['ultimo_id'],)
+            )
+        if marca['df'] is not None and nuevas.empty:
+            return marca['df'].copy(deep=False)
+        if not nuevas.empty:
+            marca['ultimo_id'] = int(nuevas['id'].iloc[-1])
+        nuevas = nuevas.drop(columns='id')
+        nuevas['Fecha'] = pd.to_datetime(nuevas['Fecha'], format="%Y-%m-%d", errors='coerce')
+        nuevas['Es_Conjunto'] = nuevas['Es_Conjunto'].fillna(0).astype(bool)
+        nuevas = nuevas.dropna(subset=['Fecha'])
+        if marca['df'] is not None and not marca['df'].empty:
+            nuevas = pd.concat([marca['df'], nuevas], ignore_index=True)
+        marca['df'] = nuevas
+        return nuevas.copy(deep=False)
+
+# --- CONSULTAS AGREGADAS ---
+def _rango_mes(anio, mes):
+    """Límites [inicio, fin) de un mes en formato ISO"""
+    inicio = datetime(anio, mes, 1)
+    fin = datetime(anio + 1, 1, 1) if mes == 12 else datetime(anio, mes + 1, 1)
+    return inicio.strftime("%Y-%m-%d"), fin.strftime("%Y-%m-%d")
+
+# Resumen materializado: mes × Tipo × Categoría × Frecuencia × Es_Conjunto, más un resumen
+# diario y los mayores gastos. Se construye una vez por proceso y cada alta lo actualiza con
+# solo las filas nuevas, así que las páginas no recorren el histórico completo en cada rerun.
+CLAVES_RESUMEN = ["Mes", "Tipo", "Categoría", "Frecuencia", "Es_Conjunto"]
+MAYORES_GASTOS = 50
+
+def _texto(serie):
+    return serie.astype(object).where(serie.notna(), "").astype(str)
+
+def _agregar_movimientos(df):
+    """Resumen (mensual, diario, mayores gastos) de un conjunto de movimientos"""
+    df = df.reindex(columns=COLUMNS)
+    fechas = pd.to_datetime(df['Fecha'])
+    importe = pd.to_numeric(df['Importe'], errors='coerce').fillna(0.0)
+    base = pd.DataFrame({
+        'Mes': fechas.dt.to_period('M').dt.to_timestamp(),
+        'Dia': fechas.dt.normalize(),
+        'Tipo': _texto(df['Tipo']),
+        'Categoría': _texto(df['Categoría']),
+        'Frecuencia': _texto(df['Frecuencia']),
+        'Es_Conjunto': _a_bool(df['Es_Conjunto']),
+        'Importe': importe,
+        'Importe_2': importe ** 2,
+        'Impacto_Mensual': pd.to_numeric(df['Impacto_Mensual'], errors='coerce').fillna(0.0),
+        'N': 1,
+    })
+    mensual = base.groupby(CLAVES_RESUMEN, as_index=False)[['Importe', 'Importe_2', 'Impacto_Mensual', 'N']].sum()
+    diario = base.groupby(['Dia', 'Tipo'], as_index=False)[['Importe', 'N']].sum()
+    gastos = df[base['Tipo'] == 'Gasto'].assign(Fecha=fechas, Importe=importe)
+    return {'mensual': mensual, 'diario': diario, 'mayores': gastos.nlargest(MAYORES_GASTOS, 'Importe')}
+
+def _agregar_movimientos_sqlite():
+    """Mismo resumen calculado con GROUP BY en la base, sin cargar los movimientos. Sustituye a las
+    consultas de gasto por mes y categoría: se agrega una vez y las altas lo actualizan en memoria."""
+    with _sqlite() as con:
+        mensual = pd.read_sql_query("""
+            SELECT substr("Fecha", 1, 7) AS "Mes", "Tipo", "Categoría", "Frecuencia", "Es_Conjunto",
+                   SUM("Importe") AS "Importe", SUM("Importe" * "Importe") AS "Importe_2",
+                   SUM("Impacto_Mensual") AS "Impacto_Mensual", COUNT(*) AS "N"
+            FROM movimientos GROUP BY 1, 2, 3, 4, 5
+        """, con)
+        diario = pd.read_sql_query("""
+            SELECT substr("Fecha", 1, 10) AS "Dia", "Tipo", SUM("Importe") AS "Importe", COUNT(*) AS "N"
+            FROM movimientos GROUP BY 1, 2
+        """, con)
+        mayores = pd.read_sql_query(
+            f'SELECT {_columnas_sql(COLUMNS)} FROM movimientos WHERE "Tipo" = \'Gasto\' ORDER BY "Importe" DESC LIMIT ?',
+            con, params=(MAYORES_GASTOS,)
+        )
+    mensual['Mes'] = pd.to_datetime(mensual['Mes'], format="%Y-%m")
+    for col in ["Tipo", "Categoría", "Frecuencia"]:
+        mensual[col] = _texto(mensual[col])
+    mensual['Es_Conjunto'] = mensual['Es_Conjunto'].fillna(0).astype(bool)
+    mensual = mensual.groupby(CLAVES_RESUMEN, as_index=False)[['Importe', 'Importe_2', 'Impacto_Mensual', 'N']].sum()
+    diario['Dia'] = pd.to_datetime(diario['Dia'], format="%Y-%m-%d")
+    diario['Tipo'] = _texto(diario['Tipo'])
+    mayores['Fecha'] = pd.to_datetime(mayores['Fecha'], format="%Y-%m-%d", errors='coerce')
+    mayores['Es_Conjunto'] = mayores['Es_Conjunto'].fillna(0).astype(bool)
+    return {'mensual': mensual, 'diario': diario, 'mayores': mayores}
+
+def _combinar_resumenes(actual, nuevo):
+    """Suma el resumen de unas altas al resumen existente"""
+    mensual = pd.concat([actual['mensual'], nuevo['mensual']], ignore_index=True)
+    diario = pd.concat([actual['diario'], nuevo['diario']], ignore_index=True)
+    mayores = pd.concat([actual['mayores'], nuevo['mayores']], ignore_index=True)
+    return {
+        'mensual': mensual.groupby(CLAVES_RESUMEN, as_index=False)[['Importe', 'Importe_2', 'Impacto_Mensual', 'N']].sum(),
+        'diario': diario.groupby(['Dia', 'Tipo'], as_index=False)[['Importe', 'N']].sum(),
+        'mayores': mayores.nlargest(MAYORES_GASTOS, 'Importe'),
+    }
+
+@st.cache_resource
+def _estado_resumen():
+    """Resumen materializado compartido por las sesiones y la clave de lectura (ver clave_lectura) que refleja"""
+    return threading.Lock(), {}
+
+def resumen_movimientos():
+    """Resumen materializado de la versión actual; solo se recalcula entero si otra escritura lo dejó
+    atrás o, con Google Sheets como fuente de verdad, al renovarse la lectura (ver clave_lectura)"""
+    lock, estado = _estado_resumen()
+    with lock:
+        clave = clave_lectura("movimientos")
+        if estado.get('clave') != clave:
+            if consultas_en_sqlite():
+                estado.update(_agregar_movimientos_sqlite())
+            else:
+                estado.update(_agregar_movimientos(load_data()))
+            estado['clave'] = clave
+        return dict(estado)
+
+def _actualizar_resumen(version_anterior, df_nuevos=None):
+    """Tras una escritura bajo el lock: aplica las altas al resumen si estaba al día con version_anterior"""
+    lock, estado = _estado_resumen()
+    with lock:
+        if estado.get('clave', (None, None))[0] != version_anterior:
+            return
+        if df_nuevos is not None and not df_nuevos.empty:
+            # Con el mismo esquema que una carga completa (céntimos, fechas válidas) para que el
+            # resumen incremental no se desvíe del que saldría de recalcularlo entero
+            estado.update(_combinar_resumenes(estado, _agregar_movimientos(_aplicar_esquema(df_nuevos))))
+        estado['clave'] = (version_datos("movimientos"), estado['clave'][1])
+
+def gastos_mes_por_categoria(anio, mes):
+    """Gasto total por categoría en un mes"""
+    mensual = resumen_movimientos()['mensual']
+    mensual = mensual[(mensual['Mes'] == pd.Timestamp(anio, mes, 1)) & (mensual['Tipo'] == 'Gasto')]
+    return mensual.groupby('Categoría')['Importe'].sum().to_dict()
+
+def gastos_por_encima(umbral):
+    """Gastos con un importe mayor que umbral. Los mayores gastos del resumen bastan si alguno
+    no supera el umbral (están todos los que lo superan); si no, puede haber más fuera de la
+    lista y se recorren todos los movimientos (en SQL cuando SQLite es la fuente de verdad)."""
+    mayores = resumen_movimientos()['mayores']
+    if len(mayores) < MAYORES_GASTOS or (mayores['Importe'] <= umbral).any():
+        return mayores[mayores['Importe'] > umbral]
+    if consultas_en_sqlite():
+        with _sqlite() as con:
+            gastos = pd.read_sql_query(
+                f'SELECT {_columnas_sql(COLUMNS)} FROM movimientos WHERE "Tipo" = \'Gasto\' AND "Importe" > ? ORDER BY id',
+                con, params=(float(umbral),)
+            )
+        gastos['Fecha'] = pd.to_datetime(gastos['Fecha'], format="%Y-%m-%d", errors='coerce')
+        gastos['Es_Conjunto'] = gastos['Es_Conjunto'].fillna(0).astype(bool)
+        return gastos.dropna(subset=['Fecha'])
+    df = load_data()
+    return df[(df['Tipo'] == 'Gasto') & (df['Importe'] > umbral)]
+
+# --- ALMACENAMIENTO PARTICIONADO POR MES ---
+def usar_particiones():
+    """Indica si los movimientos se guardan en un fichero por año-mes"""
+    return STORAGE_BACKEND == "particionado"
+
+def _fuente_local():
+    """El almacenamiento local es la fuente de verdad (Google Sheets inactivo o en modo local primero)"""
+    return not sheets_primario()
+
+def _ruta_particion(periodo):
+    extension = "parquet" if PYARROW_AVAILABLE else "csv"
+    return os.path.join(PARTITION_DIR, f"{periodo}.{extension}")
+
+def _periodos_particionados():
+    """Periodos 'YYYY-MM' con partición en disco"""
+    if not os.path.isdir(PARTITION_DIR):
+        return []
+    return sorted(os.path.splitext(f)[0] for f in os.listdir(PARTITION_DIR)
+                  if not f.startswith(".") and (f.endswith(".parquet") or f.endswith(".csv")))
+
+def _leer_particion(periodo):
+    """Lee una partición mensual; None si no existe"""
+    ruta = _ruta_particion(periodo)
+    if not os.path.exists(ruta):
+        return None
+    if PYARROW_AVAILABLE:
+        df = _desde_centimos(pq.read_table(ruta).to_pandas())
+        df['Fecha'] = df['Fecha'].astype("datetime64[ns]")
+    else:
+        df = pd.read_csv(ruta)
+        df['Fecha'] = _parsear_fechas(df['Fecha'])
+    return df.dropna(subset=['Fecha'])
+
+def _escribir_particion(periodo, df):
+    os.makedirs(PARTITION_DIR, exist_ok=True)
+    if PYARROW_AVAILABLE:
+        tabla = _tabla_movimientos(df)
+        _escritura_atomica(_ruta_particion(periodo), lambda ruta: pq.write_table(tabla, ruta))
+    else:
+        df_to_save = df.copy()
+        df_to_save['Fecha'] = df_to_save['Fecha'].dt.strftime("%d/%m/%Y")
+        _escritura_atomica(_ruta_particion(periodo), lambda ruta: df_to_save.to_csv(ruta, index=False))
+
+def _leer_particiones(periodos=None):
+    """Concatena las particiones indicadas (todas si periodos es None)"""
+    existentes = _periodos_particionados()
+    if periodos is not None:
+        existentes = [p for p in existentes if p in periodos]
+    partes = [df for df in (_leer_particion(p) for p in existentes) if df is not None and not df.empty]
+    if not partes:
+        return pd.DataFrame(columns=COLUMNS)
+    return _aplicar_esquema(pd.concat(partes, ignore_index=True))
+
+def _escribir_particiones(df):
+    """Reescribe todas las particiones y elimina las de meses que ya no tienen movimientos"""
+    periodos = df['Fecha'].dt.strftime("%Y-%m")
+    for periodo, df_periodo in df.groupby(periodos, sort=True):
+        _escribir_particion(periodo, df_periodo)
+    for periodo in set(_periodos_particionados()) - set(periodos.unique()):
+        os.remove(_ruta_particion(periodo))
+
+def _anadir_a_particiones(df_nuevos):
+    """Integra movimientos nuevos reescribiendo solo las particiones de sus meses"""
+    for periodo, df_periodo in df_nuevos.groupby(df_nuevos['Fecha'].dt.strftime("%Y-%m")):
+        df_actual = _leer_particion(periodo)
+        if df_actual is not None and not df_actual.empty:
+            df_periodo = pd.concat([df_actual, df_periodo], ignore_index=True)
+        _escribir_particion(periodo, df_periodo)
+
+def cargar_meses(periodos):
+    """Movimientos de los periodos 'YYYY-MM' indicados leyendo solo sus particiones (y el journal)"""
+    return _cargar_meses(tuple(periodos), version_datos("movimientos"))
+
+@st.cache_data(max_entries=16)
+def _cargar_meses(periodos, version):
+    df = _leer_particiones(set(periodos))
+    df_journal = _leer_journal()
+    if df_journal is not None and not df_journal.empty:
+        df_journal = df_journal[df_journal['Fecha'].dt.strftime("%Y-%m").isin(periodos)]
+        if not df_journal.empty:
+            df = df_journal if df.empty else pd.concat([df, df_journal], ignore_index=True)
+    return _aplicar_esquema(df)
+
+def movimientos_del_mes(df, anio, mes):
+    """Movimientos de un mes sin recorrer todo el histórico cuando el almacenamiento lo permite.
+    `df` (todos los movimientos) solo hace falta en los demás casos; si es None se carga."""
+    if usar_particiones() and _fuente_local():
+        return cargar_meses((f"{anio:04d}-{mes:02d}",))
+    if consultas_en_sqlite():
+        inicio, fin = _rango_mes(anio, mes)
+        with _sqlite() as con:
+            df_mes = pd.read_sql_query(
+                f'SELECT {_columnas_sql(COLUMNS)} FROM movimientos WHERE "Fecha" >= ? AND "Fecha" < ? ORDER BY id',
+                con, params=(inicio, fin)
+            )
+        df_mes['Fecha'] = pd.to_datetime(df_mes['Fecha'], format="%Y-%m-%d", errors='coerce')
+        df_mes['Es_Conjunto'] = df_mes['Es_Conjunto'].fillna(0).astype(bool)
+        return _aplicar_esquema(df_mes)
+    if df is None:
+        df = load_data()
+    return df[(df['Fecha'].dt.month == mes) & (df['Fecha'].dt.year == anio)]
+
+def lectura_por_meses():
+    """El almacenamiento permite leer meses sueltos sin cargar el histórico"""
+    return (usar_particiones() and _fuente_local()) or consultas_en_sqlite()
+
+def cargar_meses_recientes():
+    """Movimientos del mes en curso y el anterior, leyendo solo esos meses (ver lectura_por_meses)"""
+    now = datetime.now()
+    anterior = now.replace(day=1) - timedelta(days=1)
+    meses = [(anterior.year, anterior.month), (now.year, now.month)]
+    if usar_particiones() and _fuente_local():
+        return cargar_meses(f"{anio:04d}-{mes:02d}" for anio, mes in meses)
+    return _aplicar_esquema(pd.concat([movimientos_del_mes(None, anio, mes) for anio, mes in meses], ignore_index=True))
+
+# --- VERSIONES DE DATOS Y CACHÉ ---
+# Cada dataset tiene su propia versión: un contador de escrituras compartido por todas las
+# sesiones del proceso más la firma (mtime y tamaño) de sus ficheros locales, que detecta
+# escrituras de otros procesos. Las lecturas cacheadas usan la versión como clave, así que
+# una escritura solo invalida su propio dataset y nunca se vacía la caché global.
+DATASETS = ("movimientos", "recurrentes", "categorias", "presupuestos")
+
+@st.cache_resource
+def _contadores_version():
+    """Contadores de escrituras por dataset y su lock"""
+    return threading.Lock(), {dataset: 0 for dataset in DATASETS}
+
+def _ficheros_dataset(dataset):
+    """Ficheros locales cuyo cambio implica una nueva versión del dataset"""
+    if usar_sqlite():
+        # Su versión sale de la tabla versiones (ver _versiones_sqlite), no de los ficheros
+        return []
+    if dataset == "movimientos":
+        rutas = [FILE_NAME, JOURNAL_FILE]
+        if usar_almacenamiento_columnar():
+            rutas.append(PARQUET_FILE_NAME if STORAGE_BACKEND == "parquet" else ARROW_FILE_NAME)
+        if usar_particiones():
+            rutas += [_ruta_particion(p) for p in _periodos_particionados()]
+        return rutas
+    return {
+        "recurrentes": [REC_FILE_NAME],
+        "categorias": [CAT_FILE_NAME],
+        "presupuestos": [PRESUPUESTOS_FILE],
+    }[dataset]
+
+def _firma_ficheros(rutas):
+    firma = []
+    for ruta in rutas:
+        try:
+            info = os.stat(ruta)
+            firma.append((ruta, info.st_mtime_ns, info.st_size))
+        except OSError:
+            firma.append((ruta, None, None))
+    return tuple(firma)
+
+@st.cache_resource
+def _memo_versiones_sqlite():
+    """Última lectura de la tabla versiones y la firma de la base con la que se hizo"""
+    return threading.Lock(), {}
+
+def _versiones_sqlite():
+    """Versión de cada tabla de la base. finanzas.db es un único fichero para todos los datasets,
+    así que su firma solo indica que algo ha cambiado: entonces se relee la tabla versiones, que
+    cada escritura incrementa para su tabla, y una escritura no invalida los demás datasets."""
+    firma = _firma_ficheros([DB_FILE, DB_FILE + "-wal"])
+    lock, memo = _memo_versiones_sqlite()
+    with lock:
+        if memo.get('firma') == firma:
+            return memo['versiones']
+    with _sqlite() as con:
+        versiones = dict(con.execute("SELECT tabla, n FROM versiones").fetchall())
+    with lock:
+        memo.update(firma=firma, versiones=versiones)
+    return versiones
+
+def version_datos(dataset):
+    """Versión actual de un dataset, usada como clave de las lecturas cacheadas"""
+    lock, contadores = _contadores_version()
+    with lock:
+        contador = contadores[dataset]
+    firma = _firma_ficheros(_ficheros_dataset(dataset) + [_ruta_pendiente(dataset)])
+    if usar_sqlite():
+        firma = ((DB_FILE, dataset, _versiones_sqlite().get(dataset, 0)),) + firma
+    return contador, firma
+
+def clave_lectura(dataset):
+    """Clave de las lecturas cacheadas de un dataset: (versión, tramo). La versión solo recoge las
+    escrituras de esta instancia; con Google Sheets como fuente de verdad el tramo de
+    SHEETS_TTL_LECTURAS segundos hace que las lecturas se renueven. No forma parte de la versión:
+    renovar una lectura no debe dar ConflictoVersionError en un editor abierto."""
+    tramo = int(time.time() // SHEETS_TTL_LECTURAS) if sheets_primario() else None
+    return version_datos(dataset), tramo
+
+def _invalidar_dataset(dataset):
+    """Publica una nueva versión del dataset tras una escritura"""
+    lock, contadores = _contadores_version()
+    with lock:
+        contadores[dataset] += 1
+    descartar_precarga(dataset)
+    if replicacion_activa():
+        marcar_para_replicar(dataset)
 
 # --- FUNCIONES DE DATOS ---
-@st.cache_data
 def load_data():
-    """Carga datos desde Google Sheets o archivo local"""
+    """Carga datos desde Google Sheets o archivo local.
+    Devuelve una vista superficial del libro compartido: con copy-on-write de pandas
+    las modificaciones de una sesión no afectan al resto y no se copia ningún buffer."""
+    clave = clave_lectura("movimientos")
+    df = _libro_compartido(clave)
+    _registrar_lectura_libro(clave, df)
+    return df.copy(deep=False)
+
+@st.cache_resource(max_entries=2)
+def _libro_compartido(clave):
+    """Libro de movimientos inmutable de una versión (ver clave_lectura), compartido sin copias por
+    todas las sesiones. Cada escritura publica una versión nueva; la anterior sigue viva para quien
+    aún la use."""
+    inicio = time.perf_counter()
+    df_bruto, origen = _leer_movimientos()
+    df = _aplicar_esquema(df_bruto)
+    _registrar_informe_carga("movimientos", origen, inicio, df_bruto, df)
+    return df
+
+@st.cache_resource
+def _lecturas_libro():
+    """Sesiones y lecturas servidas por cada versión del libro compartido"""
+    return threading.Lock(), {}
+
+def _id_sesion():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "sin_sesion"
+
+def _registrar_lectura_libro(version, df):
+    lock, lecturas = _lecturas_libro()
+    with lock:
+        if version not in lecturas:
+            # Solo se conserva la versión actual: las anteriores ya no se sirven
+            lecturas.clear()
+            lecturas[version] = {'bytes': int(df.memory_usage(deep=True).sum()), 'sesiones': set(), 'lecturas': 0}
+        lecturas[version]['sesiones'].add(_id_sesion())
+        lecturas[version]['lecturas'] += 1
+
+def informe_memoria_libro():
+    """Memoria del libro compartido frente a una copia por sesión o por rerun"""
+    lock, lecturas = _lecturas_libro()
+    with lock:
+        if not lecturas:
+            return None
+        datos = next(iter(lecturas.values()))
+        return {
+            'bytes': datos['bytes'],
+            'sesiones': len(datos['sesiones']),
+            'lecturas': datos['lecturas'],
+            'ahorro_sesiones': datos['bytes'] * (len(datos['sesiones']) - 1),
+            'ahorro_copias': datos['bytes'] * (datos['lecturas'] - 1),
+        }
+
+def _leer_movimientos():
+    """Lee los movimientos sin tipar; devuelve (DataFrame, origen)"""
+    # Un guardado pendiente en la cola es la versión más reciente
+    pendiente = _leer_pendiente("movimientos")
+    if pendiente is not None:
+        return pendiente, "cola de escritura"
+    
     # Intentar cargar desde Google Sheets primero
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    if sheets_primario():
+        valores = valores_precargados("movimientos")
+        if valores is not None:
+            return registrar_valores(SHEET_FINANZAS, COLUMNS, valores), "Google Sheets"
         sheet = get_google_sheet()
         if sheet:
             try:
                 worksheet = get_or_create_worksheet(sheet, SHEET_FINANZAS, COLUMNS)
                 if worksheet:
-                    records = worksheet.get_all_records()
-                    if records:
-                        df = pd.DataFrame(records)
-                        df['Fecha'] = pd.to_datetime(df['Fecha'], dayfirst=True, errors='coerce')
-                        if "Es_Conjunto" not in df.columns: 
-                            df["Es_Conjunto"] = False
-                        return df.dropna(subset=['Fecha']).copy()
-                    else:
-                        # Si está vacía, retornar DataFrame vacío
-                        return pd.DataFrame(columns=COLUMNS)
+                    # Solo se descargan las filas añadidas desde la última lectura
+                    return leer_hoja_incremental(worksheet, COLUMNS), "Google Sheets"
             except Exception as e:
+                _tras_error_sheets(e)
                 st.warning(f"Error cargando desde Google Sheets: {str(e)}. Usando archivo local.")
     
+    # Fallback: fichero local + altas pendientes en el journal
+    df = _cargar_base_local()
+    df_journal = _leer_journal()
+    if df_journal is not None and not df_journal.empty:
+        df = df_journal if df.empty else pd.concat([df, df_journal], ignore_index=True)
+    return df, STORAGE_BACKEND
+
+def _cargar_base_local():
+    """Carga el fichero base de movimientos (SQLite, particiones, columnar o CSV), sin el journal"""
+    if usar_sqlite():
+        return _leer_movimientos_sqlite()
+    
+    if usar_particiones() and os.path.isdir(PARTITION_DIR):
+        return _leer_particiones()
+    
+    # Fallback: cargar desde almacenamiento columnar si está configurado
+    if usar_almacenamiento_columnar():
+        df = _leer_movimientos_columnar()
+        if df is not None:
+            return df
+    
     # Fallback: cargar desde archivo local
     if os.path.exists(FILE_NAME):
         try:
             df = pd.read_csv(FILE_NAME)
-            df['Fecha'] = pd.to_datetime(df['Fecha'], dayfirst=True, errors='coerce')
+            df['Fecha'] = _parsear_fechas(df['Fecha'])
             if "Es_Conjunto" not in df.columns: df["Es_Conjunto"] = False
-            return df.dropna(subset=['Fecha'])
+            df = df.dropna(subset=['Fecha'])
+            # Migración: la primera carga desde CSV genera el fichero columnar o las particiones
+            if usar_almacenamiento_columnar():
+                _escribir_movimientos_columnar(df)
+            elif usar_particiones():
+                _escribir_particiones(df)
+            return df
         except: pass
     return pd.DataFrame(columns=COLUMNS)
 
-def save_all_data(df):
-    """Guarda datos en Google Sheets o archivo local"""
+def _escribir_base_local(df):
+    """Reescribe el fichero base de movimientos (SQLite, particiones, columnar o CSV)"""
+    if usar_sqlite():
+        _reemplazar_tabla_sqlite("movimientos", COLUMNS, df)
+        return
+    if usar_particiones():
+        _escribir_particiones(df)
+        return
+    if usar_almacenamiento_columnar():
+        _escribir_movimientos_columnar(df)
+        return
     df_to_save = df.copy()
     df_to_save['Fecha'] = df_to_save['Fecha'].dt.strftime("%d/%m/%Y")
-    
+    _escritura_atomica(FILE_NAME, lambda ruta: df_to_save.to_csv(ruta, index=False))
+
+def save_all_data(df, version_esperada=None):
+    """Guarda datos en Google Sheets o archivo local.
+    Con version_esperada lanza ConflictoVersionError si otra sesión ha guardado antes."""
+    _persistir("movimientos", df, version_esperada)
+
+def _exigir_sheets(respaldo_local):
+    """Al volcar la cola (sin respaldo local) con Sheets como fuente principal, no poder guardar en él
+    es un error: el guardado sigue en cola y se reintenta, no acaba en un fichero local que nadie lee"""
+    if not respaldo_local and sheets_primario():
+        raise ConnectionError("Google Sheets no está disponible")
+
+def _guardar_movimientos(df, respaldo_local=True):
     # Intentar guardar en Google Sheets primero
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    if sheets_primario():
         sheet = get_google_sheet()
         if sheet:
             try:
                 worksheet = get_or_create_worksheet(sheet, SHEET_FINANZAS, COLUMNS)
                 if worksheet:
-                    # Limpiar hoja y escribir nuevos datos
-                    worksheet.clear()
-                    worksheet.append_row(COLUMNS)
-                    
-                    # Convertir DataFrame a lista de listas
-                    for _, row in df_to_save.iterrows():
-                        worksheet.append_row(row.tolist())
-                    
-                    st.cache_data.clear()
+                    # Solo se envían las filas que han cambiado desde la última sincronización
+                    filas = _filas_para_hoja(df)
+                    sincronizar_hoja(worksheet, COLUMNS, filas)
+                    marcar_hoja(SHEET_FINANZAS, COLUMNS, filas, pd.DataFrame(filas, columns=COLUMNS), lectura_completa=False)
+                    _invalidar_dataset("movimientos")
                     return
             except Exception as e:
+                _tras_error_sheets(e)
+                if not respaldo_local:
+                    raise
                 st.warning(f"Error guardando en Google Sheets: {str(e)}. Guardando en archivo local.")
     
-    # Fallback: guardar en archivo local
-    df_to_save.to_csv(FILE_NAME, index=False)
+    _exigir_sheets(respaldo_local)
+    # Fallback: guardar en archivo local. El DataFrame ya incluye las altas del journal
+    _escribir_base_local(df)
+    if os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+    _invalidar_dataset("movimientos")
+
+# --- JOURNAL DE ALTAS (SOLO AÑADIR) ---
+def _filas_para_hoja(df):
+    """Convierte movimientos a filas de valores serializables para Google Sheets"""
+    df_filas = df.reindex(columns=COLUMNS).copy()
+    df_filas['Fecha'] = pd.to_datetime(df_filas['Fecha']).dt.strftime("%d/%m/%Y")
+    return _valores_hoja(df_filas, COLUMNS)
+
+def _leer_journal():
+    """Lee las altas pendientes de compactar; None si no hay journal"""
+    if not os.path.exists(JOURNAL_FILE):
+        return None
+    try:
+        df = pd.read_csv(JOURNAL_FILE)
+        df['Fecha'] = _parsear_fechas(df['Fecha'])
+        return df.dropna(subset=['Fecha'])
+    except Exception as e:
+        st.warning(f"Error leyendo el journal de movimientos: {str(e)}")
+        return None
+
+def append_movimientos(df_nuevos):
+    """Añade movimientos nuevos sin reescribir el histórico completo; devuelve False si no se han guardado"""
+    df_nuevos = df_nuevos.reindex(columns=COLUMNS)
+    with _lock_cola():
+        version_anterior = version_datos("movimientos")
+        pendiente = _leer_pendiente("movimientos")
+        if pendiente is not None:
+            # Hay un guardado completo en cola: las altas se suman a él para no perderse al volcarlo
+            _encolar("movimientos", pd.concat([pendiente, df_nuevos], ignore_index=True))
+        else:
+            with _bloqueo_escritura():
+                if not _anadir_movimientos(df_nuevos):
+                    return False
+        _actualizar_resumen(version_anterior, df_nuevos)
+    
+    # Compactar en segundo plano al superar el umbral (un solo hilo a la vez)
+    if _contar_journal() >= JOURNAL_COMPACT_THRESHOLD and _lock_compactacion().acquire(blocking=False):
+        threading.Thread(target=_compactar_en_segundo_plano, daemon=True).start()
+    return True
+
+@st.cache_resource
+def _lock_compactacion():
+    """Ocupado mientras hay una compactación en marcha: las altas siguientes no lanzan otra"""
+    return threading.Lock()
+
+def _compactar_en_segundo_plano():
+    try:
+        compactar_journal()
+    finally:
+        _lock_compactacion().release()
+
+def _anadir_movimientos(df_nuevos):
+    """Guarda las altas; devuelve False si no se han podido guardar"""
+    # En Google Sheets basta con una única llamada append_rows. Si falla no se recurre al journal:
+    # con Sheets como fuente principal nadie lo lee y el alta desaparecería sin aviso.
+    if sheets_primario():
+        try:
+            sheet = get_google_sheet()
+            worksheet = get_or_create_worksheet(sheet, SHEET_FINANZAS, COLUMNS) if sheet else None
+            if worksheet is None:
+                raise ConnectionError("Google Sheets no está disponible")
+            filas = _filas_para_hoja(df_nuevos)
+            worksheet.append_rows(filas)
+            _tras_cambio_de_filas(worksheet.title)
+            if SHEET_FINANZAS in _instantaneas_hojas():
+                _instantaneas_hojas()[SHEET_FINANZAS] += _normalizar_filas(filas)
+            _invalidar_dataset("movimientos")
+            return True
+        except Exception as e:
+            _tras_error_sheets(e)
+            st.error(f"Error añadiendo en Google Sheets: {str(e)}. El movimiento no se ha guardado, inténtalo de nuevo.")
+            return False
+    
+    # SQLite: las altas son simples INSERT
+    if usar_sqlite():
+        with _sqlite() as con:
+            _insertar_filas_sqlite(con, "movimientos", COLUMNS, _filas_sqlite(df_nuevos, COLUMNS))
+        _invalidar_dataset("movimientos")
+        return True
+    
+    # Local: añadir al final del journal, O(altas) en lugar de O(histórico)
+    df_journal = df_nuevos.copy()
+    df_journal['Fecha'] = pd.to_datetime(df_journal['Fecha']).dt.strftime("%d/%m/%Y")
+    nuevo = not os.path.exists(JOURNAL_FILE)
+    _anadir_a_fichero(JOURNAL_FILE, df_journal.to_csv(header=nuevo, index=False))
+    _invalidar_dataset("movimientos")
+    return True
+
+def _contar_journal():
+    """Número de altas en el journal sin parsearlo"""
+    if not os.path.exists(JOURNAL_FILE):
+        return 0
+    with open(JOURNAL_FILE, 'rb') as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+def compactar_journal():
+    """Integra el journal en el fichero base y lo elimina"""
+    with _bloqueo_escritura():
+        df_journal = _leer_journal()
+        if df_journal is None:
+            return
+        version_anterior = version_datos("movimientos")
+        if usar_particiones():
+            # Solo se reescriben las particiones de los meses con altas nuevas
+            _anadir_a_particiones(df_journal)
+        else:
+            df_base = _cargar_base_local()
+            df = df_journal if df_base.empty else pd.concat([df_base, df_journal], ignore_index=True)
+            _escribir_base_local(df)
+        os.remove(JOURNAL_FILE)
+        # Los datos no cambian: el resumen sigue siendo válido para la versión compactada y un
+        # editor abierto sobre la anterior puede guardar sin conflicto
+        _alias_versiones()[("movimientos", _version_logica(version_anterior))] = version_datos("movimientos")
+        _actualizar_resumen(version_anterior)
 
 def load_recurrentes():
     """Carga gastos recurrentes desde Google Sheets o archivo local"""
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    return _load_recurrentes(clave_lectura("recurrentes"))
+
+def _df_recurrentes(records):
+    df = pd.DataFrame(records)
+    if "Es_Conjunto" in df.columns:
+        df['Es_Conjunto'] = _a_bool(df['Es_Conjunto'])
+    return df
+
+@st.cache_data(max_entries=4)
+def _load_recurrentes(clave):
+    pendiente = _leer_pendiente("recurrentes")
+    if pendiente is not None:
+        return pendiente
+    
+    if sheets_primario():
+        records = registros_precargados("recurrentes")
+        if records is not None:
+            return _df_recurrentes(records)
         sheet = get_google_sheet()
         if sheet:
             try:
@@ -1764,40 +1944,63 @@ def load_recurrentes():
                 if worksheet:
                     records = worksheet.get_all_records()
                     if records:
-                        return pd.DataFrame(records)
+                        return _df_recurrentes(records)
                     else:
                         worksheet.append_row(COLUMNS_REC)
             except Exception as e:
+                _tras_error_sheets(e)
                 st.warning(f"Error cargando recurrentes desde Google Sheets: {str(e)}")
     
+    if usar_sqlite():
+        return _leer_tabla_sqlite("recurrentes", COLUMNS_REC)
+    
     if os.path.exists(REC_FILE_NAME):
         try: return pd.read_csv(REC_FILE_NAME)
         except: pass
     return pd.DataFrame(columns=COLUMNS_REC)
 
-def save_recurrentes(df):
+def save_recurrentes(df, version_esperada=None):
     """Guarda gastos recurrentes en Google Sheets o archivo local"""
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    _persistir("recurrentes", df, version_esperada)
+
+def _guardar_recurrentes(df, respaldo_local=True):
+    if sheets_primario():
         sheet = get_google_sheet()
         if sheet:
             try:
                 worksheet = get_or_create_worksheet(sheet, SHEET_RECURRENTES, COLUMNS_REC)
                 if worksheet:
-                    worksheet.clear()
-                    worksheet.append_row(COLUMNS_REC)
-                    for _, row in df.iterrows():
-                        worksheet.append_row(row.tolist())
+                    escribir_hoja(worksheet, COLUMNS_REC, _valores_hoja(df, COLUMNS_REC))
+                    _invalidar_dataset("recurrentes")
                     return
             except Exception as e:
+                _tras_error_sheets(e)
+                if not respaldo_local:
+                    raise
                 st.warning(f"Error guardando recurrentes en Google Sheets: {str(e)}")
     
-    df.to_csv(REC_FILE_NAME, index=False)
+    _exigir_sheets(respaldo_local)
+    if usar_sqlite():
+        _reemplazar_tabla_sqlite("recurrentes", COLUMNS_REC, df)
+    else:
+        _escritura_atomica(REC_FILE_NAME, lambda ruta: df.to_csv(ruta, index=False))
+    _invalidar_dataset("recurrentes")
 
 def load_categories():
     """Carga categorías desde Google Sheets o archivo local"""
+    return _load_categories(clave_lectura("categorias"))
+
+@st.cache_data(max_entries=4)
+def _load_categories(clave):
     default = ["Vivienda", "Transporte", "Comida", "Seguros", "Ahorro", "Ingresos", "Otros"]
-    
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    pendiente = _leer_pendiente("categorias")
+    if pendiente is not None:
+        return pendiente
+    
+    if sheets_primario():
+        records = registros_precargados("categorias")
+        if records is not None:
+            return [r['Categoría'] for r in records if r.get('Categoría')]
         sheet = get_google_sheet()
         if sheet:
             try:
@@ -1808,12 +2011,17 @@ def load_categories():
                         return [r['Categoría'] for r in records if r.get('Categoría')]
                     else:
                         # Inicializar con categorías por defecto
-                        for cat in default:
-                            worksheet.append_row([cat])
+                        escribir_hoja(worksheet, ["Categoría"], [[cat] for cat in default])
                         return default
             except Exception as e:
+                _tras_error_sheets(e)
                 st.warning(f"Error cargando categorías desde Google Sheets: {str(e)}")
     
+    if usar_sqlite():
+        df = _leer_tabla_sqlite("categorias", ["Categoría"])
+        if not df.empty: return df['Categoría'].tolist()
+        return default
+    
     if os.path.exists(CAT_FILE_NAME):
         try:
             df = pd.read_csv(CAT_FILE_NAME)
@@ -1823,25 +2031,32 @@ def load_categories():
 
 def save_categories(lista):
     """Guarda categorías en Google Sheets o archivo local"""
+    _persistir("categorias", list(dict.fromkeys(lista)))
+
+def _guardar_categorias(lista, respaldo_local=True):
     lista = list(dict.fromkeys(lista)) 
     
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    if sheets_primario():
         sheet = get_google_sheet()
         if sheet:
             try:
                 worksheet = get_or_create_worksheet(sheet, SHEET_CATEGORIAS, ["Categoría"])
                 if worksheet:
-                    worksheet.clear()
-                    worksheet.append_row(["Categoría"])
-                    for cat in lista:
-                        worksheet.append_row([cat])
-                    st.cache_data.clear()
+                    escribir_hoja(worksheet, ["Categoría"], [[cat] for cat in lista])
+                    _invalidar_dataset("categorias")
                     return
             except Exception as e:
+                _tras_error_sheets(e)
+                if not respaldo_local:
+                    raise
                 st.warning(f"Error guardando categorías en Google Sheets: {str(e)}")
     
-    pd.DataFrame({"Categoría": lista}).to_csv(CAT_FILE_NAME, index=False)
-    st.cache_data.clear()
+    _exigir_sheets(respaldo_local)
+    if usar_sqlite():
+        _reemplazar_tabla_sqlite("categorias", ["Categoría"], pd.DataFrame({"Categoría": lista}))
+    else:
+        _escritura_atomica(CAT_FILE_NAME, lambda ruta: pd.DataFrame({"Categoría": lista}).to_csv(ruta, index=False))
+    _invalidar_dataset("categorias")
 
 def formatear_periodo_es(fecha_dt):
     if isinstance(fecha_dt, str):
@@ -1852,7 +2067,18 @@ def formatear_periodo_es(fecha_dt):
 # --- FUNCIONES DE PRESUPUESTOS ---
 def load_presupuestos():
     """Carga presupuestos mensuales por categoría"""
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    return _load_presupuestos(clave_lectura("presupuestos"))
+
+@st.cache_data(max_entries=4)
+def _load_presupuestos(clave):
+    pendiente = _leer_pendiente("presupuestos")
+    if pendiente is not None:
+        return pendiente
+    
+    if sheets_primario():
+        records = registros_precargados("presupuestos")
+        if records is not None:
+            return pd.DataFrame(records)
         sheet = get_google_sheet()
         if sheet:
             try:
@@ -1861,7 +2087,11 @@ def load_presupuestos():
                     records = worksheet.get_all_records()
                     if records:
                         return pd.DataFrame(records)
-            except: pass
+            except Exception as e:
+                _tras_error_sheets(e)
+    
+    if usar_sqlite():
+        return _leer_tabla_sqlite("presupuestos", COLUMNS_PRES)
     
     if os.path.exists(PRESUPUESTOS_FILE):
         try:
@@ -1869,22 +2099,406 @@ def load_presupuestos():
         except: pass
     return pd.DataFrame(columns=["Categoría", "Presupuesto_Mensual"])
 
-def save_presupuestos(df_pres):
+def save_presupuestos(df_pres, version_esperada=None):
     """Guarda presupuestos"""
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    _persistir("presupuestos", df_pres, version_esperada)
+
+def _guardar_presupuestos(df_pres, respaldo_local=True):
+    if sheets_primario():
         sheet = get_google_sheet()
         if sheet:
             try:
                 worksheet = get_or_create_worksheet(sheet, "Presupuestos", ["Categoría", "Presupuesto_Mensual"])
                 if worksheet:
-                    worksheet.clear()
-                    worksheet.append_row(["Categoría", "Presupuesto_Mensual"])
-                    for _, row in df_pres.iterrows():
-                        worksheet.append_row([row['Categoría'], row['Presupuesto_Mensual']])
+                    escribir_hoja(worksheet, COLUMNS_PRES, _valores_hoja(df_pres, COLUMNS_PRES))
+                    _invalidar_dataset("presupuestos")
                     return
-            except: pass
-    
-    df_pres.to_csv(PRESUPUESTOS_FILE, index=False)
+            except Exception as e:
+                _tras_error_sheets(e)
+                if not respaldo_local:
+                    raise
+                st.warning(f"Error guardando presupuestos en Google Sheets: {str(e)}")
+    
+    _exigir_sheets(respaldo_local)
+    if usar_sqlite():
+        _reemplazar_tabla_sqlite("presupuestos", COLUMNS_PRES, df_pres)
+    else:
+        _escritura_atomica(PRESUPUESTOS_FILE, lambda ruta: df_pres.to_csv(ruta, index=False))
+    _invalidar_dataset("presupuestos")
+
+# --- CARGA INICIAL EN PARALELO ---
+@st.cache_resource
+def _pool_carga():
+    """Hilos compartidos por todas las sesiones para la carga inicial"""
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="carga")
+
+@st.cache_resource
+def _ultima_carga():
+    """Último valor cargado de cada dataset y su versión, de reserva si una carga supera CARGA_TIMEOUT"""
+    return {}
+
+def cargar_datasets(solo_meses_recientes=False):
+    """Ejecuta los cargadores a la vez: la primera pintura espera a la fuente más lenta, no a la
+    suma de todas. Si alguno supera CARGA_TIMEOUT se usa su última carga (y sigue cargando en
+    segundo plano para el siguiente rerun). Si no la hay (arranque en frío) se le espera sin
+    límite, con un aviso en pantalla: no hay datos que mostrar en su lugar y una página vacía
+    invitaría a guardar encima.
+    Devuelve (datos, versiones): la versión de cada dataset es la de los datos devueltos (tomada
+    antes de cargarlos), también cuando son los de reserva. Los editores parten de ella para que
+    guardar sobre datos viejos dé ConflictoVersionError en lugar de pisar los nuevos.
+    Con solo_meses_recientes los movimientos son solo los del mes en curso y el anterior, si el
+    almacenamiento permite leerlos sin cargar el histórico (ver cargar_meses_recientes)."""
+    recientes = solo_meses_recientes and lectura_por_meses()
+    cargadores = {
+        "movimientos": cargar_meses_recientes if recientes else load_data,
+        "recurrentes": load_recurrentes,
+        "categorias": load_categories,
+        "presupuestos": load_presupuestos,
+    }
+    # La reserva de los meses recientes no debe servir como histórico completo (ni al revés)
+    claves_reserva = {dataset: dataset for dataset in cargadores}
+    if recientes:
+        claves_reserva["movimientos"] = "movimientos_recientes"
+    ctx = get_script_run_ctx()
+    tiempos = {}
+
+    def ejecutar(dataset, cargar):
+        # Con el contexto de la sesión los avisos de los cargadores se muestran en la página
+        add_script_run_ctx(threading.current_thread(), ctx)
+        inicio_carga = time.perf_counter()
+        try:
+            version = version_datos(dataset)
+            return cargar(), version
+        finally:
+            tiempos[dataset] = time.perf_counter() - inicio_carga
+            # Los hilos del pool se reutilizan: no deben quedarse con el contexto de esta sesión
+            # (add_script_run_ctx no permite soltarlo, con None vuelve a poner el actual)
+            setattr(threading.current_thread(), SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+
+    inicio = time.perf_counter()
+    futuros = {dataset: _pool_carga().submit(ejecutar, dataset, cargar) for dataset, cargar in cargadores.items()}
+    wait(futuros.values(), timeout=CARGA_TIMEOUT)
+    reserva = _ultima_carga()
+    datos, versiones, retrasados = {}, {}, []
+    for dataset, futuro in futuros.items():
+        clave = claves_reserva[dataset]
+        if not futuro.done() and clave in reserva:
+            valor, versiones[dataset] = reserva[clave]
+            datos[dataset] = valor.copy(deep=False) if isinstance(valor, pd.DataFrame) else list(valor)
+            retrasados.append(dataset)
+            continue
+        if not futuro.done():
+            with st.spinner(f"Cargando {dataset}…"):
+                futuro.result()
+        reserva[clave] = futuro.result()
+        datos[dataset], versiones[dataset] = reserva[clave]
+    if retrasados:
+        st.warning(f"⏳ La carga de {', '.join(retrasados)} está tardando más de {CARGA_TIMEOUT:.0f} s; "
+                   "se muestran los últimos datos cargados.")
+    _informes_carga()["arranque"] = {
+        'total': time.perf_counter() - inicio,
+        'tiempos': dict(tiempos),
+        'retrasados': retrasados,
+    }
+    return datos, versiones
+
+# --- ESCRITURA EN SEGUNDO PLANO (WRITE-BEHIND) ---
+# Los guardados completos se dejan en una cola en disco (un fichero por dataset con la última
+# versión, así que varios guardados seguidos se fusionan) y un hilo los vuelca al almacenamiento.
+# Las lecturas dan prioridad a la cola, de modo que la sesión ve sus cambios al instante.
+def _guardadores():
+    return {
+        "movimientos": _guardar_movimientos,
+        "recurrentes": _guardar_recurrentes,
+        "categorias": _guardar_categorias,
+        "presupuestos": _guardar_presupuestos,
+    }
+
+def _ruta_pendiente(dataset):
+    return os.path.join(COLA_ESCRITURAS_DIR, f"{dataset}.pkl")
+
+def _leer_pendiente(dataset):
+    """Último guardado pendiente de volcar; None si no hay"""
+    ruta = _ruta_pendiente(dataset)
+    if not os.path.exists(ruta):
+        return None
+    try:
+        return pd.read_pickle(ruta)
+    except Exception as e:
+        st.warning(f"Error leyendo la cola de escritura de {dataset}: {str(e)}")
+        return None
+
+def _lock_cola():
+    """Lock de la cola, independiente del de escritura para no bloquear encolados durante un volcado"""
+    return _bloqueo_fichero(LOCK_COLA_FILE)
+
+@st.cache_resource
+def _alias_versiones():
+    """(dataset, versión lógica) -> versión con los mismos datos tras volcar la cola o compactar el journal"""
+    return {}
+
+@st.cache_resource
+def _estado_escritor():
+    return {'ultimo_volcado': None, 'error': None}
+
+def _encolar(dataset, datos):
+    os.makedirs(COLA_ESCRITURAS_DIR, exist_ok=True)
+    _escritura_atomica(_ruta_pendiente(dataset), lambda ruta: pd.to_pickle(datos, ruta))
+    _invalidar_dataset(dataset)
+    _escritor_segundo_plano().set()
+
+def _persistir(dataset, datos, version_esperada=None):
+    """Guarda un dataset completo: en la cola si la escritura diferida está activa, si no al momento"""
+    if ESCRITURA_DIFERIDA:
+        with _lock_cola():
+            _comprobar_version(dataset, version_esperada)
+            _encolar(dataset, datos)
+        return
+    with _bloqueo_escritura():
+        _comprobar_version(dataset, version_esperada)
+        _guardadores()[dataset](datos)
+
+def volcar_cola_escrituras():
+    """Vuelca al almacenamiento los guardados pendientes; devuelve True si la cola queda vacía"""
+    estado = _estado_escritor()
+    for dataset, guardar in _guardadores().items():
+        ruta = _ruta_pendiente(dataset)
+        with _lock_cola():
+            if not os.path.exists(ruta):
+                continue
+            firma = _firma_ficheros([ruta])
+            datos = pd.read_pickle(ruta)
+            version_cola = version_datos(dataset)
+        try:
+            with _bloqueo_escritura():
+                guardar(datos, respaldo_local=False)
+        except Exception as e:
+            estado['error'] = f"{dataset}: {str(e)}"
+            return False
+        with _lock_cola():
+            # Si entretanto se encoló otro guardado, se vuelca en la siguiente pasada
+            if _firma_ficheros([ruta]) == firma:
+                os.remove(ruta)
+                _alias_versiones()[(dataset, firma[0])] = version_datos(dataset)
+                if dataset == "movimientos":
+                    _actualizar_resumen(version_cola)
+        estado['ultimo_volcado'] = datetime.now()
+        estado['error'] = None
+    return estado_escrituras()['pendientes'] == []
+
+def estado_escrituras():
+    """Datasets pendientes de volcar, último volcado y último error del escritor"""
+    estado = _estado_escritor()
+    return {
+        'pendientes': [d for d in _guardadores() if os.path.exists(_ruta_pendiente(d))],
+        'ultimo_volcado': estado['ultimo_volcado'],
+        'error': estado['error'],
+    }
+
+def _bucle_escritor(despertar):
+    while True:
+        despertar.wait(timeout=5)
+        despertar.clear()
+        try:
+            if not volcar_cola_escrituras():
+                if _estado_escritor()['error']:
+                    time.sleep(5)  # reintento tras un error
+                else:
+                    despertar.set()  # se encoló algo durante el volcado
+        except Exception as e:
+            _estado_escritor()['error'] = str(e)
+
+def _volcar_al_salir():
+    """Hook de cierre: intenta vaciar la cola antes de que termine el proceso"""
+    for _ in range(3):
+        if volcar_cola_escrituras():
+            return
+
+@st.cache_resource
+def _escritor_segundo_plano():
+    """Arranca una vez por proceso el hilo escritor; también vuelca lo que quedó en cola al reiniciar"""
+    despertar = threading.Event()
+    threading.Thread(target=_bucle_escritor, args=(despertar,), daemon=True).start()
+    atexit.register(_volcar_al_salir)
+    despertar.set()
+    return despertar
+
+# --- REPLICACIÓN EN GOOGLE SHEETS (MODO LOCAL PRIMERO) ---
+# Cada escritura local marca el dataset como pendiente en REPLICACION_FILE (sobrevive a reinicios)
+# y un hilo envía a Sheets su estado local completo. La sincronización por diferencias hace que
+# solo viajen las filas cambiadas; si Sheets falla se reintenta con espera exponencial.
+def _leer_replicacion():
+    """dataset -> {desde, cambios, intentos, proximo, error} de los datasets sin replicar"""
+    if not os.path.exists(REPLICACION_FILE):
+        return {}
+    try:
+        with open(REPLICACION_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _escribir_replicacion(pendientes):
+    def escribir(ruta):
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(pendientes, f)
+    _escritura_atomica(REPLICACION_FILE, escribir)
+
+@st.cache_resource
+def _estado_replicador():
+    return {'despertar': None, 'ultima': None, 'huellas': {}}
+
+def marcar_para_replicar(dataset):
+    """Anota que el dataset ha cambiado en local y despierta al replicador"""
+    with _bloqueo_fichero(LOCK_REPLICACION_FILE):
+        pendientes = _leer_replicacion()
+        entrada = pendientes.setdefault(dataset, {
+            'desde': time.time(), 'cambios': 0, 'intentos': 0, 'proximo': 0, 'error': None
+        })
+        # No se reinicia la espera: escribir mientras Sheets falla no acelera los reintentos
+        entrada['cambios'] += 1
+        _escribir_replicacion(pendientes)
+    despertar = _estado_replicador()['despertar']
+    if despertar:
+        despertar.set()
+
+def _filas_replicables(dataset):
+    """(hoja, cabecera, filas) con el estado local actual del dataset"""
+    if dataset == "movimientos":
+        return SHEET_FINANZAS, COLUMNS, _filas_para_hoja(_libro_compartido(clave_lectura("movimientos")))
+    if dataset == "recurrentes":
+        return SHEET_RECURRENTES, COLUMNS_REC, _valores_hoja(load_recurrentes(), COLUMNS_REC)
+    if dataset == "categorias":
+        return SHEET_CATEGORIAS, ["Categoría"], [[cat] for cat in load_categories()]
+    return "Presupuestos", COLUMNS_PRES, _valores_hoja(load_presupuestos(), COLUMNS_PRES)
+
+def _replicar_dataset(dataset):
+    hoja, cabecera, filas = _filas_replicables(dataset)
+    huellas = _estado_replicador()['huellas']
+    huella = _hash_filas(filas)
+    if huellas.get(dataset) == huella:
+        return  # Sheets ya tiene este contenido
+    sheet = get_google_sheet()
+    if not sheet:
+        # No cachear la falta de conexión: el siguiente reintento vuelve a conectar
+        get_google_sheet.clear()
+        raise RuntimeError("sin conexión con Google Sheets")
+    worksheet = get_or_create_worksheet(sheet, hoja, cabecera)
+    if not worksheet:
+        raise RuntimeError(f"no se pudo abrir la hoja {hoja}")
+    try:
+        sincronizar_hoja(worksheet, cabecera, filas)
+    except Exception as e:
+        _tras_error_sheets(e)
+        raise
+    huellas[dataset] = huella
+
+def replicar_pendientes():
+    """Replica los datasets cuyo reintento ya toca; devuelve segundos hasta el siguiente o None"""
+    with _bloqueo_fichero(LOCK_REPLICACION_FILE):
+        pendientes = _leer_replicacion()
+    for dataset, entrada in pendientes.items():
+        if entrada['proximo'] > time.time():
+            continue
+        inicio = time.time()
+        try:
+            _replicar_dataset(dataset)
+            error = None
+        except Exception as e:
+            error = str(e)
+        with _bloqueo_fichero(LOCK_REPLICACION_FILE):
+            actuales = _leer_replicacion()
+            actual = actuales.get(dataset)
+            if actual is None:
+                continue
+            if error is None:
+                if actual['cambios'] == entrada['cambios']:
+                    del actuales[dataset]
+                else:
+                    # Hubo escrituras durante el envío: siguen pendientes desde que empezó
+                    actual.update(desde=inicio, intentos=0, proximo=0, error=None)
+                _estado_replicador()['ultima'] = datetime.now()
+            else:
+                actual['intentos'] += 1
+                espera = min(REPLICACION_ESPERA_BASE * 2 ** (actual['intentos'] - 1), REPLICACION_ESPERA_MAX)
+                actual['proximo'] = time.time() + espera * random.uniform(0.5, 1.0)
+                actual['error'] = error
+            _escribir_replicacion(actuales)
+    with _bloqueo_fichero(LOCK_REPLICACION_FILE):
+        pendientes = _leer_replicacion()
+    if not pendientes:
+        return None
+    return max(min(e['proximo'] for e in pendientes.values()) - time.time(), 0.5)
+
+def estado_replicacion():
+    """Datasets sin replicar, retraso del más antiguo, último error y próximo reintento"""
+    pendientes = _leer_replicacion()
+    ahora = time.time()
+    errores = [f"{d}: {e['error']}" for d, e in pendientes.items() if e['error']]
+    return {
+        'pendientes': sorted(pendientes),
+        'retraso': max((ahora - e['desde'] for e in pendientes.values()), default=0.0),
+        'intentos': max((e['intentos'] for e in pendientes.values()), default=0),
+        'proximo': max(min((e['proximo'] for e in pendientes.values()), default=ahora) - ahora, 0.0),
+        'error': errores[0] if errores else None,
+        'ultima': _estado_replicador()['ultima'],
+    }
+
+def _bucle_replicador(despertar):
+    espera = None
+    while True:
+        despertar.wait(timeout=30 if espera is None else min(espera, 30))
+        despertar.clear()
+        try:
+            espera = replicar_pendientes()
+        except Exception:
+            espera = 5
+
+def _sembrar_desde_sheets():
+    """Primer arranque en modo local primero sin datos locales: se parte de lo que hay en Sheets
+    para que el replicador no vacíe las hojas con un almacenamiento local en blanco"""
+    if os.path.exists(REPLICACION_FILE) or not _libro_compartido(clave_lectura("movimientos")).empty \
+            or not load_recurrentes().empty or not load_presupuestos().empty:
+        return
+    sheet = get_google_sheet()
+    if not sheet:
+        get_google_sheet.clear()
+        return
+    datos = {}
+    try:
+        worksheet = get_or_create_worksheet(sheet, SHEET_FINANZAS, COLUMNS)
+        if worksheet:
+            datos["movimientos"] = _aplicar_esquema(leer_hoja_incremental(worksheet, COLUMNS))
+        worksheet = get_or_create_worksheet(sheet, SHEET_RECURRENTES, COLUMNS_REC)
+        if worksheet:
+            datos["recurrentes"] = _df_recurrentes(worksheet.get_all_records())
+        worksheet = get_or_create_worksheet(sheet, SHEET_CATEGORIAS, ["Categoría"])
+        if worksheet:
+            datos["categorias"] = [r['Categoría'] for r in worksheet.get_all_records() if r.get('Categoría')]
+        worksheet = get_or_create_worksheet(sheet, "Presupuestos", COLUMNS_PRES)
+        if worksheet:
+            datos["presupuestos"] = pd.DataFrame(worksheet.get_all_records())
+    except Exception as e:
+        _tras_error_sheets(e)
+        st.warning(f"Error importando los datos de Google Sheets: {str(e)}")
+        return
+    with _bloqueo_escritura():
+        for dataset, valor in datos.items():
+            if len(valor):
+                _guardadores()[dataset](valor)
+    # Lo local es ahora copia de Sheets: no hay nada que replicar
+    with _bloqueo_fichero(LOCK_REPLICACION_FILE):
+        if os.path.exists(REPLICACION_FILE):
+            os.remove(REPLICACION_FILE)
+
+@st.cache_resource
+def _replicador_sheets():
+    """Arranca una vez por proceso el hilo replicador; retoma la cola que quedó de la ejecución anterior"""
+    _sembrar_desde_sheets()
+    despertar = threading.Event()
+    _estado_replicador()['despertar'] = despertar
+    threading.Thread(target=_bucle_replicador, args=(despertar,), daemon=True).start()
+    despertar.set()
+    return despertar
 
 # --- FUNCIONES DE IMPORTACIÓN CSV ---
 def importar_desde_csv(uploaded_file, mapeo_columnas):
@@ -1910,7 +2524,7 @@ def importar_desde_csv(uploaded_file, mapeo_columnas):
         
         # Convertir fechas
         if 'Fecha' in df_nuevo.columns:
-            df_nuevo['Fecha'] = pd.to_datetime(df_nuevo['Fecha'], dayfirst=True, errors='coerce')
+            df_nuevo['Fecha'] = _parsear_fechas(df_nuevo['Fecha'])
         
         # Convertir importes
         if 'Importe' in df_nuevo.columns:
@@ -1974,12 +2588,12 @@ def crear_backup(df):
     backup_file = os.path.join(BACKUP_DIR, f"backup_{timestamp}.csv")
     df_backup = df.copy()
     df_backup['Fecha'] = df_backup['Fecha'].dt.strftime("%d/%m/%Y")
-    df_backup.to_csv(backup_file, index=False)
+    _escritura_atomica(backup_file, lambda ruta: df_backup.to_csv(ruta, index=False))
     return backup_file
 
 def registrar_cambio(tipo_cambio, descripcion, usuario="Sistema"):
     """Registra un cambio en el historial"""
-    if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
+    if sheets_primario():
         sheet = get_google_sheet()
         if sheet:
             try:
@@ -1992,47 +2606,62 @@ def registrar_cambio(tipo_cambio, descripcion, usuario="Sistema"):
                         usuario
                     ])
                     return
-            except: pass
+            except Exception as e:
+                _tras_error_sheets(e)
     
-    if not os.path.exists(HISTORIAL_FILE):
-        pd.DataFrame(columns=["Fecha", "Tipo", "Descripcion", "Usuario"]).to_csv(HISTORIAL_FILE, index=False)
+    if usar_sqlite():
+        with _sqlite() as con:
+            _insertar_filas_sqlite(con, "historial", COLUMNS_HIST, [[
+                datetime.now().strftime("%d/%m/%Y %H:%M:%S"), tipo_cambio, descripcion, usuario
+            ]])
+        return
     
+    # Añadir una línea bajo el lock en lugar de releer y reescribir todo el historial
     try:
-        df_hist = pd.read_csv(HISTORIAL_FILE)
-        df_hist = pd.concat([df_hist, pd.DataFrame([{
-            "Fecha": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-            "Tipo": tipo_cambio,
-            "Descripcion": descripcion,
-            "Usuario": usuario
-        }])], ignore_index=True)
-        df_hist.to_csv(HISTORIAL_FILE, index=False)
+        with _bloqueo_escritura():
+            nuevo = not os.path.exists(HISTORIAL_FILE)
+            _anadir_a_fichero(HISTORIAL_FILE, pd.DataFrame([{
+                "Fecha": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+                "Tipo": tipo_cambio,
+                "Descripcion": descripcion,
+                "Usuario": usuario
+            }]).to_csv(header=nuevo, index=False))
     except: pass
 
+def load_historial():
+    """Carga el historial de cambios local"""
+    if usar_sqlite():
+        return _leer_tabla_sqlite("historial", COLUMNS_HIST)
+    if os.path.exists(HISTORIAL_FILE):
+        try:
+            return pd.read_csv(HISTORIAL_FILE)
+        except: pass
+    return pd.DataFrame(columns=COLUMNS_HIST)
+
 # --- FUNCIONES DE INTELIGENCIA ---
-def analizar_patrones(df):
-    """Analiza patrones en los gastos"""
-    if df.empty:
-        return {}
-    
-    df_gastos = df[df['Tipo'] == 'Gasto'].copy()
-    if df_gastos.empty:
+def analizar_patrones():
+    """Analiza patrones en los gastos a partir del resumen materializado"""
+    resumen = resumen_movimientos()
+    mensual = resumen['mensual'][resumen['mensual']['Tipo'] == 'Gasto']
+    if mensual.empty:
         return {}
+    diario = resumen['diario'][resumen['diario']['Tipo'] == 'Gasto']
     
     # Gastos por día de la semana
-    df_gastos['Dia_Semana'] = df_gastos['Fecha'].dt.day_name()
-    gastos_por_dia = df_gastos.groupby('Dia_Semana')['Importe'].sum().to_dict()
+    gastos_por_dia = diario.groupby(diario['Dia'].dt.day_name())['Importe'].sum().to_dict()
     
     # Categorías más gastadas
-    top_categorias = df_gastos.groupby('Categoría')['Importe'].sum().sort_values(ascending=False).head(5).to_dict()
+    top_categorias = mensual.groupby('Categoría')['Importe'].sum().sort_values(ascending=False).head(5).to_dict()
     
     # Promedio mensual
-    promedio_mensual = df_gastos.groupby(df_gastos['Fecha'].dt.to_period('M'))['Importe'].sum().mean()
+    promedio_mensual = mensual.groupby('Mes')['Importe'].sum().mean()
     
-    # Detección de gastos inusuales (más de 2 desviaciones estándar)
-    media = df_gastos['Importe'].mean()
-    std = df_gastos['Importe'].std()
+    # Detección de gastos inusuales (más de 2 desviaciones estándar), con media y varianza desde sumas
+    n = mensual['N'].sum()
+    media = mensual['Importe'].sum() / n
+    std = ((mensual['Importe_2'].sum() - n * media ** 2) / (n - 1)) ** 0.5 if n > 1 else float('nan')
     umbral = media + (2 * std)
-    gastos_inusuales = df_gastos[df_gastos['Importe'] > umbral].copy()
+    gastos_inusuales = gastos_por_encima(umbral).sort_values('Fecha', kind='stable')
     
     return {
         'gastos_por_dia': gastos_por_dia,
@@ -2043,18 +2672,18 @@ def analizar_patrones(df):
         'desviacion': std
     }
 
-def generar_recomendaciones(df, presupuestos, patrones):
+def generar_recomendaciones(presupuestos, patrones):
     """Genera recomendaciones basadas en el análisis"""
     recomendaciones = []
     now = datetime.now()
-    df_mes = df[(df['Fecha'].dt.month == now.month) & (df['Fecha'].dt.year == now.year)]
     
     # Comparar con presupuestos
     if not presupuestos.empty:
+        gastos_cat = gastos_mes_por_categoria(now.year, now.month)
         for _, presup in presupuestos.iterrows():
             cat = presup['Categoría']
             presup_mes = presup['Presupuesto_Mensual']
-            gasto_mes = df_mes[(df_mes['Categoría'] == cat) & (df_mes['Tipo'] == 'Gasto')]['Importe'].sum()
+            gasto_mes = gastos_cat.get(cat, 0)
             
             if gasto_mes > presup_mes * 0.9:
                 porcentaje = (gasto_mes / presup_mes) * 100
@@ -2074,36 +2703,37 @@ def generar_recomendaciones(df, presupuestos, patrones):
     return recomendaciones
 
 # --- FUNCIONES DE GEMINI AI ---
-def preparar_contexto_financiero(df, df_presupuestos=None):
-    """Prepara un resumen estructurado de los datos financieros para Gemini"""
-    if df.empty:
-        return "No hay datos financieros disponibles."
-    
+def preparar_contexto_financiero(df=None, df_presupuestos=None):
+    """Prepara un resumen estructurado de los datos financieros para Gemini. Sale del resumen
+    materializado y de los movimientos del mes en curso; `df` solo se usa si el almacenamiento
+    no permite leer un mes suelto (ver movimientos_del_mes)."""
     now = datetime.now()
-    df_mes = df[(df['Fecha'].dt.month == now.month) & (df['Fecha'].dt.year == now.year)]
-    df_mes_anterior = df[(df['Fecha'].dt.month == (now.month - 1) % 12 + (1 if now.month == 1 else 0)) & 
-                         (df['Fecha'].dt.year == (now.year if now.month > 1 else now.year - 1))]
+    resumen = resumen_movimientos()
+    mensual = resumen['mensual']
+    if mensual.empty:
+        return "No hay datos financieros disponibles."
+    mes_actual = pd.Timestamp(now.year, now.month, 1)
+    mes_anterior = mes_actual - pd.DateOffset(months=1)
+    df_mes = movimientos_del_mes(df, now.year, now.month)
     
     # Ingresos y gastos
-    ingresos_mes = df_mes[df_mes['Tipo'] == "Ingreso"]['Importe'].sum()
-    gastos_mes = df_mes[df_mes['Tipo'] == "Gasto"]['Importe'].sum()
-    ingresos_mes_anterior = df_mes_anterior[df_mes_anterior['Tipo'] == "Ingreso"]['Importe'].sum() if not df_mes_anterior.empty else 0
-    gastos_mes_anterior = df_mes_anterior[df_mes_anterior['Tipo'] == "Gasto"]['Importe'].sum() if not df_mes_anterior.empty else 0
+    totales = mensual[mensual['Mes'].isin([mes_actual, mes_anterior])].groupby(['Mes', 'Tipo'])['Importe'].sum()
+    ingresos_mes = totales.get((mes_actual, "Ingreso"), 0)
+    gastos_mes = totales.get((mes_actual, "Gasto"), 0)
+    ingresos_mes_anterior = totales.get((mes_anterior, "Ingreso"), 0)
+    gastos_mes_anterior = totales.get((mes_anterior, "Gasto"), 0)
     
     # Gastos por categoría del mes actual
-    gastos_por_categoria = df_mes[df_mes['Tipo'] == 'Gasto'].groupby('Categoría')['Importe'].sum().to_dict()
-    
-    # Gastos recurrentes
-    df_recurrentes = df[df['Frecuencia'].isin(['Mensual', 'Anual'])]
-    gastos_recurrentes = df_recurrentes.groupby(['Categoría', 'Concepto'])['Importe'].sum().to_dict()
+    gastos_por_categoria = gastos_mes_por_categoria(now.year, now.month)
     
     # Top gastos del mes
     top_gastos = df_mes[df_mes['Tipo'] == 'Gasto'].nlargest(5, 'Importe')[['Concepto', 'Categoría', 'Importe']].to_dict('records')
     
     # Promedio mensual histórico
-    n_meses = max(len(df['Fecha'].dt.to_period('M').unique()), 1)
-    gasto_promedio_historico = df[df['Tipo'] == "Gasto"]['Impacto_Mensual'].sum() / n_meses
-    ingreso_promedio_historico = df[df['Tipo'] == "Ingreso"].groupby(df['Fecha'].dt.to_period('M'))['Importe'].sum().mean() if not df[df['Tipo'] == "Ingreso"].empty else 0
+    n_meses = max(mensual['Mes'].nunique(), 1)
+    gasto_promedio_historico = mensual[mensual['Tipo'] == "Gasto"]['Impacto_Mensual'].sum() / n_meses
+    ingresos_por_mes = mensual[mensual['Tipo'] == "Ingreso"].groupby('Mes')['Importe'].sum()
+    ingreso_promedio_historico = ingresos_por_mes.mean() if not ingresos_por_mes.empty else 0
     
     contexto = f"""
 RESUMEN FINANCIERO DEL MES ACTUAL ({MESES_ES_DICT[now.month]} {now.year}):
@@ -2137,8 +2767,8 @@ GASTOS POR CATEGORÍA (MES ACTUAL):
                 porcentaje = (gasto_cat / presup['Presupuesto_Mensual']) * 100 if presup['Presupuesto_Mensual'] > 0 else 0
                 contexto += f"- {presup['Categoría']}: {gasto_cat:,.2f} € / {presup['Presupuesto_Mensual']:,.2f} € ({porcentaje:.1f}%)\n"
     
-    contexto += f"\nTOTAL DE REGISTROS: {len(df)} movimientos"
-    contexto += f"\nRANGO DE FECHAS: {df['Fecha'].min().strftime('%d/%m/%Y')} - {df['Fecha'].max().strftime('%d/%m/%Y')}"
+    contexto += f"\nTOTAL DE REGISTROS: {mensual['N'].sum()} movimientos"
+    contexto += f"\nRANGO DE FECHAS: {resumen['diario']['Dia'].min().strftime('%d/%m/%Y')} - {resumen['diario']['Dia'].max().strftime('%d/%m/%Y')}"
     
     return contexto
 
@@ -2173,12 +2803,104 @@ PREGUNTA DEL USUARIO:
 
 RESPUESTA:"""
         
-        # Generar respuesta
-        response = GEMINI_MODEL.generate_content(prompt)
+        # Generar respuesta; si el modelo recordado ya no existe, se detecta otro y se reintenta
+        try:
+            response = GEMINI_MODEL.generate_content(prompt)
+        except Exception as e:
+            if GEMINI_MODELO or not _es_error_de_modelo(e):
+                raise
+            olvidar_modelo_gemini()
+            if inicializar_gemini() is None:
+                raise
+            response = GEMINI_MODEL.generate_content(prompt)
         return response.text
     except Exception as e:
         return f"Error al comunicarse con Gemini: {str(e)}. Por favor, verifica tu API key y conexión."
 
+# --- MÉTRICAS DERIVADAS ---
+# Cada métrica se declara una vez con los datasets que lee y las métricas de las que depende.
+# Se calcula solo cuando una sección la pide y se memoriza, compartida entre sesiones, con la
+# versión de sus datasets (y el mes en curso) como clave: cambiar de sección o pulsar un botón
+# no recalcula nada mientras los datos no cambien.
+METRICAS = {}
+
+def metrica(nombre, datasets=(), depende=()):
+    """Registra una métrica derivada; la función recibe los valores de sus dependencias"""
+    def registrar(funcion):
+        METRICAS[nombre] = (funcion, tuple(datasets), tuple(depende))
+        return funcion
+    return registrar
+
+@st.cache_resource
+def _memo_metricas():
+    """Último valor calculado de cada métrica con la clave de versión con la que se calculó"""
+    return threading.Lock(), {}
+
+def _datasets_metrica(nombre):
+    """Datasets de los que depende una métrica, directa o transitivamente"""
+    _, datasets, depende = METRICAS[nombre]
+    return set(datasets).union(*(_datasets_metrica(d) for d in depende))
+
+def valor_metrica(nombre):
+    """Valor de una métrica para la versión actual de sus datos, calculando solo lo que haga falta.
+    La clave se toma antes de calcular: si los datos cambian a mitad, el valor queda obsoleto
+    y la siguiente lectura lo recalcula. Los valores compartidos no deben modificarse."""
+    funcion, _, depende = METRICAS[nombre]
+    now = datetime.now()
+    clave = ((now.year, now.month),) + tuple(clave_lectura(d) for d in sorted(_datasets_metrica(nombre)))
+    lock, memo = _memo_metricas()
+    with lock:
+        if nombre in memo and memo[nombre][0] == clave:
+            return memo[nombre][1]
+    valor = funcion(*(valor_metrica(d) for d in depende))
+    with lock:
+        memo[nombre] = (clave, valor)
+    return valor
+
+@metrica("mensual", datasets=("movimientos",))
+def _metrica_mensual():
+    return resumen_movimientos()['mensual']
+
+@metrica("n_meses", depende=("mensual",))
+def _metrica_n_meses(mensual):
+    return max(mensual['Mes'].nunique(), 1)
+
+@metrica("ingresos", depende=("mensual",))
+def _metrica_ingresos(mensual):
+    """Ingresos del mes en curso"""
+    now = datetime.now()
+    return mensual[(mensual['Mes'] == pd.Timestamp(now.year, now.month, 1)) & (mensual['Tipo'] == "Ingreso")]['Importe'].sum()
+
+@metrica("gasto_pro", depende=("mensual", "n_meses"))
+def _metrica_gasto_pro(mensual, n_meses):
+    """Gasto mensual promedio, con los gastos periódicos prorrateados"""
+    return mensual[mensual['Tipo'] == "Gasto"]['Impacto_Mensual'].sum() / n_meses
+
+@metrica("prov_anual", depende=("mensual",))
+def _metrica_prov_anual(mensual):
+    """Hucha mensual para los gastos anuales"""
+    return mensual[(mensual['Tipo'] == "Gasto") & (mensual['Frecuencia'] == "Anual")]['Impacto_Mensual'].sum()
+
+@metrica("total_conjunto", depende=("mensual",))
+def _metrica_total_conjunto(mensual):
+    return mensual[mensual['Es_Conjunto']]['Importe'].sum()
+
+@metrica("ahorro_real", depende=("ingresos", "gasto_pro"))
+def _metrica_ahorro_real(ingresos, gasto_pro):
+    return ingresos - gasto_pro
+
+@metrica("patrones", datasets=("movimientos",))
+def _metrica_patrones():
+    return analizar_patrones()
+
+@metrica("recomendaciones", datasets=("presupuestos",), depende=("patrones",))
+def _metrica_recomendaciones(patrones):
+    return generar_recomendaciones(load_presupuestos(), patrones)
+
+@metrica("contexto_financiero", datasets=("movimientos", "presupuestos"))
+def _metrica_contexto_financiero():
+    return preparar_contexto_financiero(df_presupuestos=load_presupuestos())
+
 # --- ESTADO SESIÓN ---
 if 'simulacion' not in st.session_state: 
     st.session_state.simulacion = []
@@ -2190,11 +2912,23 @@ if 'show_modal' not in st.session_state:
     st.session_state.show_modal = False
 if 'seccion_actual' not in st.session_state:
     st.session_state.seccion_actual = "🤖 Asesor"
+if 'menu_abierto' not in st.session_state:
+    st.session_state.menu_abierto = False
 
 # --- CARGA ---
-df = load_data()
-df_rec = load_recurrentes()
-lista_cats = load_categories()
+if ESCRITURA_DIFERIDA:
+    _escritor_segundo_plano()
+if replicacion_activa():
+    _replicador_sheets()
+# El Asesor y Presupuestos solo usan los movimientos del mes en curso y el anterior (el resto
+# sale del resumen materializado); las demás secciones trabajan con el histórico completo
+SECCIONES_MESES_RECIENTES = ("🤖 Asesor", "💰 Presupuestos")
+datos_iniciales, versiones_iniciales = cargar_datasets(
+    solo_meses_recientes=st.session_state.seccion_actual in SECCIONES_MESES_RECIENTES
+)
+df = datos_iniciales["movimientos"]
+df_rec = datos_iniciales["recurrentes"]
+lista_cats = datos_iniciales["categorias"]
 
 # --- SIDEBAR OCULTO ---
 # La sidebar está oculta completamente para aprovechar todo el espacio
@@ -2217,220 +2951,328 @@ titulos_secciones = {
 }
 titulo_actual = titulos_secciones.get(st.session_state.seccion_actual, "Finanzas Proactivas €")
 
-# Header con diseño glass exacto según HTML
-st.markdown(f"""
-<header class="sticky top-0 z-50 glass border-b border-white/5 px-4 py-3 flex items-center justify-between" style="backdrop-filter: blur(10px); background: rgba(18, 19, 32, 0.8); border-bottom: 1px solid rgba(255, 255, 255, 0.05); padding: 0.75rem 1rem; margin: -1rem -1rem 1rem -1rem; display: flex; align-items: center; justify-content: space-between;">
-    <div style="display: flex; align-items: center; gap: 0.5rem;">
-        <h2 style="margin: 0; color: white; font-size: 1.125rem; font-weight: 700; line-height: 1.25; letter-spacing: -0.025em;">Finanzas Proactivas €</h2>
-    </div>
-    <div style="display: flex; align-items: center; gap: 0.75rem;">
-""", unsafe_allow_html=True)
-
-col_btn1, col_btn2 = st.columns([1, 1])
-with col_btn1:
-    if st.button("➕ Nuevo", type="primary", key="btn_alta_header", use_container_width=True):
-        st.session_state.show_modal = True
-        st.rerun()
+# Definir opciones del menú
+opciones_menu = ["🤖 Asesor", "📊 Gráficos", "🔍 Tabla", "🔄 Recurrentes", "📝 Editar", "📤 Exportar/Importar", "💰 Presupuestos", "⚙️ Config"]
 
-with col_btn2:
-    if 'menu_abierto' not in st.session_state:
-        st.session_state.menu_abierto = False
-    if st.button("☰", key="btn_hamburger", help="Menú", use_container_width=True):
-        st.session_state.menu_abierto = not st.session_state.menu_abierto
+# --- FRAGMENTOS ---
+# Abrir el menú o el formulario de alta y usar el chat solo vuelven a ejecutar su fragmento,
+# no el script entero (cargas de datos, métricas, secciones). Lo que cambia datos o la sección
+# visible (guardar, simular, navegar) sigue pidiendo un rerun completo con st.rerun().
+def _rerun_fragmento():
+    """Vuelve a ejecutar solo el fragmento en curso; si el clic llegó en un rerun completo, la app"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
         st.rerun()
 
-st.markdown("</div></header>", unsafe_allow_html=True)
-
-# Modal/Popup para el formulario - Mostrar después del header cuando está activo
-if st.session_state.show_modal:
-    # Contenedor estilizado para el formulario
-    st.markdown("""
-    <div style="background: var(--modal-bg); border: 1px solid rgba(255, 255, 255, 0.05); border-radius: 0.75rem; padding: 1.5rem; margin-bottom: 1.5rem; box-shadow: 0 20px 25px -5px rgba(0, 0, 0, 0.5);">
-        <div style="width: 48px; height: 6px; background: #3d3f51; border-radius: 9999px; margin: 0 auto 1rem auto;"></div>
+@st.fragment
+def cabecera():
+    """Cabecera con los botones de alta y menú, el formulario de alta y el menú de navegación"""
+    # Header con diseño glass exacto según HTML
+    st.markdown(f"""
+    <header class="sticky top-0 z-50 glass border-b border-white/5 px-4 py-3 flex items-center justify-between" style="backdrop-filter: blur(10px); background: rgba(18, 19, 32, 0.8); border-bottom: 1px solid rgba(255, 255, 255, 0.05); padding: 0.75rem 1rem; margin: -1rem -1rem 1rem -1rem; display: flex; align-items: center; justify-content: space-between;">
+        <div style="display: flex; align-items: center; gap: 0.5rem;">
+            <h2 style="margin: 0; color: white; font-size: 1.125rem; font-weight: 700; line-height: 1.25; letter-spacing: -0.025em;">Finanzas Proactivas €</h2>
+        </div>
+        <div style="display: flex; align-items: center; gap: 0.75rem;">
     """, unsafe_allow_html=True)
     
-    # Formulario inteligente y adaptativo - sin título ni X
-    with st.form("form_reg_modal", clear_on_submit=True):
-        # Primera fila: Modo Simulación y Tipo
-        col_sim, col_tipo = st.columns([1, 2])
-        with col_sim:
-            modo_simulacion = st.checkbox("🧪 Simulación", help="Prueba sin guardar", value=st.session_state.modo_simulacion, key="modo_sim_modal")
-            st.session_state.modo_simulacion = modo_simulacion
-        with col_tipo:
-            st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Tipo</p>', unsafe_allow_html=True)
-            tipo = st.radio("", ["Ingreso", "Gasto"], index=1, horizontal=True, label_visibility="collapsed")
-        
-        # Segunda fila: Gasto Conjunto en contenedor especial
-        st.markdown('<div class="gasto-conjunto-container">', unsafe_allow_html=True)
-        es_conjunto = st.checkbox("👥 Gasto Conjunto", key="es_conjunto_modal")
-        st.markdown('</div>', unsafe_allow_html=True)
-        
-        # Tercera fila: Fecha y Categoría
-        col_fecha, col_cat = st.columns(2)
-        with col_fecha:
-            st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">📅 Fecha</p>', unsafe_allow_html=True)
-            fecha = st.date_input(
-                "", 
-                datetime.now(), 
-                format="DD/MM/YYYY",
-                key="fecha_input_modal",
-                label_visibility="collapsed"
-            )
-        with col_cat:
-            st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Categoría</p>', unsafe_allow_html=True)
-            cat = st.selectbox("", lista_cats, key="cat_select_modal", label_visibility="collapsed")
-        
-        # Cuarta fila: Concepto (ancho completo)
-        st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Concepto</p>', unsafe_allow_html=True)
-        con = st.text_input("", key="concepto_input_modal", placeholder="Ej: Cena en terraza", label_visibility="collapsed")
-        
-        # Quinta fila: Importe y Frecuencia
-        col_imp, col_fre = st.columns([2, 1])
-        with col_imp:
-            st.markdown('<p style="color: var(--primary); font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Importe Total (€)</p>', unsafe_allow_html=True)
-            imp_input = st.number_input(
-                "", 
-                min_value=0.0, 
-                step=0.01, 
-                format="%.2f",
-                key="importe_input_modal",
-                label_visibility="collapsed"
-            )
-        with col_fre:
-            st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Frecuencia</p>', unsafe_allow_html=True)
-            fre = st.selectbox(
-                "", 
-                ["Puntual", "Mensual", "Anual"],
-                key="frecuencia_select_modal",
-                label_visibility="collapsed"
-            )
-    
-        # Mostrar cálculo si es conjunto
-        imp_real = imp_input / 2 if es_conjunto and tipo == "Gasto" else imp_input
-        if es_conjunto and tipo == "Gasto" and imp_input > 0:
-            st.info(f"ℹ️ Se registrarán **{imp_real:.2f} €** (mitad del total)")
-
-        # Botones de acción
-        btn = "➕ Añadir a Simulación" if modo_simulacion else "💾 Guardar"
+    col_btn1, col_btn2 = st.columns([1, 1])
+    with col_btn1:
+        if st.button("➕ Nuevo", type="primary", key="btn_alta_header", use_container_width=True):
+            st.session_state.show_modal = True
+    
+    with col_btn2:
+        if st.button("☰", key="btn_hamburger", help="Menú", use_container_width=True):
+            st.session_state.menu_abierto = not st.session_state.menu_abierto
+    
+    st.markdown("</div></header>", unsafe_allow_html=True)
+    
+    # Indicador de guardado en segundo plano
+    if ESCRITURA_DIFERIDA:
+        estado_guardado = estado_escrituras()
+        if estado_guardado['error']:
+            st.warning(f"⚠️ Reintentando guardar ({estado_guardado['error']}). Los cambios están a salvo en la cola local.")
+        elif estado_guardado['pendientes']:
+            st.caption(f"⏳ Guardando en segundo plano: {', '.join(estado_guardado['pendientes'])}")
+    
+    # Modal/Popup para el formulario - Mostrar después del header cuando está activo
+    if st.session_state.show_modal:
+        # Contenedor estilizado para el formulario
+        st.markdown("""
+        <div style="background: var(--modal-bg); border: 1px solid rgba(255, 255, 255, 0.05); border-radius: 0.75rem; padding: 1.5rem; margin-bottom: 1.5rem; box-shadow: 0 20px 25px -5px rgba(0, 0, 0, 0.5);">
+            <div style="width: 48px; height: 6px; background: #3d3f51; border-radius: 9999px; margin: 0 auto 1rem auto;"></div>
+        """, unsafe_allow_html=True)
         
-        col_submit, col_cancel = st.columns([2, 1])
-        with col_submit:
-            submitted = st.form_submit_button(btn, type="primary", use_container_width=True)
-        with col_cancel:
-            if st.form_submit_button("Cancelar", use_container_width=True):
-                st.session_state.show_modal = False
-                st.rerun()
+        # Formulario inteligente y adaptativo - sin título ni X
+        with st.form("form_reg_modal", clear_on_submit=True):
+            # Primera fila: Modo Simulación y Tipo
+            col_sim, col_tipo = st.columns([1, 2])
+            with col_sim:
+                modo_simulacion = st.checkbox("🧪 Simulación", help="Prueba sin guardar", value=st.session_state.modo_simulacion, key="modo_sim_modal")
+                st.session_state.modo_simulacion = modo_simulacion
+            with col_tipo:
+                st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Tipo</p>', unsafe_allow_html=True)
+                tipo = st.radio("", ["Ingreso", "Gasto"], index=1, horizontal=True, label_visibility="collapsed")
+            
+            # Segunda fila: Gasto Conjunto en contenedor especial
+            st.markdown('<div class="gasto-conjunto-container">', unsafe_allow_html=True)
+            es_conjunto = st.checkbox("👥 Gasto Conjunto", key="es_conjunto_modal")
+            st.markdown('</div>', unsafe_allow_html=True)
+            
+            # Tercera fila: Fecha y Categoría
+            col_fecha, col_cat = st.columns(2)
+            with col_fecha:
+                st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">📅 Fecha</p>', unsafe_allow_html=True)
+                fecha = st.date_input(
+                    "", 
+                    datetime.now(), 
+                    format="DD/MM/YYYY",
+                    key="fecha_input_modal",
+                    label_visibility="collapsed"
+                )
+            with col_cat:
+                st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Categoría</p>', unsafe_allow_html=True)
+                cat = st.selectbox("", lista_cats, key="cat_select_modal", label_visibility="collapsed")
+            
+            # Cuarta fila: Concepto (ancho completo)
+            st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Concepto</p>', unsafe_allow_html=True)
+            con = st.text_input("", key="concepto_input_modal", placeholder="Ej: Cena en terraza", label_visibility="collapsed")
+            
+            # Quinta fila: Importe y Frecuencia
+            col_imp, col_fre = st.columns([2, 1])
+            with col_imp:
+                st.markdown('<p style="color: var(--primary); font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Importe Total (€)</p>', unsafe_allow_html=True)
+                imp_input = st.number_input(
+                    "", 
+                    min_value=0.0, 
+                    step=0.01, 
+                    format="%.2f",
+                    key="importe_input_modal",
+                    label_visibility="collapsed"
+                )
+            with col_fre:
+                st.markdown('<p style="color: #9fa1b7; font-size: 0.75rem; font-weight: 700; text-transform: uppercase; letter-spacing: 0.05em; margin-bottom: 0.5rem;">Frecuencia</p>', unsafe_allow_html=True)
+                fre = st.selectbox(
+                    "", 
+                    ["Puntual", "Mensual", "Anual"],
+                    key="frecuencia_select_modal",
+                    label_visibility="collapsed"
+                )
         
-        if submitted:
-            if imp_input > 0 and con:
-                impacto = imp_real / 12 if fre == "Anual" else imp_real
-                
-                if modo_simulacion:
-                    # LÓGICA DE SIMULACIÓN CORREGIDA
-                    st.session_state.simulacion.append({
-                        "Fecha": fecha.strftime("%d/%m/%Y"), 
-                        "Tipo": tipo, 
-                        "Concepto": f"{con} (Sim)",
-                        "Importe": imp_real, 
-                        "Frecuencia": fre, 
-                        "Impacto_Mensual": impacto, 
-                        "Es_Conjunto": es_conjunto
-                    })
+            # Mostrar cálculo si es conjunto
+            imp_real = imp_input / 2 if es_conjunto and tipo == "Gasto" else imp_input
+            if es_conjunto and tipo == "Gasto" and imp_input > 0:
+                st.info(f"ℹ️ Se registrarán **{imp_real:.2f} €** (mitad del total)")
+    
+            # Botones de acción
+            btn = "➕ Añadir a Simulación" if modo_simulacion else "💾 Guardar"
+            
+            col_submit, col_cancel = st.columns([2, 1])
+            with col_submit:
+                submitted = st.form_submit_button(btn, type="primary", use_container_width=True)
+            with col_cancel:
+                if st.form_submit_button("Cancelar", use_container_width=True):
                     st.session_state.show_modal = False
-                    st.success("Añadido a simulación")
-                    st.rerun()
+                    _rerun_fragmento()
+            
+            if submitted:
+                if imp_input > 0 and con:
+                    impacto = imp_real / 12 if fre == "Anual" else imp_real
+                    
+                    if modo_simulacion:
+                        # LÓGICA DE SIMULACIÓN CORREGIDA
+                        st.session_state.simulacion.append({
+                            "Fecha": fecha.strftime("%d/%m/%Y"), 
+                            "Tipo": tipo, 
+                            "Concepto": f"{con} (Sim)",
+                            "Importe": imp_real, 
+                            "Frecuencia": fre, 
+                            "Impacto_Mensual": impacto, 
+                            "Es_Conjunto": es_conjunto
+                        })
+                        st.session_state.show_modal = False
+                        st.success("Añadido a simulación")
+                        st.rerun()
+                    else:
+                        # LÓGICA DE GUARDADO REAL
+                        new_row = pd.DataFrame([[pd.to_datetime(fecha), tipo, cat, con, imp_real, fre, impacto, es_conjunto]], columns=COLUMNS)
+                        if append_movimientos(new_row):
+                            registrar_cambio("Alta", f"Nuevo movimiento: {con} ({imp_real:.2f} €)")
+                            st.session_state.show_modal = False
+                            st.success("Guardado")
+                            st.rerun()
                 else:
-                    # LÓGICA DE GUARDADO REAL
-                    new_row = pd.DataFrame([[pd.to_datetime(fecha), tipo, cat, con, imp_real, fre, impacto, es_conjunto]], columns=COLUMNS)
-                    df = pd.concat([df, new_row], ignore_index=True)
-                    save_all_data(df)
-                    registrar_cambio("Alta", f"Nuevo movimiento: {con} ({imp_real:.2f} €)")
-                    st.session_state.show_modal = False
-                    st.success("Guardado")
-                    st.rerun()
-            else:
-                st.error("Faltan datos")
-    
-    # Cerrar div del contenedor
-    st.markdown("</div>", unsafe_allow_html=True)
-    
-    # Botón para cerrar el modal (fuera del form)
-    if st.button("✕ Cerrar", key="close_modal_btn", use_container_width=True, type="secondary"):
-        st.session_state.show_modal = False
-        st.rerun()
-
-# Definir opciones del menú
-opciones_menu = ["🤖 Asesor", "📊 Gráficos", "🔍 Tabla", "🔄 Recurrentes", "📝 Editar", "📤 Exportar/Importar", "💰 Presupuestos", "⚙️ Config"]
-
-# Menú lateral derecho - Usando columnas de Streamlit
-if st.session_state.menu_abierto:
-    # CSS para overlay y menú
-    st.markdown("""
-    <style>
-    .menu-overlay-custom {
-        position: fixed !important;
-        top: 0 !important;
-        left: 0 !important;
-        right: 0 !important;
-        bottom: 0 !important;
-        background: rgba(0,0,0,0.5) !important;
-        z-index: 99998 !important;
-    }
-    </style>
-    <div class="menu-overlay-custom"></div>
-    """, unsafe_allow_html=True)
-    
-    # Usar columnas: espacio vacío a la izquierda, menú a la derecha
-    col_espacio, col_menu = st.columns([3, 1])
-    
-    with col_espacio:
-        st.empty()  # Espacio vacío
-    
-    with col_menu:
-        st.markdown("### Navegación")
+                    st.error("Faltan datos")
         
-        # Botón para cerrar menú
-        if st.button("✕ Cerrar", use_container_width=True, key="btn_cerrar_menu"):
-            st.session_state.menu_abierto = False
-            st.rerun()
+        # Cerrar div del contenedor
+        st.markdown("</div>", unsafe_allow_html=True)
         
-        st.markdown("---")
+        # Botón para cerrar el modal (fuera del form)
+        if st.button("✕ Cerrar", key="close_modal_btn", use_container_width=True, type="secondary"):
+            st.session_state.show_modal = False
+            _rerun_fragmento()
+    
+    # Menú lateral derecho - Usando columnas de Streamlit
+    if st.session_state.menu_abierto:
+        # CSS para overlay y menú
+        st.markdown("""
+        <style>
+        .menu-overlay-custom {
+            position: fixed !important;
+            top: 0 !important;
+            left: 0 !important;
+            right: 0 !important;
+            bottom: 0 !important;
+            background: rgba(0,0,0,0.5) !important;
+            z-index: 99998 !important;
+        }
+        </style>
+        <div class="menu-overlay-custom"></div>
+        """, unsafe_allow_html=True)
+        
+        # Usar columnas: espacio vacío a la izquierda, menú a la derecha
+        col_espacio, col_menu = st.columns([3, 1])
         
-        # Botones del menú
-        for opcion in opciones_menu:
-            if st.button(opcion, use_container_width=True, key=f"menu_btn_{opcion}"):
-                st.session_state.seccion_actual = opcion
+        with col_espacio:
+            st.empty()  # Espacio vacío
+        
+        with col_menu:
+            st.markdown("### Navegación")
+            
+            # Botón para cerrar menú
+            if st.button("✕ Cerrar", use_container_width=True, key="btn_cerrar_menu"):
                 st.session_state.menu_abierto = False
-                st.rerun()
+                _rerun_fragmento()
+            
+            st.markdown("---")
+            
+            # Botones del menú
+            for opcion in opciones_menu:
+                if st.button(opcion, use_container_width=True, key=f"menu_btn_{opcion}"):
+                    st.session_state.seccion_actual = opcion
+                    st.session_state.menu_abierto = False
+                    st.rerun()
+
+cabecera()
+
+@st.fragment
+def chat_asesor():
+    """Chat con Gemini del asesor"""
+    st.markdown("---")
+    st.subheader("🤖 Asistente IA con Gemini")
+    st.caption("Haz preguntas en lenguaje natural sobre tus finanzas y recibe respuestas inteligentes")
+    
+    # El modelo (y la librería de Gemini) se inicializan al abrir el chat, no al arrancar
+    if GEMINI_ENABLED and GEMINI_MODEL is None:
+        inicializar_gemini()
+    if GEMINI_ENABLED and GEMINI_MODEL is not None:
+        # Mostrar historial de chat
+        if st.session_state.chat_history:
+            st.markdown("**💬 Conversación:**")
+            for mensaje in st.session_state.chat_history[-10:]:  # Mostrar últimos 10 mensajes
+                if mensaje['tipo'] == 'usuario':
+                    with st.chat_message("user"):
+                        st.write(mensaje['contenido'])
+                else:
+                    with st.chat_message("assistant"):
+                        st.write(mensaje['contenido'])
+    
+        # Campo de entrada para preguntas
+        st.markdown("**💭 Haz una pregunta sobre tus finanzas:**")
+        pregunta = st.text_input(
+            "Ejemplos: '¿Cuánto he gastado en comida este mes?', '¿Cuál es mi categoría con más gastos?', '¿Cómo van mis presupuestos?'",
+            key=f"pregunta_gemini_{st.session_state.chat_input_key}",
+            label_visibility="collapsed"
+        )
+    
+        col_ask, col_clear = st.columns([3, 1])
+        with col_ask:
+            if st.button("💬 Enviar Pregunta", type="primary", use_container_width=True):
+                if pregunta.strip():
+                    with st.spinner("🤔 Pensando..."):
+                        respuesta = chat_con_gemini(pregunta, valor_metrica("contexto_financiero"))
+    
+                        # Guardar en historial
+                        st.session_state.chat_history.append({
+                            'tipo': 'usuario',
+                            'contenido': pregunta
+                        })
+                        st.session_state.chat_history.append({
+                            'tipo': 'asistente',
+                            'contenido': respuesta
+                        })
+                        # Incrementar key para limpiar el campo
+                        st.session_state.chat_input_key += 1
+                    _rerun_fragmento()
+    
+        with col_clear:
+            if st.button("🗑️ Limpiar Chat", use_container_width=True):
+                st.session_state.chat_history = []
+                st.session_state.chat_input_key += 1  # También limpiar el input
+                _rerun_fragmento()
+    
+        # Sugerencias de preguntas
+        with st.expander("💡 Preguntas sugeridas"):
+            sugerencias = [
+                "¿Cuánto he gastado este mes?",
+                "¿Cuál es mi categoría con más gastos?",
+                "¿Cómo van mis presupuestos?",
+                "¿En qué categoría debería ahorrar más?",
+                "¿Cuánto puedo ahorrar este mes?",
+                "Compara mis gastos de este mes con el anterior",
+                "¿Qué gastos recurrentes tengo?",
+                "Dame recomendaciones para mejorar mis finanzas"
+            ]
+            cols_sug = st.columns(2)
+            for i, sug in enumerate(sugerencias):
+                with cols_sug[i % 2]:
+                    if st.button(sug, key=f"sug_{i}", use_container_width=True):
+                        # Simular pregunta
+                        with st.spinner("🤔 Pensando..."):
+                            respuesta = chat_con_gemini(sug, valor_metrica("contexto_financiero"))
+                            st.session_state.chat_history.append({
+                                'tipo': 'usuario',
+                                'contenido': sug
+                            })
+                            st.session_state.chat_history.append({
+                                'tipo': 'asistente',
+                                'contenido': respuesta
+                            })
+                        _rerun_fragmento()
+    else:
+        st.warning("⚠️ Gemini no está configurado. Para activar el asistente IA:")
+        st.info("""
+        1. Obtén una API key de Google AI Studio: https://makersuite.google.com/app/apikey
+        2. Agrega la variable de entorno: `GEMINI_API_KEY=tu_api_key`
+        3. En Streamlit Cloud, ve a Settings → Secrets y agrega:
+           ```
+           GEMINI_API_KEY=tu_api_key_aqui
+           ```
+        """)
+        if not GEMINI_AVAILABLE:
+            st.error("❌ La librería `google-generativeai` no está instalada. Ejecuta: `pip install google-generativeai`")
+
 
 # --- DASHBOARD ---
-if df.empty: 
+if df.empty and resumen_movimientos()['mensual'].empty:
     st.info("Empieza añadiendo movimientos.")
 else:
-    # CÁLCULOS REALES
-    now = datetime.now()
-    df_mes = df[(df['Fecha'].dt.month == now.month) & (df['Fecha'].dt.year == now.year)]
-    
-    ingresos = df_mes[df_mes['Tipo'] == "Ingreso"]['Importe'].sum()
-    n_meses = max(len(df['Fecha'].dt.to_period('M').unique()), 1)
-    gasto_pro = df[df['Tipo'] == "Gasto"]['Impacto_Mensual'].sum() / n_meses
-    
-    df_anuales = df[(df['Tipo'] == "Gasto") & (df['Frecuencia'] == "Anual")]
-    prov_anual = df_anuales['Impacto_Mensual'].sum() if not df_anuales.empty else 0
-    total_conjunto = df[df['Es_Conjunto'] == True]['Importe'].sum()
-
+    # Las métricas se calculan dentro de cada sección, solo si las usa (ver MÉTRICAS DERIVADAS)
     # Mostrar sección según selección del menú
     seccion_actual = st.session_state.seccion_actual
     
     # --- SECCIÓN: ASESOR INTELIGENTE & SIMULACIÓN ---
     if seccion_actual == "🤖 Asesor":
-        # Cargar presupuestos y analizar patrones
-        df_presupuestos = load_presupuestos()
-        patrones = analizar_patrones(df)
-        recomendaciones = generar_recomendaciones(df, df_presupuestos, patrones)
+        patrones = valor_metrica("patrones")
+        recomendaciones = valor_metrica("recomendaciones")
+        ingresos = valor_metrica("ingresos")
+        gasto_pro = valor_metrica("gasto_pro")
+        prov_anual = valor_metrica("prov_anual")
+        total_conjunto = valor_metrica("total_conjunto")
         
         # 1. PARTE SUPERIOR: DATOS REALES - Métricas con scroll horizontal
-        ahorro_real = ingresos - gasto_pro
+        ahorro_real = valor_metrica("ahorro_real")
         promedio_mensual = patrones.get('promedio_mensual', 0) if patrones else 0
         
         # Métricas en grid responsive - Todas visibles sin scroll
@@ -2619,99 +3461,7 @@ else:
             st.markdown("</div>", unsafe_allow_html=True)
         
         # 2. CHAT CON GEMINI AI
-        st.markdown("---")
-        st.subheader("🤖 Asistente IA con Gemini")
-        st.caption("Haz preguntas en lenguaje natural sobre tus finanzas y recibe respuestas inteligentes")
-        
-        if GEMINI_ENABLED and GEMINI_MODEL is not None:
-            # Preparar contexto financiero
-            contexto_financiero = preparar_contexto_financiero(df, df_presupuestos)
-            
-            # Mostrar historial de chat
-            if st.session_state.chat_history:
-                st.markdown("**💬 Conversación:**")
-                for mensaje in st.session_state.chat_history[-10:]:  # Mostrar últimos 10 mensajes
-                    if mensaje['tipo'] == 'usuario':
-                        with st.chat_message("user"):
-                            st.write(mensaje['contenido'])
-                    else:
-                        with st.chat_message("assistant"):
-                            st.write(mensaje['contenido'])
-            
-            # Campo de entrada para preguntas
-            st.markdown("**💭 Haz una pregunta sobre tus finanzas:**")
-            pregunta = st.text_input(
-                "Ejemplos: '¿Cuánto he gastado en comida este mes?', '¿Cuál es mi categoría con más gastos?', '¿Cómo van mis presupuestos?'",
-                key=f"pregunta_gemini_{st.session_state.chat_input_key}",
-                label_visibility="collapsed"
-            )
-            
-            col_ask, col_clear = st.columns([3, 1])
-            with col_ask:
-                if st.button("💬 Enviar Pregunta", type="primary", use_container_width=True):
-                    if pregunta.strip():
-                        with st.spinner("🤔 Pensando..."):
-                            respuesta = chat_con_gemini(pregunta, contexto_financiero)
-                            
-                            # Guardar en historial
-                            st.session_state.chat_history.append({
-                                'tipo': 'usuario',
-                                'contenido': pregunta
-                            })
-                            st.session_state.chat_history.append({
-                                'tipo': 'asistente',
-                                'contenido': respuesta
-                            })
-                            # Incrementar key para limpiar el campo
-                            st.session_state.chat_input_key += 1
-                        st.rerun()
-            
-            with col_clear:
-                if st.button("🗑️ Limpiar Chat", use_container_width=True):
-                    st.session_state.chat_history = []
-                    st.session_state.chat_input_key += 1  # También limpiar el input
-                    st.rerun()
-            
-            # Sugerencias de preguntas
-            with st.expander("💡 Preguntas sugeridas"):
-                sugerencias = [
-                    "¿Cuánto he gastado este mes?",
-                    "¿Cuál es mi categoría con más gastos?",
-                    "¿Cómo van mis presupuestos?",
-                    "¿En qué categoría debería ahorrar más?",
-                    "¿Cuánto puedo ahorrar este mes?",
-                    "Compara mis gastos de este mes con el anterior",
-                    "¿Qué gastos recurrentes tengo?",
-                    "Dame recomendaciones para mejorar mis finanzas"
-                ]
-                cols_sug = st.columns(2)
-                for i, sug in enumerate(sugerencias):
-                    with cols_sug[i % 2]:
-                        if st.button(sug, key=f"sug_{i}", use_container_width=True):
-                            # Simular pregunta
-                            with st.spinner("🤔 Pensando..."):
-                                respuesta = chat_con_gemini(sug, contexto_financiero)
-                                st.session_state.chat_history.append({
-                                    'tipo': 'usuario',
-                                    'contenido': sug
-                                })
-                                st.session_state.chat_history.append({
-                                    'tipo': 'asistente',
-                                    'contenido': respuesta
-                                })
-                            st.rerun()
-        else:
-            st.warning("⚠️ Gemini no está configurado. Para activar el asistente IA:")
-            st.info("""
-            1. Obtén una API key de Google AI Studio: https://makersuite.google.com/app/apikey
-            2. Agrega la variable de entorno: `GEMINI_API_KEY=tu_api_key`
-            3. En Streamlit Cloud, ve a Settings → Secrets y agrega:
-               ```
-               GEMINI_API_KEY=tu_api_key_aqui
-               ```
-            """)
-            if not GEMINI_AVAILABLE:
-                st.error("❌ La librería `google-generativeai` no está instalada. Ejecuta: `pip install google-generativeai`")
+        chat_asesor()
         
         # 3. PARTE INFERIOR: ZONA DE SIMULACIÓN
         st.markdown("---")
@@ -2763,17 +3513,21 @@ else:
             ["Evolución Temporal", "Distribución por Categorías", "Gráfico de Sankey (Flujo)", 
              "Gráfico de Burbujas", "Calendario de Gastos", "Heatmap por Día de Semana"]
         )
+        # Todos los gráficos se alimentan del resumen materializado, no del histórico
+        resumen_mov = resumen_movimientos()
+        mensual_gastos = resumen_mov['mensual'][resumen_mov['mensual']['Tipo'] == 'Gasto']
+        diario_gastos = resumen_mov['diario'][resumen_mov['diario']['Tipo'] == 'Gasto']
         
         if tipo_visualizacion == "Evolución Temporal":
-            df_ev = df.groupby([df['Fecha'].dt.to_period('M'), 'Tipo'])['Importe'].sum().reset_index()
-            df_ev['Mes'] = df_ev['Fecha'].dt.to_timestamp().apply(formatear_periodo_es)
+            df_ev = resumen_mov['mensual'].groupby(['Mes', 'Tipo'])['Importe'].sum().reset_index().rename(columns={'Mes': 'Fecha'})
+            df_ev['Mes'] = df_ev['Fecha'].apply(formatear_periodo_es)
             fig = px.bar(df_ev.sort_values("Fecha"), x='Mes', y='Importe', color='Tipo', barmode='group',
                          color_discrete_map={'Ingreso': '#00CC96', 'Gasto': '#EF553B'},
                          title="Evolución de Ingresos y Gastos")
             st.plotly_chart(fig, use_container_width=True)
         
         elif tipo_visualizacion == "Distribución por Categorías":
-            df_cat = df[df['Tipo'] == 'Gasto'].groupby('Categoría')['Importe'].sum().reset_index()
+            df_cat = mensual_gastos.groupby('Categoría')['Importe'].sum().reset_index()
             df_cat = df_cat.sort_values('Importe', ascending=False)
             
             col_pie, col_bar = st.columns(2)
@@ -2790,14 +3544,13 @@ else:
         
         elif tipo_visualizacion == "Gráfico de Sankey (Flujo)":
             # Crear flujo: Ingresos -> Categorías -> Ahorro
-            df_gastos = df[df['Tipo'] == 'Gasto'].copy()
-            if not df_gastos.empty:
-                ingresos_total = df[df['Tipo'] == 'Ingreso']['Importe'].sum()
-                gastos_total = df_gastos['Importe'].sum()
+            if not mensual_gastos.empty:
+                ingresos_total = resumen_mov['mensual'][resumen_mov['mensual']['Tipo'] == 'Ingreso']['Importe'].sum()
+                gastos_total = mensual_gastos['Importe'].sum()
                 ahorro = ingresos_total - gastos_total
                 
                 # Preparar datos para Sankey
-                gastos_por_cat = df_gastos.groupby('Categoría')['Importe'].sum().to_dict()
+                gastos_por_cat = mensual_gastos.groupby('Categoría')['Importe'].sum().to_dict()
                 
                 # Crear nodos y enlaces
                 nodes = ['Ingresos'] + list(gastos_por_cat.keys()) + ['Ahorro']
@@ -2845,11 +3598,9 @@ else:
                 st.info("No hay suficientes datos para el gráfico de Sankey")
         
         elif tipo_visualizacion == "Gráfico de Burbujas":
-            df_gastos = df[df['Tipo'] == 'Gasto'].copy()
-            if not df_gastos.empty:
-                df_burb = df_gastos.groupby(['Categoría', df_gastos['Fecha'].dt.to_period('M')])['Importe'].sum().reset_index()
-                df_burb['Fecha'] = pd.to_datetime(df_burb['Fecha'].astype(str))
-                df_burb['Mes'] = df_burb['Fecha'].apply(formatear_periodo_es)
+            if not mensual_gastos.empty:
+                df_burb = mensual_gastos.groupby(['Categoría', 'Mes'])['Importe'].sum().reset_index()
+                df_burb['Mes'] = df_burb['Mes'].apply(formatear_periodo_es)
                 
                 fig_burb = px.scatter(df_burb, x='Mes', y='Categoría', size='Importe', 
                                      color='Importe', hover_data=['Importe'],
@@ -2862,15 +3613,14 @@ else:
                 st.info("No hay datos de gastos para mostrar")
         
         elif tipo_visualizacion == "Calendario de Gastos":
-            df_gastos = df[df['Tipo'] == 'Gasto'].copy()
-            if not df_gastos.empty:
-                df_gastos['Año'] = df_gastos['Fecha'].dt.year
-                df_gastos['Mes'] = df_gastos['Fecha'].dt.month
-                df_gastos['Dia'] = df_gastos['Fecha'].dt.day
-                df_gastos['Dia_Semana'] = df_gastos['Fecha'].dt.day_name()
-                
+            if not diario_gastos.empty:
                 # Crear heatmap por día del mes
-                pivot_cal = df_gastos.groupby(['Año', 'Mes', 'Dia'])['Importe'].sum().reset_index()
+                pivot_cal = pd.DataFrame({
+                    'Año': diario_gastos['Dia'].dt.year,
+                    'Mes': diario_gastos['Dia'].dt.month,
+                    'Dia': diario_gastos['Dia'].dt.day,
+                    'Importe': diario_gastos['Importe'],
+                })
                 pivot_cal['Fecha_Str'] = pivot_cal.apply(lambda x: f"{x['Año']}-{x['Mes']:02d}-{x['Dia']:02d}", axis=1)
                 
                 fig_cal = px.scatter(pivot_cal, x='Dia', y='Mes', size='Importe', 
@@ -2885,11 +3635,12 @@ else:
                 st.info("No hay datos de gastos para mostrar")
         
         elif tipo_visualizacion == "Heatmap por Día de Semana":
-            df_gastos = df[df['Tipo'] == 'Gasto'].copy()
-            if not df_gastos.empty:
-                df_gastos['Dia_Semana'] = df_gastos['Fecha'].dt.day_name()
-                df_gastos['Mes'] = df_gastos['Fecha'].dt.month
-                df_gastos['Mes_Nombre'] = df_gastos['Mes'].map(MESES_ES_DICT)
+            if not diario_gastos.empty:
+                df_gastos = pd.DataFrame({
+                    'Dia_Semana': diario_gastos['Dia'].dt.day_name(),
+                    'Mes_Nombre': diario_gastos['Dia'].dt.month.map(MESES_ES_DICT),
+                    'Importe': diario_gastos['Importe'],
+                })
                 
                 dias_orden = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
                 dias_es = {'Monday': 'Lunes', 'Tuesday': 'Martes', 'Wednesday': 'Miércoles', 
@@ -2919,10 +3670,15 @@ else:
         col_list, col_action = st.columns([2, 1])
         
         with col_list:
+            version_rec = version_base_editor("editor_rec", "recurrentes", versiones_iniciales["recurrentes"])
             edited_rec = st.data_editor(df_rec, num_rows="dynamic", use_container_width=True, key="editor_rec")
             if st.button("💾 Guardar Plantillas"):
-                save_recurrentes(edited_rec)
-                st.success("Guardado"); st.rerun()
+                try:
+                    save_recurrentes(edited_rec, version_esperada=version_rec)
+                    st.session_state.pop("version_base_editor_rec", None)
+                    st.success("Guardado"); st.rerun()
+                except ConflictoVersionError as e:
+                    st.error(f"❌ {e}. Recarga la página y vuelve a aplicar tus cambios.")
 
         with col_action:
             fecha_gen = st.date_input("Generar para fecha:", datetime.now(), format="DD/MM/YYYY")
@@ -2935,9 +3691,8 @@ else:
                         impacto = imp_final / 12 if row['Frecuencia'] == "Anual" else imp_final
                         nuevos_movs.append([pd.to_datetime(fecha_gen), row['Tipo'], row['Categoría'], row['Concepto'], imp_final, row['Frecuencia'], impacto, row['Es_Conjunto']])
                     
-                    df = pd.concat([df, pd.DataFrame(nuevos_movs, columns=COLUMNS)], ignore_index=True)
-                    save_all_data(df)
-                    st.success(f"Generados {len(nuevos_movs)} movimientos"); st.rerun()
+                    if append_movimientos(pd.DataFrame(nuevos_movs, columns=COLUMNS)):
+                        st.success(f"Generados {len(nuevos_movs)} movimientos"); st.rerun()
 
     # --- SECCIÓN: EDITAR ---
     elif seccion_actual == "📝 Editar":
@@ -2945,8 +3700,10 @@ else:
         st.caption("Edita los movimientos directamente en la tabla y haz clic en 'Guardar Cambios'")
         
         # Preparar DataFrame para edición
+        version_mov = version_base_editor("editor_movimientos", "movimientos", versiones_iniciales["movimientos"])
         df_edit = df.copy()
         df_edit['Fecha'] = df_edit['Fecha'].dt.date  # Convertir a date para el editor
+        df_edit[COLUMNAS_CATEGORICAS] = df_edit[COLUMNAS_CATEGORICAS].astype(object)  # Permitir valores nuevos
         
         edited_df = st.data_editor(
             df_edit, 
@@ -3008,12 +3765,17 @@ else:
                     axis=1
                 )
                 cambios = len(edited_df) - len(df)
-                save_all_data(edited_df)
-                registrar_cambio("Edición", f"Editados {len(edited_df)} movimientos ({cambios:+d} cambios)")
-                st.success("✅ Cambios guardados correctamente")
-                st.rerun()
+                try:
+                    save_all_data(edited_df, version_esperada=version_mov)
+                    st.session_state.pop("version_base_editor_movimientos", None)
+                    registrar_cambio("Edición", f"Editados {len(edited_df)} movimientos ({cambios:+d} cambios)")
+                    st.success("✅ Cambios guardados correctamente")
+                    st.rerun()
+                except ConflictoVersionError as e:
+                    st.error(f"❌ {e}. Pulsa 'Recargar' y vuelve a aplicar tus cambios.")
         with col_btn2:
             if st.button("🔄 Recargar", use_container_width=True):
+                st.session_state.pop("version_base_editor_movimientos", None)
                 st.rerun()
 
     # --- SECCIÓN: EXPORTAR/IMPORTAR ---
@@ -3106,11 +3868,10 @@ else:
                                 st.dataframe(df_importado.head(10), use_container_width=True)
                                 
                                 if st.button("💾 Confirmar e Importar", type="primary"):
-                                    df = pd.concat([df, df_importado], ignore_index=True)
-                                    save_all_data(df)
-                                    registrar_cambio("Importación", f"Importados {len(df_importado)} movimientos desde CSV")
-                                    st.success("✅ Datos importados correctamente")
-                                    st.rerun()
+                                    if append_movimientos(df_importado):
+                                        registrar_cambio("Importación", f"Importados {len(df_importado)} movimientos desde CSV")
+                                        st.success("✅ Datos importados correctamente")
+                                        st.rerun()
                             else:
                                 st.error("❌ No se pudieron importar los datos. Verifica el formato del archivo.")
                         else:
@@ -3124,7 +3885,7 @@ else:
         st.subheader("💰 Presupuestos Mensuales")
         st.caption("Establece presupuestos por categoría y recibe alertas cuando te acerques al límite")
         
-        df_presupuestos = load_presupuestos()
+        df_presupuestos = datos_iniciales["presupuestos"].copy()
         
         # Agregar nuevas categorías si no están en presupuestos
         for cat in lista_cats:
@@ -3134,6 +3895,7 @@ else:
                     'Presupuesto_Mensual': 0.0
                 }])], ignore_index=True)
         
+        version_pres = version_base_editor("editor_presupuestos", "presupuestos", versiones_iniciales["presupuestos"])
         edited_pres = st.data_editor(
             df_presupuestos[df_presupuestos['Categoría'].isin(lista_cats)],
             num_rows="dynamic",
@@ -3156,23 +3918,27 @@ else:
         )
         
         if st.button("💾 Guardar Presupuestos", type="primary", use_container_width=True):
-            save_presupuestos(edited_pres)
-            st.success("✅ Presupuestos guardados")
-            st.rerun()
+            try:
+                save_presupuestos(edited_pres, version_esperada=version_pres)
+                st.session_state.pop("version_base_editor_presupuestos", None)
+                st.success("✅ Presupuestos guardados")
+                st.rerun()
+            except ConflictoVersionError as e:
+                st.error(f"❌ {e}. Recarga la página y vuelve a aplicar tus cambios.")
         
         st.markdown("---")
         
         # Mostrar estado de presupuestos
-        if not edited_pres.empty and not df.empty:
+        if not edited_pres.empty:
             st.subheader("📊 Estado de Presupuestos del Mes Actual")
             now = datetime.now()
-            df_mes = df[(df['Fecha'].dt.month == now.month) & (df['Fecha'].dt.year == now.year)]
+            gastos_cat = gastos_mes_por_categoria(now.year, now.month)
             
             for _, presup in edited_pres.iterrows():
                 if presup['Presupuesto_Mensual'] > 0:
                     cat = presup['Categoría']
                     presup_mes = presup['Presupuesto_Mensual']
-                    gasto_mes = df_mes[(df_mes['Categoría'] == cat) & (df_mes['Tipo'] == 'Gasto')]['Importe'].sum()
+                    gasto_mes = gastos_cat.get(cat, 0)
                     porcentaje = (gasto_mes / presup_mes) * 100 if presup_mes > 0 else 0
                     restante = presup_mes - gasto_mes
                     
@@ -3217,8 +3983,12 @@ else:
         # Configuración de Gemini AI
         st.markdown("### 🤖 Asistente IA con Gemini")
         
+        if GEMINI_ENABLED and GEMINI_MODEL is None:
+            inicializar_gemini()
         if GEMINI_ENABLED and GEMINI_MODEL is not None:
             st.success("✅ Gemini está activo y listo para responder tus preguntas")
+            if GEMINI_RESOLUCION:
+                st.caption(f"Modelo: `{GEMINI_RESOLUCION[0]}` ({GEMINI_RESOLUCION[1]})")
             st.info("💡 Ve a la pestaña 'Asesor' para chatear con el asistente IA")
         else:
             st.warning("⚠️ Gemini no está configurado")
@@ -3258,12 +4028,31 @@ else:
         # Configuración de Google Sheets
         st.markdown("### ☁️ Google Drive / Sheets")
         
+        if replicacion_activa():
+            st.info("🏠 **Modo local primero:** los datos se guardan en local y se replican en Google Sheets en segundo plano")
+            replicacion = estado_replicacion()
+            if replicacion['pendientes']:
+                st.caption(f"⏳ Retraso de replicación: {replicacion['retraso']:.0f} s "
+                           f"({', '.join(replicacion['pendientes'])})")
+            else:
+                st.caption("✅ Google Sheets está al día")
+            if replicacion['error']:
+                st.warning(f"⚠️ Error replicando ({replicacion['error']}). Intento {replicacion['intentos']}, "
+                           f"próximo reintento en {replicacion['proximo']:.0f} s. Los datos locales están a salvo.")
+            if replicacion['ultima']:
+                st.caption(f"Última replicación: {replicacion['ultima'].strftime('%d/%m/%Y %H:%M:%S')}")
+
         if GOOGLE_SHEETS_ENABLED and GSPREAD_AVAILABLE:
             sheet = get_google_sheet()
             if sheet:
                 st.success("✅ Google Sheets conectado correctamente")
                 st.info(f"📊 Libro: **{sheet.title}**")
                 st.caption("Tus datos se están guardando automáticamente en Google Drive")
+                informe_api = cliente_sheets().informe()
+                if not informe_api.empty:
+                    with st.expander("📈 Uso de la API de Google Sheets"):
+                        st.caption(f"Límite compartido por todas las sesiones: {SHEETS_PETICIONES_MINUTO} peticiones/minuto")
+                        st.dataframe(informe_api, use_container_width=True, hide_index=True)
             else:
                 st.warning("⚠️ Google Sheets no está configurado correctamente")
                 st.markdown("""
@@ -3315,8 +4104,7 @@ else:
                     backup_seleccionado = st.selectbox("Restaurar desde backup:", backups, key="select_backup")
                     if st.button("🔄 Restaurar Backup", use_container_width=True):
                         try:
-                            df_backup = pd.read_csv(os.path.join(BACKUP_DIR, backup_seleccionado))
-                            df_backup['Fecha'] = pd.to_datetime(df_backup['Fecha'], dayfirst=True, errors='coerce')
+                            df_backup = _aplicar_esquema(pd.read_csv(os.path.join(BACKUP_DIR, backup_seleccionado)))
                             save_all_data(df_backup)
                             registrar_cambio("Restauración", f"Restaurado desde: {backup_seleccionado}")
                             st.success("✅ Backup restaurado correctamente")
@@ -3328,15 +4116,9 @@ else:
         
         # Historial de Cambios
         st.markdown("### 📜 Historial de Cambios")
-        if os.path.exists(HISTORIAL_FILE):
-            try:
-                df_hist = pd.read_csv(HISTORIAL_FILE)
-                if not df_hist.empty:
-                    st.dataframe(df_hist.tail(20), use_container_width=True, hide_index=True)
-                else:
-                    st.info("No hay historial de cambios aún")
-            except:
-                st.info("No hay historial de cambios aún")
+        df_hist = load_historial()
+        if not df_hist.empty:
+            st.dataframe(df_hist.tail(20), use_container_width=True, hide_index=True)
         else:
             st.info("No hay historial de cambios aún")
         
@@ -3354,3 +4136,25 @@ else:
                 fecha_antigua = df['Fecha'].min()
                 fecha_reciente = df['Fecha'].max()
                 st.metric("Rango de Datos", f"{fecha_antigua.strftime('%d/%m/%Y')} - {fecha_reciente.strftime('%d/%m/%Y')}")
+        st.caption(f"💾 Almacenamiento local: {STORAGE_BACKEND.upper() if (usar_almacenamiento_columnar() or usar_sqlite() or usar_particiones()) else 'CSV'}")
+        informe = _informes_carga().get("movimientos")
+        if informe:
+            st.caption(f"⏱️ Última carga de movimientos: {informe['filas']} filas desde {informe['origen']} en "
+                       f"{informe['segundos'] * 1000:,.0f} ms · memoria {informe['memoria_antes'] / 1024:,.0f} KB → "
+                       f"{informe['memoria_despues'] / 1024:,.0f} KB")
+        arranque = _informes_carga().get("arranque")
+        if arranque:
+            st.caption(f"🚀 Carga en paralelo: {arranque['total'] * 1000:,.0f} ms en total (secuencial: "
+                       f"{sum(arranque['tiempos'].values()) * 1000:,.0f} ms) · " +
+                       " · ".join(f"{d} {t * 1000:,.0f} ms" for d, t in arranque['tiempos'].items()))
+        if ESCRITURA_DIFERIDA:
+            estado_guardado = estado_escrituras()
+            ultimo = estado_guardado['ultimo_volcado']
+            st.caption(f"📝 Escritura en segundo plano: {len(estado_guardado['pendientes'])} guardados en cola · "
+                       f"último volcado {ultimo.strftime('%H:%M:%S') if ultimo else 'ninguno'}")
+        memoria_libro = informe_memoria_libro()
+        if memoria_libro:
+            st.caption(f"🧠 Libro compartido: {memoria_libro['bytes'] / 1024:,.0f} KB en memoria para "
+                       f"{memoria_libro['sesiones']} sesiones · ahorro frente a una copia por sesión "
+                       f"{memoria_libro['ahorro_sesiones'] / 1024:,.0f} KB · copias evitadas en "
+                       f"{memoria_libro['lecturas']} lecturas {memoria_libro['ahorro_copias'] / 1024:,.0f} KB")
@@ -0,0 +1,25 @@
+"""Carga las funciones de app.py sin servidor de Streamlit (modo bare) en un directorio temporal."""
+import logging
+import os
+import runpy
+import tempfile
+import warnings
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def cargar_app(directorio=None, entorno=None):
+    """Ejecuta app.py en `directorio` (uno temporal por defecto) y devuelve su espacio de nombres.
+    `entorno` fija variables de configuración antes de ejecutarlo (como al arrancar el proceso)."""
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore")
+    os.environ.update(entorno or {})
+    os.chdir(directorio or tempfile.mkdtemp(prefix="finanzas_bench_"))
+    return runpy.run_path(RUTA_APP, run_name="finanzas_app")
+
+
+def reiniciar_caches():
+    """Vacía las cachés de Streamlit: la siguiente lectura es la de un proceso recién arrancado"""
+    import streamlit as st
+    st.cache_data.clear()
+    st.cache_resource.clear()
@@ -0,0 +1,103 @@
+"""Llamadas a la API y tiempo de un guardado completo en Google Sheets: fila a fila frente a por rango,
+y coste de guardar una edición pequeña reescribiendo la hoja frente a enviar solo las diferencias.
+
+    python benchmarks/bench_escritura_sheets.py --filas 100 500 2000 --latencia 0.01
+"""
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# El doble de gspread vive con los tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from _app import cargar_app
+from fake_gspread import FakeWorksheet
+
+
+def movimientos(n):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "Fecha": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 730, n), unit="D"),
+        "Tipo": rng.choice(["Gasto", "Ingreso"], n, p=[0.85, 0.15]),
+        "Categoría": rng.choice(["Vivienda", "Comida", "Transporte", "Ocio"], n),
+        "Concepto": [f"Movimiento {i}" for i in range(n)],
+        "Importe": rng.uniform(1, 500, n).round(2),
+        "Frecuencia": rng.choice(["Puntual", "Mensual", "Anual"], n),
+        "Impacto_Mensual": rng.uniform(1, 500, n).round(2),
+        "Es_Conjunto": rng.choice([True, False], n),
+    })
+
+
+def guardar_fila_a_fila(app, worksheet, df):
+    """Implementación anterior: clear + append_row por cada fila"""
+    df_to_save = df.copy()
+    df_to_save['Fecha'] = df_to_save['Fecha'].dt.strftime("%d/%m/%Y")
+    worksheet.clear()
+    worksheet.append_row(app['COLUMNS'])
+    for _, row in df_to_save.iterrows():
+        worksheet.append_row(row.tolist())
+
+
+def guardar_por_rango(app, worksheet, df):
+    app['escribir_hoja'](worksheet, app['COLUMNS'], app['_filas_para_hoja'](df))
+
+
+def editar(df):
+    """Edición típica desde "📝 Editar": cambia un importe, borra una fila y añade otra"""
+    df = df.copy()
+    df.loc[df.index[len(df) // 2], "Importe"] = 999.99
+    df = df.drop(df.index[len(df) // 3])
+    return pd.concat([df, movimientos(1)], ignore_index=True)
+
+
+def medir_edicion(app, guardar, df, latencia):
+    worksheet = FakeWorksheet("Finanzas", latencia=latencia)
+    app['_instantaneas_hojas']().clear()
+    app['sincronizar_hoja'](worksheet, app['COLUMNS'], app['_filas_para_hoja'](df))
+    worksheet.llamadas.clear()
+    worksheet.celdas_enviadas = 0
+    inicio = time.perf_counter()
+    guardar(worksheet, app['COLUMNS'], app['_filas_para_hoja'](editar(df)))
+    return sum(worksheet.llamadas.values()), worksheet.celdas_enviadas, time.perf_counter() - inicio
+
+
+def medir(app, guardar, df, latencia):
+    llamadas = Counter()
+    worksheet = FakeWorksheet("Finanzas", latencia=latencia, contador=llamadas)
+    inicio = time.perf_counter()
+    guardar(app, worksheet, df)
+    segundos = time.perf_counter() - inicio
+    assert len(worksheet.get_all_records()) == len(df)
+    llamadas["get_all_records"] -= 1
+    return sum(llamadas.values()), segundos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--latencia", type=float, default=0.01, help="segundos simulados por llamada a la API")
+    args = parser.parse_args()
+
+    app = cargar_app()
+    print(f"{'filas':>7} {'método':<12} {'llamadas':>9} {'segundos':>9}")
+    for n in args.filas:
+        df = movimientos(n)
+        for nombre, guardar in [("fila a fila", guardar_fila_a_fila), ("por rango", guardar_por_rango)]:
+            llamadas, segundos = medir(app, guardar, df, args.latencia)
+            print(f"{n:>7} {nombre:<12} {llamadas:>9} {segundos:>9.2f}")
+
+    print(f"\nEdición de 3 filas\n{'filas':>7} {'método':<12} {'llamadas':>9} {'celdas':>9} {'segundos':>9}")
+    for n in args.filas:
+        df = movimientos(n)
+        for nombre, guardar in [("reescritura", app['escribir_hoja']), ("diferencias", app['sincronizar_hoja'])]:
+            llamadas, celdas, segundos = medir_edicion(app, guardar, df, args.latencia)
+            print(f"{n:>7} {nombre:<12} {llamadas:>9} {celdas:>9} {segundos:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Tiempo de importación de las dependencias pesadas y cuáles carga un arranque en frío de app.py.
+
+Cada medida se hace en un proceso nuevo con `python -X importtime`. Sale con código 1 si el arranque
+(sección por defecto, sin Gemini configurado) importa alguna dependencia que debería ser diferida;
+no cuenta las que ya importa el propio Streamlit (p. ej. plotly.graph_objects para su tema).
+
+    python benchmarks/bench_importacion.py
+"""
+import os
+import subprocess
+import sys
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+DIFERIDOS = ["plotly.express", "plotly.graph_objects", "gspread", "google.oauth2.service_account",
+             "google.generativeai", "openpyxl"]
+
+
+def tiempos_importacion(codigo):
+    """{módulo: ms acumulados} de los módulos importados al ejecutar `codigo` en un proceso nuevo"""
+    proceso = subprocess.run([sys.executable, "-X", "importtime", "-c", codigo],
+                             capture_output=True, text=True, cwd=DIRECTORIO)
+    if proceso.returncode != 0:
+        return None
+    tiempos = {}
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith("import time:") or "[us]" in linea:
+            continue
+        _, acumulado, modulo = linea[len("import time:"):].split("|")
+        # Los módulos importados por otro van sangrados: solo los de primer nivel suman al total
+        tiempos[modulo.strip()] = (int(acumulado) / 1000, not modulo.startswith("  "))
+    return tiempos
+
+
+def main():
+    print(f"{'módulo':<32} {'importación (ms)':>17} {'en el arranque':>15}")
+    arranque = tiempos_importacion("from _app import cargar_app; cargar_app()")
+    streamlit = tiempos_importacion("import streamlit")
+    regresiones = []
+    for modulo in DIFERIDOS:
+        propio = tiempos_importacion(f"import {modulo}")
+        if propio is None:
+            print(f"{modulo:<32} {'no instalado':>17}")
+            continue
+        if modulo not in arranque:
+            estado = "no"
+        elif modulo in streamlit:
+            estado = "por streamlit"
+        else:
+            estado = "sí"
+            regresiones.append(modulo)
+        print(f"{modulo:<32} {propio[modulo][0]:>17.0f} {estado:>15}")
+    total = sum(ms for ms, primer_nivel in arranque.values() if primer_nivel)
+    print(f"\nImportaciones del arranque de app.py: {total:.0f} ms (streamlit: {streamlit['streamlit'][0]:.0f} ms)")
+    if regresiones:
+        print(f"Regresión: el arranque importa {', '.join(regresiones)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Latencia de las interacciones del menú, el formulario de alta y el chat del asesor.
+
+Cada interacción se simula con AppTest (clic o texto + clic) y se mide hasta que el rerun
+termina. AppTest siempre vuelve a ejecutar el script entero; si el botón está en un fragmento
+(st.fragment), se pide solo el rerun de ese fragmento, como hace el navegador. Gemini se
+sustituye por el doble de fake_genai, así que el chat no depende de la red.
+
+    python benchmarks/bench_interacciones.py --filas 2000 --repeticiones 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _app import RUTA_APP, cargar_app
+from bench_escritura_sheets import movimientos
+import fake_genai
+
+import streamlit.testing.v1.local_script_runner as local_script_runner
+from streamlit.testing.v1 import AppTest
+
+# Como el servidor, se compila el script una sola vez (AppTest crea una caché nueva en cada rerun)
+_cache_script = local_script_runner.ScriptCache()
+local_script_runner.ScriptCache = lambda: _cache_script
+
+# Fragmento cuyo rerun se pide en la siguiente ejecución de AppTest (None: script entero)
+_fragmento = None
+_RerunData = local_script_runner.RerunData
+
+
+def _rerun_data(**datos):
+    if _fragmento is not None:
+        datos["fragment_id_queue"] = [_fragmento]
+    return _RerunData(**datos)
+
+
+local_script_runner.RerunData = _rerun_data
+
+
+def fragmentos(at):
+    """Identificador de cada fragmento registrado por la app, por nombre de su función"""
+    ids = {}
+    for fragment_id, envoltorio in at._fragment_storage._fragments.items():
+        for celda in envoltorio.__closure__ or ():
+            funcion = celda.cell_contents
+            if callable(funcion) and getattr(funcion, "__module__", None) == "__main__":
+                ids[funcion.__name__] = fragment_id
+    return ids
+
+
+def boton(at, clave=None, etiqueta=None):
+    for b in at.button:
+        if (clave is not None and b.key == clave) or (etiqueta is not None and b.label == etiqueta):
+            return b
+    raise LookupError(clave or etiqueta)
+
+
+def escribir_pregunta(at):
+    entrada = next(t for t in at.text_input if (t.key or "").startswith("pregunta_gemini_"))
+    entrada.input("¿Cuánto he gastado este mes?")
+
+
+# (nombre, fragmento que contiene el botón, acción previa opcional, clic)
+INTERACCIONES = [
+    ("abrir menú", "cabecera", None, lambda at: boton(at, "btn_hamburger")),
+    ("cerrar menú", "cabecera", None, lambda at: boton(at, "btn_cerrar_menu")),
+    ("abrir formulario", "cabecera", None, lambda at: boton(at, "btn_alta_header")),
+    ("cerrar formulario", "cabecera", None, lambda at: boton(at, "close_modal_btn")),
+    ("enviar pregunta", "chat_asesor", escribir_pregunta, lambda at: boton(at, etiqueta="💬 Enviar Pregunta")),
+    ("limpiar chat", "chat_asesor", None, lambda at: boton(at, etiqueta="🗑️ Limpiar Chat")),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=2000, help="movimientos de ejemplo")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    global _fragmento
+    with fake_genai.instalar():
+        app = cargar_app(entorno={"ESCRITURA_DIFERIDA": "0", "GEMINI_API_KEY": "bench"})
+        app['save_all_data'](movimientos(args.filas))
+
+        at = AppTest.from_file(RUTA_APP, default_timeout=120)
+        inicio = time.perf_counter()
+        at.run()
+        print(f"Carga completa de la página: {(time.perf_counter() - inicio) * 1000:.0f} ms\n")
+        ids = fragmentos(at)
+        print(f"{'interacción':<20} {'rerun':>9} {'ms (mediana)':>13} {'mín':>7} {'máx':>7}")
+        tiempos = {nombre: [] for nombre, _, _, _ in INTERACCIONES}
+        for _ in range(args.repeticiones):
+            for nombre, fragmento, preparar, elemento in INTERACCIONES:
+                if preparar:
+                    preparar(at)
+                clic = elemento(at).click()
+                _fragmento = ids.get(fragmento)
+                inicio = time.perf_counter()
+                try:
+                    clic.run()
+                finally:
+                    _fragmento = None
+                tiempos[nombre].append(time.perf_counter() - inicio)
+                if at.exception:
+                    raise RuntimeError(f"{nombre}: {at.exception[0].message}")
+                if fragmento in ids:
+                    # El árbol de AppTest solo tiene ahora el fragmento: se recompone sin medir
+                    at.run()
+        for nombre, fragmento, _, _ in INTERACCIONES:
+            valores = tiempos[nombre]
+            print(f"{nombre:<20} {'fragmento' if fragmento in ids else 'completo':>9} "
+                  f"{statistics.median(valores) * 1000:>13.0f} {min(valores) * 1000:>7.0f} {max(valores) * 1000:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Bytes que el servidor envía al navegador en cada rerun y tiempo del script, por sección.
+
+Suma el tamaño serializado (protobuf) de todos los elementos que genera un rerun con AppTest.
+El tema CSS se sirve como estático (static/estilos.css) y ya no forma parte de ese envío; la
+columna "con CSS en línea" estima el envío si se volviera a incrustar en un st.markdown.
+
+    python benchmarks/bench_payload.py --filas 2000 --reruns 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _app import RUTA_APP, cargar_app
+from bench_escritura_sheets import movimientos
+
+from streamlit.testing.v1 import AppTest
+
+SECCIONES = ["🤖 Asesor", "📊 Gráficos", "🔍 Tabla", "🔄 Recurrentes", "📝 Editar",
+             "📤 Exportar/Importar", "💰 Presupuestos", "⚙️ Config"]
+RUTA_ESTILOS = os.path.join(os.path.dirname(RUTA_APP), "static", "estilos.css")
+
+
+def elementos(nodo):
+    yield nodo
+    for hijo in getattr(nodo, "children", {}).values():
+        yield from elementos(hijo)
+
+
+def bytes_rerun(at):
+    return sum(len(n.proto.SerializeToString()) for n in elementos(at._tree) if getattr(n, "proto", None) is not None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, default=2000, help="movimientos de ejemplo")
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    # Datos de ejemplo guardados de forma síncrona en un directorio temporal
+    app = cargar_app(entorno={"ESCRITURA_DIFERIDA": "0"})
+    app['save_all_data'](movimientos(args.filas))
+    css = os.path.getsize(RUTA_ESTILOS) if os.path.exists(RUTA_ESTILOS) else 0
+    print(f"Tema CSS servido como estático: {css / 1024:.1f} KB (una descarga, cacheada por el navegador)\n")
+    print(f"{'sección':<22} {'KB por rerun':>13} {'con CSS en línea':>17} {'ms por rerun':>13}")
+    for seccion in SECCIONES:
+        at = AppTest.from_file(RUTA_APP, default_timeout=120)
+        at.session_state["seccion_actual"] = seccion
+        at.run()
+        tiempos = []
+        for _ in range(args.reruns):
+            inicio = time.perf_counter()
+            at.run()
+            tiempos.append(time.perf_counter() - inicio)
+        enviado = bytes_rerun(at)
+        print(f"{seccion:<22} {enviado / 1024:>13.1f} {(enviado + css) / 1024:>17.1f} {statistics.median(tiempos) * 1000:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
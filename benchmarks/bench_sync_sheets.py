@@ -0,0 +1,78 @@
+"""save_all_data y load_data contra Google Sheets simulado en memoria (sin red): llamadas a la API,
+fallos inyectados y tiempo de guardar, guardar una edición, cargar en frío y recargar tras guardar.
+
+    python benchmarks/bench_sync_sheets.py --filas 1000 10000 100000 --latencia 0.05 --tasa-error 0.02
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# El doble de gspread vive con los tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from _app import cargar_app, reiniciar_caches
+from bench_escritura_sheets import editar, movimientos
+from fake_gspread import FakeSpreadsheet, instalar
+
+ENTORNO = {
+    "GOOGLE_SHEETS_ENABLED": "true",
+    "GOOGLE_SHEET_ID": "bench",
+    "GOOGLE_CREDENTIALS_JSON": "{}",
+    # Guardados síncronos para medirlos; sin límite de ritmo salvo que se pida con --peticiones-minuto
+    "ESCRITURA_DIFERIDA": "0",
+    "SHEETS_PETICIONES_MINUTO": "1000000",
+}
+
+
+def medir(libro, funcion):
+    llamadas, fallos = sum(libro.llamadas.values()), sum(libro.simulador.fallos.values())
+    inicio = time.perf_counter()
+    resultado = funcion()
+    segundos = time.perf_counter() - inicio
+    return resultado, sum(libro.llamadas.values()) - llamadas, sum(libro.simulador.fallos.values()) - fallos, segundos
+
+
+def escenario(n, args):
+    libro = FakeSpreadsheet(latencia=args.latencia, tasa_error=args.tasa_error)
+    with instalar(libro):
+        reiniciar_caches()
+        app = cargar_app(entorno=ENTORNO)
+        df = movimientos(n)
+        df_editado = editar(df)
+
+        def cargar_en_frio():
+            reiniciar_caches()
+            return app['load_data']()
+
+        pasos = [
+            ("guardar", lambda: app['save_all_data'](df)),
+            ("guardar edición", lambda: app['save_all_data'](df_editado)),
+            ("cargar en frío", cargar_en_frio),
+            ("guardar edición", lambda: app['save_all_data'](df)),
+            ("cargar tras guardar", app['load_data']),
+        ]
+        for nombre, paso in pasos:
+            resultado, llamadas, fallos, segundos = medir(libro, paso)
+            if nombre.startswith("cargar"):
+                assert len(resultado) == len(df), (nombre, len(resultado), len(df))
+            print(f"{n:>8} {nombre:<20} {llamadas:>9} {fallos:>7} {segundos:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filas", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--latencia", type=float, default=0.05, help="segundos simulados por llamada a la API")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="probabilidad de 429 en cada llamada")
+    parser.add_argument("--peticiones-minuto", type=int, help="cuota de la API (SHEETS_PETICIONES_MINUTO)")
+    args = parser.parse_args()
+    if args.peticiones_minuto:
+        ENTORNO["SHEETS_PETICIONES_MINUTO"] = str(args.peticiones_minuto)
+
+    print(f"{'filas':>8} {'operación':<20} {'llamadas':>9} {'fallos':>7} {'segundos':>9}")
+    for n in args.filas:
+        escenario(n, args)
+
+
+if __name__ == "__main__":
+    main()
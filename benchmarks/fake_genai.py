@@ -0,0 +1,82 @@
+"""Doble en memoria de google-generativeai (Gemini) para medir sin red ni API key.
+
+Cubre la API que usa app.py (configure, list_models, GenerativeModel.generate_content), simula
+latencia y cuenta llamadas. `instalar()` lo registra en sys.modules en lugar de la librería real;
+app.py debe cargarse después, con GEMINI_API_KEY definida.
+"""
+import importlib.machinery
+import sys
+import time
+import types
+from collections import Counter
+from contextlib import contextmanager
+
+MODELOS = ["gemini-1.5-flash-latest", "gemini-1.5-pro-latest", "gemini-pro"]
+
+
+class ModeloNoEncontrado(Exception):
+    """Error de la API cuando el modelo pedido ya no existe (404)"""
+
+
+class Simulador:
+    """Estado compartido del doble: modelos disponibles, latencia y llamadas por operación"""
+
+    def __init__(self, latencia=0.0, modelos=MODELOS, retirados=()):
+        self.latencia = latencia
+        self.modelos = list(modelos)
+        self.retirados = set(retirados)
+        self.llamadas = Counter()
+
+    def llamar(self, operacion):
+        self.llamadas[operacion] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+
+class Respuesta:
+    def __init__(self, texto):
+        self.text = texto
+
+
+def modulo(simulador):
+    """Módulo google.generativeai que delega en `simulador`"""
+    genai = types.ModuleType("google.generativeai")
+    genai.__spec__ = importlib.machinery.ModuleSpec("google.generativeai", None)
+
+    def configure(api_key=None, **kwargs):
+        simulador.llamadas["configure"] += 1
+
+    def list_models():
+        simulador.llamar("list_models")
+        return [types.SimpleNamespace(name=f"models/{m}", supported_generation_methods=["generateContent"])
+                for m in simulador.modelos if m not in simulador.retirados]
+
+    class GenerativeModel:
+        def __init__(self, nombre):
+            self.model_name = nombre
+
+        def generate_content(self, prompt):
+            simulador.llamar("generate_content")
+            if self.model_name in simulador.retirados:
+                raise ModeloNoEncontrado(f"404 models/{self.model_name} is not found")
+            return Respuesta(f"Respuesta simulada de {self.model_name}")
+
+    genai.configure = configure
+    genai.list_models = list_models
+    genai.GenerativeModel = GenerativeModel
+    return genai
+
+
+@contextmanager
+def instalar(**opciones):
+    """Sustituye google.generativeai por el doble mientras dura el bloque y devuelve su Simulador"""
+    simulador = Simulador(**opciones)
+    original = sys.modules.get("google.generativeai")
+    sys.modules["google.generativeai"] = modulo(simulador)
+    try:
+        yield simulador
+    finally:
+        if original is None:
+            sys.modules.pop("google.generativeai", None)
+        else:
+            sys.modules["google.generativeai"] = original
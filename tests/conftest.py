@@ -0,0 +1,89 @@
+"""Fixtures de los tests: app.py en modo bare (sin servidor de Streamlit), un libro de Google
+Sheets en memoria y movimientos de ejemplo.
+
+    pip install -r requirements-test.txt && python -m pytest -q
+"""
+import logging
+import os
+import random
+import runpy
+import warnings
+
+import pandas as pd
+import pytest
+
+from fake_gspread import FakeSpreadsheet, instalar
+
+# En modo bare Streamlit avisa de cada llamada sin contexto de sesión (también desde hilos)
+logging.disable(logging.WARNING)
+warnings.filterwarnings("ignore", module="streamlit")
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+ENTORNO_SHEETS = {
+    "GOOGLE_SHEETS_ENABLED": "true",
+    "GOOGLE_SHEET_ID": "test",
+    "GOOGLE_CREDENTIALS_JSON": "{}",
+    "SHEETS_PETICIONES_MINUTO": "1000000",
+}
+
+
+def _reiniciar_caches():
+    import streamlit as st
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Función que ejecuta app.py en un directorio temporal con la configuración dada y devuelve
+    el espacio de nombres de sus funciones (el que hay que modificar para sustituir una).
+    Con sheets=True se conecta al libro en memoria (fixture `libro`)."""
+    def cargar(sheets=False, **entorno):
+        for clave, valor in {**(ENTORNO_SHEETS if sheets else {}), **entorno}.items():
+            monkeypatch.setenv(clave, valor)
+        monkeypatch.chdir(tmp_path)
+        _reiniciar_caches()
+        return runpy.run_path(RUTA_APP, run_name="finanzas_app")["load_data"].__globals__
+    yield cargar
+    _reiniciar_caches()
+
+
+@pytest.fixture
+def libro():
+    """Libro de Google Sheets en memoria al que se conecta app.py cargada con sheets=True"""
+    libro = FakeSpreadsheet(codigo_error=400)
+    with instalar(libro):
+        yield libro
+
+
+@pytest.fixture
+def movimientos():
+    """Función que genera n movimientos de ejemplo reproducibles (Concepto "Movimiento i")"""
+    def generar(n, inicio=0, semilla=0):
+        azar = random.Random(semilla)
+        return pd.DataFrame({
+            "Fecha": [pd.Timestamp("2024-01-01") + pd.Timedelta(days=azar.randrange(730)) for _ in range(n)],
+            "Tipo": [azar.choices(["Gasto", "Ingreso"], [0.85, 0.15])[0] for _ in range(n)],
+            "Categoría": [azar.choice(["Vivienda", "Comida", "Transporte", "Ocio"]) for _ in range(n)],
+            "Concepto": [f"Movimiento {i}" for i in range(inicio, inicio + n)],
+            "Importe": [round(azar.uniform(1, 500), 2) for _ in range(n)],
+            "Frecuencia": [azar.choice(["Puntual", "Mensual", "Anual"]) for _ in range(n)],
+            "Impacto_Mensual": [round(azar.uniform(1, 500), 2) for _ in range(n)],
+            "Es_Conjunto": [azar.choice([True, False]) for _ in range(n)],
+        })
+    return generar
+
+
+@pytest.fixture
+def hoja():
+    """Conversión entre filas de una hoja simulada y DataFrames, normalizadas como las compara app.py"""
+    class Hoja:
+        @staticmethod
+        def contenido(g, worksheet):
+            return g["_normalizar_filas"]([g["gspread_utils"].numericise_all(list(f)) for f in worksheet._valores[1:]])
+
+        @staticmethod
+        def esperado(g, df):
+            return g["_normalizar_filas"](g["_filas_para_hoja"](df))
+    return Hoja
@@ -0,0 +1,258 @@
+"""Doble en memoria de gspread para los tests y los benchmarks: llamadas, tiempo y errores sin red.
+
+Cubre la API que usa app.py (cliente, libro y hojas), simula latencia, cuenta llamadas por
+operación e inyecta errores. `instalar(libro)` hace que app.py se conecte a él en lugar de a Google.
+"""
+import json
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import gspread
+    from gspread.exceptions import APIError, WorksheetNotFound
+except ImportError:
+    gspread = None
+
+    class WorksheetNotFound(Exception):
+        pass
+
+    class APIError(Exception):
+        def __init__(self, response):
+            super().__init__(response.text)
+            self.response = response
+
+
+class RespuestaSimulada:
+    """Respuesta HTTP mínima para construir un APIError de gspread"""
+
+    def __init__(self, codigo, mensaje):
+        self.status_code = codigo
+        self.headers = {}
+        self._mensaje = mensaje
+        self.text = json.dumps(self.json())
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": self._mensaje, "status": "SIMULADO"}}
+
+
+class Simulador:
+    """Latencia, contador de llamadas e inyección de errores compartidos por un libro y sus hojas.
+
+    errores: {operación: n} hace fallar las n siguientes llamadas a esa operación.
+    tasa_error: probabilidad de que falle cualquier llamada (reproducible con `semilla`).
+    """
+
+    def __init__(self, latencia=0.0, contador=None, errores=None, tasa_error=0.0, codigo_error=429, semilla=0):
+        self.latencia = latencia
+        self.llamadas = contador if contador is not None else Counter()
+        self.errores = Counter(errores or {})
+        self.tasa_error = tasa_error
+        self.codigo_error = codigo_error
+        self.fallos = Counter()
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+
+    def llamada(self, nombre):
+        with self._lock:
+            self.llamadas[nombre] += 1
+            fallar = self.errores[nombre] > 0 or (self.tasa_error and self._azar.random() < self.tasa_error)
+            if self.errores[nombre] > 0:
+                self.errores[nombre] -= 1
+            if fallar:
+                self.fallos[nombre] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+        if fallar:
+            raise APIError(RespuestaSimulada(self.codigo_error, f"Error simulado en {nombre}"))
+
+
+class FakeWorksheet:
+    """Hoja en memoria con la API de gspread que usa app.py; cuenta llamadas y simula latencia"""
+
+    def __init__(self, title, rows=1000, cols=20, latencia=0.0, contador=None, simulador=None):
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.simulador = simulador or Simulador(latencia, contador)
+        self.llamadas = self.simulador.llamadas
+        self.celdas_enviadas = 0
+        self._valores = []
+
+    def _llamada(self, nombre):
+        self.simulador.llamada(nombre)
+
+    # --- Lecturas (como la API: valores formateados como texto) ---
+    def get_all_values(self):
+        self._llamada("get_all_values")
+        return [[_formatear(v) for v in f] for f in self._valores]
+
+    def get_all_records(self):
+        self._llamada("get_all_records")
+        if not self._valores:
+            return []
+        cabecera = [_formatear(v) for v in self._valores[0]]
+        # Como gspread, las filas vacías intermedias también son registros (con "" en cada campo)
+        return [dict(zip(cabecera, (_numerizar(_formatear(v)) for v in list(f) + [""] * (len(cabecera) - len(f)))))
+                for f in self._valores[1:]]
+
+    def get(self, rango, **kwargs):
+        self._llamada("get")
+        return self._rango(rango)
+
+    def _rango(self, rango):
+        inicio, _, fin = rango.partition(":")
+        fila_fin = "".join(c for c in fin if c.isdigit())
+        filas = [[_formatear(v) for v in f] for f in self._valores[_fila_a1(inicio) - 1:int(fila_fin) if fila_fin else None]]
+        # Como la API: las filas vacías del final del rango no se devuelven
+        while filas and not any(v != "" for v in filas[-1]):
+            filas.pop()
+        return filas
+
+    def batch_get(self, rangos, **kwargs):
+        """Varios rangos en una sola llamada, como Worksheet.batch_get"""
+        self._llamada("batch_get")
+        return [self._rango(r) for r in rangos]
+
+    # --- Escrituras ---
+    def clear(self):
+        self._llamada("clear")
+        self._valores = []
+
+    def append_row(self, fila, **kwargs):
+        self._llamada("append_row")
+        self.celdas_enviadas += len(fila)
+        self._valores.append(list(fila))
+        self.row_count = max(self.row_count, len(self._valores))
+
+    def append_rows(self, filas, **kwargs):
+        self._llamada("append_rows")
+        self.celdas_enviadas += sum(len(f) for f in filas)
+        self._valores.extend(list(f) for f in filas)
+        self.row_count = max(self.row_count, len(self._valores))
+
+    def add_rows(self, n):
+        self._llamada("add_rows")
+        self.row_count += n
+
+    def update(self, range_name=None, values=None, **kwargs):
+        self._llamada("update")
+        fila_inicio = _fila_a1(range_name.split(":")[0])
+        if fila_inicio - 1 + len(values) > self.row_count:
+            raise ValueError("El rango excede el tamaño de la hoja")
+        self._escribir(fila_inicio, values)
+
+    def batch_update(self, datos, **kwargs):
+        self._llamada("batch_update")
+        for bloque in datos:
+            self._escribir(_fila_a1(bloque['range'].split(":")[0]), bloque['values'])
+
+    def insert_rows(self, filas, row=1, **kwargs):
+        self._llamada("insert_rows")
+        self.celdas_enviadas += sum(len(f) for f in filas)
+        self._valores[row - 1:row - 1] = [list(f) for f in filas]
+        self.row_count += len(filas)
+
+    def delete_rows(self, inicio, fin=None):
+        self._llamada("delete_rows")
+        del self._valores[inicio - 1:(fin or inicio)]
+        self.row_count -= (fin or inicio) - inicio + 1
+
+    def batch_clear(self, rangos):
+        self._llamada("batch_clear")
+        for rango in rangos:
+            inicio, fin = rango.split(":")
+            for i in range(_fila_a1(inicio) - 1, min(_fila_a1(fin), len(self._valores))):
+                self._valores[i] = [""] * len(self._valores[i])
+        while self._valores and not any(v != "" for v in self._valores[-1]):
+            self._valores.pop()
+
+    def _escribir(self, fila_inicio, filas):
+        self.celdas_enviadas += sum(len(f) for f in filas)
+        while len(self._valores) < fila_inicio - 1 + len(filas):
+            self._valores.append([])
+        for i, fila in enumerate(filas):
+            self._valores[fila_inicio - 1 + i] = list(fila)
+
+
+def _formatear(valor):
+    if isinstance(valor, bool):
+        return "TRUE" if valor else "FALSE"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _numerizar(texto):
+    for tipo in (int, float):
+        try:
+            return tipo(texto)
+        except ValueError:
+            pass
+    return texto
+
+
+def _fila_a1(celda):
+    return int("".join(c for c in celda if c.isdigit()))
+
+
+class FakeSpreadsheet:
+    """Libro en memoria: resuelve y crea hojas contando las peticiones de metadatos.
+    Acepta los argumentos de Simulador (latencia, errores, tasa_error...)."""
+
+    def __init__(self, latencia=0.0, title="Finanzas (fake)", **simulacion):
+        self.title = title
+        self.simulador = Simulador(latencia, **simulacion)
+        self.llamadas = self.simulador.llamadas
+        self.hojas = {}
+
+    def worksheet(self, titulo):
+        self.simulador.llamada("worksheet")
+        if titulo not in self.hojas:
+            raise WorksheetNotFound(titulo)
+        return self.hojas[titulo]
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self.simulador.llamada("add_worksheet")
+        hoja = FakeWorksheet(title, rows=rows, cols=cols, simulador=self.simulador)
+        self.hojas[title] = hoja
+        return hoja
+
+    def values_batch_get(self, rangos, **kwargs):
+        """Una sola petición para varias hojas completas ("'Titulo'"), como Spreadsheet.values_batch_get"""
+        self.simulador.llamada("values_batch_get")
+        rangos_valores = []
+        for rango in rangos:
+            titulo = rango.strip("'")
+            if titulo not in self.hojas:
+                raise WorksheetNotFound(titulo)
+            rangos_valores.append({"range": rango, "values": [[_formatear(v) for v in f] for f in self.hojas[titulo]._valores]})
+        return {"valueRanges": rangos_valores}
+
+
+class FakeClient:
+    """Cliente de gspread: open_by_key devuelve siempre el mismo libro"""
+
+    def __init__(self, libro):
+        self.libro = libro
+
+    def open_by_key(self, clave):
+        self.libro.simulador.llamada("open_by_key")
+        return self.libro
+
+
+@contextmanager
+def instalar(libro):
+    """Sustituye la autorización de gspread para que app.py abra `libro`.
+    app.py debe cargarse con GOOGLE_SHEETS_ENABLED=true, GOOGLE_SHEET_ID y GOOGLE_CREDENTIALS_JSON."""
+    from google.oauth2 import service_account
+    originales = gspread.authorize, service_account.Credentials.__dict__["from_service_account_info"]
+    gspread.authorize = lambda credenciales, **kwargs: FakeClient(libro)
+    service_account.Credentials.from_service_account_info = staticmethod(lambda *args, **kwargs: None)
+    try:
+        yield libro
+    finally:
+        gspread.authorize = originales[0]
+        service_account.Credentials.from_service_account_info = originales[1]
@@ -0,0 +1,43 @@
+"""Escritura en segundo plano (write-behind): cola en disco y volcado a Google Sheets."""
+import os
+import threading
+
+
+def test_volcado_de_la_cola_con_sheets_caido_conserva_el_guardado(app, libro, movimientos, hoja, monkeypatch):
+    g = app(sheets=True, ESCRITURA_DIFERIDA="1")
+    # Sin hilo escritor: la cola se vuelca a mano
+    monkeypatch.setitem(g, "_escritor_segundo_plano", lambda: threading.Event())
+    df = movimientos(50)
+    g["save_all_data"](df)
+    assert g["volcar_cola_escrituras"]()
+
+    editado = df.copy()
+    editado.loc[3, "Concepto"] = "EDITADO"
+    g["save_all_data"](editado)
+    libro.simulador.errores.update({"batch_update": 5, "batch_get": 5, "update": 5, "clear": 5, "append_rows": 5})
+    assert not g["volcar_cola_escrituras"]()
+    estado = g["estado_escrituras"]()
+    assert estado["pendientes"] == ["movimientos"]
+    assert estado["error"]
+    # Nada acaba en el fichero local cuando Sheets es la fuente principal
+    assert not os.path.exists(g["FILE_NAME"])
+
+    libro.simulador.errores.clear()
+    assert g["volcar_cola_escrituras"]()
+    assert hoja.contenido(g, libro.hojas[g["SHEET_FINANZAS"]]) == hoja.esperado(g, editado)
+
+
+def test_con_sheets_principal_los_guardados_son_sincronos_por_defecto(app, libro, movimientos, hoja, monkeypatch):
+    monkeypatch.delenv("ESCRITURA_DIFERIDA", raising=False)
+    g = app(sheets=True)
+    assert not g["ESCRITURA_DIFERIDA"]
+    df = movimientos(10)
+    g["save_all_data"](df)
+    # Ya está en la hoja al volver, sin pasar por la cola en disco
+    assert hoja.contenido(g, libro.hojas[g["SHEET_FINANZAS"]]) == hoja.esperado(g, df)
+    assert not os.path.exists(g["_ruta_pendiente"]("movimientos"))
+
+
+def test_en_local_los_guardados_van_a_la_cola_por_defecto(app, monkeypatch):
+    monkeypatch.delenv("ESCRITURA_DIFERIDA", raising=False)
+    assert app()["ESCRITURA_DIFERIDA"]
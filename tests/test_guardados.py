@@ -0,0 +1,34 @@
+"""Guardados completos: avisos de error y control optimista de versiones."""
+import time
+
+import pytest
+
+
+def test_error_de_sheets_al_guardar_presupuestos_se_avisa(app, libro, monkeypatch):
+    g = app(sheets=True, ESCRITURA_DIFERIDA="0")
+    avisos = []
+    monkeypatch.setattr(g["st"], "warning", lambda mensaje, *args, **kwargs: avisos.append(mensaje))
+    presupuestos = g["pd"].DataFrame({"Categoría": ["Comida"], "Presupuesto_Mensual": [300.0]})
+    libro.simulador.errores.update({"update": 1})
+    g["save_presupuestos"](presupuestos)
+    assert any("presupuestos" in a for a in avisos)
+
+
+def test_guardar_sobre_datos_de_reserva_da_conflicto(app, movimientos, monkeypatch):
+    g = app(ESCRITURA_DIFERIDA="0")
+    g["save_all_data"](movimientos(10))
+    _, versiones = g["cargar_datasets"]()
+    version_reserva = versiones["movimientos"]
+    g["save_all_data"](movimientos(12))
+
+    # La carga de movimientos supera CARGA_TIMEOUT: se pinta la reserva, con su versión
+    carga_normal = g["load_data"]
+    monkeypatch.setitem(g, "CARGA_TIMEOUT", 0.05)
+    monkeypatch.setitem(g, "load_data", lambda: (time.sleep(0.5), carga_normal())[1])
+    datos, versiones = g["cargar_datasets"]()
+    assert g["_informes_carga"]()["arranque"]["retrasados"] == ["movimientos"]
+    assert len(datos["movimientos"]) == 10
+    assert versiones["movimientos"] == version_reserva
+    with pytest.raises(g["ConflictoVersionError"]):
+        g["save_all_data"](datos["movimientos"], version_esperada=versiones["movimientos"])
+    assert len(carga_normal()) == 12
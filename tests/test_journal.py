@@ -0,0 +1,84 @@
+"""Altas de movimientos: journal local, compactación y altas en Google Sheets."""
+import os
+import time
+
+import pytest
+
+
+def test_altas_en_journal_y_compactacion(app, movimientos):
+    g = app(ESCRITURA_DIFERIDA="0", JOURNAL_COMPACT_THRESHOLD="1000")
+    g["save_all_data"](movimientos(20))
+    altas = movimientos(5, inicio=20, semilla=1)
+    for i in range(len(altas)):
+        assert g["append_movimientos"](altas.iloc[[i]])
+    assert g["_contar_journal"]() == len(altas)
+    total = g["resumen_movimientos"]()["mensual"]["Importe"].sum()
+    assert len(g["load_data"]()) == 25
+
+    g["compactar_journal"]()
+    assert g["_contar_journal"]() == 0
+    df = g["load_data"]()
+    assert set(df["Concepto"]) == {f"Movimiento {i}" for i in range(25)}
+    assert g["resumen_movimientos"]()["mensual"]["Importe"].sum() == pytest.approx(total)
+
+
+def test_una_sola_compactacion_en_marcha(app, movimientos, monkeypatch):
+    g = app(ESCRITURA_DIFERIDA="0", JOURNAL_COMPACT_THRESHOLD="2")
+    g["save_all_data"](movimientos(10))
+    compactar = g["compactar_journal"]
+    llamadas = []
+
+    def compactar_lento():
+        llamadas.append(1)
+        time.sleep(0.3)
+        compactar()
+
+    monkeypatch.setitem(g, "compactar_journal", compactar_lento)
+    for i in range(6):
+        g["append_movimientos"](movimientos(1, inicio=10 + i))
+    # Esperar a que termine la compactación en marcha
+    with g["_lock_compactacion"]():
+        pass
+    assert len(llamadas) == 1
+    assert len(g["load_data"]()) == 16
+
+
+def test_compactar_no_provoca_conflicto_en_un_editor_abierto(app, movimientos):
+    g = app(ESCRITURA_DIFERIDA="0", JOURNAL_COMPACT_THRESHOLD="1000")
+    g["save_all_data"](movimientos(10))
+    g["append_movimientos"](movimientos(2, inicio=10))
+    version_editor = g["version_datos"]("movimientos")
+    editado = g["load_data"]()
+    editado.loc[0, "Concepto"] = "EDITADO"
+
+    g["compactar_journal"]()
+    assert g["version_datos"]("movimientos") != version_editor
+    g["save_all_data"](editado, version_esperada=version_editor)
+    assert "EDITADO" in set(g["load_data"]()["Concepto"])
+
+
+def test_compactar_no_oculta_un_cambio_real(app, movimientos):
+    g = app(ESCRITURA_DIFERIDA="0", JOURNAL_COMPACT_THRESHOLD="1000")
+    g["save_all_data"](movimientos(10))
+    g["append_movimientos"](movimientos(1, inicio=10))
+    version_editor = g["version_datos"]("movimientos")
+    g["compactar_journal"]()
+    g["append_movimientos"](movimientos(1, inicio=11))
+    with pytest.raises(g["ConflictoVersionError"]):
+        g["save_all_data"](g["load_data"](), version_esperada=version_editor)
+
+
+def test_alta_fallida_en_sheets_no_acaba_en_el_journal(app, libro, movimientos):
+    g = app(sheets=True, ESCRITURA_DIFERIDA="0")
+    g["save_all_data"](movimientos(10))
+    n_antes = g["resumen_movimientos"]()["mensual"]["N"].sum()
+
+    libro.simulador.errores.update({"append_rows": 1})
+    assert not g["append_movimientos"](movimientos(1, inicio=10))
+    assert not os.path.exists(g["JOURNAL_FILE"])
+    assert "Movimiento 10" not in set(g["load_data"]()["Concepto"])
+    assert g["resumen_movimientos"]()["mensual"]["N"].sum() == n_antes
+
+    assert g["append_movimientos"](movimientos(1, inicio=10))
+    assert "Movimiento 10" in set(g["load_data"]()["Concepto"])
+    assert g["resumen_movimientos"]()["mensual"]["N"].sum() == n_antes + 1
@@ -0,0 +1,23 @@
+"""Lecturas cacheadas con Google Sheets como fuente de verdad: cambios hechos fuera de la app."""
+import time
+
+
+def test_los_cambios_directos_en_la_hoja_se_ven_al_renovar_la_lectura(app, libro, movimientos, monkeypatch):
+    g = app(sheets=True, ESCRITURA_DIFERIDA="0", SHEETS_TTL_LECTURAS="60")
+    g["save_all_data"](movimientos(10))
+    reloj = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: reloj[0])
+    assert len(g["load_data"]()) == 10
+    assert g["resumen_movimientos"]()["mensual"]["N"].sum() == 10
+    version_editor = g["version_datos"]("movimientos")
+
+    # Otra persona añade una fila directamente en la hoja
+    libro.hojas[g["SHEET_FINANZAS"]]._valores += g["_filas_para_hoja"](movimientos(1, inicio=10))
+    assert len(g["load_data"]()) == 10
+
+    reloj[0] += 61
+    assert "Movimiento 10" in set(g["load_data"]()["Concepto"])
+    assert g["resumen_movimientos"]()["mensual"]["N"].sum() == 11
+    assert g["valor_metrica"]("mensual")["N"].sum() == 11
+    # Renovar la lectura no es una escritura: un editor abierto puede seguir guardando
+    g["_comprobar_version"]("movimientos", version_editor)
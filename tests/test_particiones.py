@@ -0,0 +1,25 @@
+"""Almacenamiento particionado por año-mes: lectura de solo los meses que se necesitan."""
+from datetime import datetime
+
+
+def test_asesor_y_presupuestos_leen_solo_los_meses_recientes(app, movimientos, monkeypatch):
+    g = app(STORAGE_BACKEND="particionado", ESCRITURA_DIFERIDA="0")
+    pd = g["pd"]
+    mes_actual = pd.Timestamp(datetime.now().year, datetime.now().month, 1)
+    recientes = movimientos(6, inicio=1000, semilla=1)
+    recientes["Fecha"] = [mes_actual - pd.DateOffset(months=i % 2) + pd.Timedelta(days=i) for i in range(6)]
+    g["save_all_data"](pd.concat([movimientos(200), recientes], ignore_index=True))
+    assert len(g["_periodos_particionados"]()) > 2
+
+    leidas = []
+    leer_particion = g["_leer_particion"]
+    monkeypatch.setitem(g, "_leer_particion", lambda periodo: (leidas.append(periodo), leer_particion(periodo))[1])
+    datos, _ = g["cargar_datasets"](solo_meses_recientes=True)
+    periodos = {(mes_actual - pd.DateOffset(months=i)).strftime("%Y-%m") for i in range(2)}
+    assert set(leidas) == periodos
+    assert set(datos["movimientos"]["Concepto"]) == set(recientes["Concepto"])
+
+    leidas.clear()
+    datos, _ = g["cargar_datasets"]()
+    assert len(datos["movimientos"]) == 206
+    assert len(leidas) == len(g["_periodos_particionados"]())
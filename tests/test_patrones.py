@@ -0,0 +1,34 @@
+"""Análisis de patrones desde el resumen materializado frente al cálculo sobre todos los movimientos."""
+import pytest
+
+
+def analizar_patrones_original(df):
+    """Cálculo anterior al resumen materializado: recorre todos los movimientos"""
+    df_gastos = df[df['Tipo'] == 'Gasto'].copy()
+    media = df_gastos['Importe'].mean()
+    std = df_gastos['Importe'].std()
+    umbral = media + (2 * std)
+    return {
+        'gastos_inusuales': df_gastos[df_gastos['Importe'] > umbral].copy(),
+        'media_gasto': media,
+        'desviacion': std,
+    }
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+@pytest.mark.parametrize("n_inusuales", [5, 80])
+def test_gastos_inusuales_como_el_calculo_original(app, movimientos, backend, n_inusuales):
+    g = app(STORAGE_BACKEND=backend, ESCRITURA_DIFERIDA="0")
+    df = movimientos(3000)
+    inusuales = movimientos(n_inusuales, inicio=3000, semilla=1)
+    inusuales["Tipo"] = "Gasto"
+    inusuales["Importe"] = [5000.0 + i for i in range(n_inusuales)]
+    g["save_all_data"](g["pd"].concat([df, inusuales], ignore_index=True))
+    g["append_movimientos"](movimientos(1, inicio=4000).assign(Tipo="Gasto", Importe=9000.0))
+
+    patrones = g["analizar_patrones"]()
+    esperado = analizar_patrones_original(g["load_data"]())
+    assert set(patrones['gastos_inusuales']['Concepto']) == set(esperado['gastos_inusuales']['Concepto'])
+    assert len(patrones['gastos_inusuales']) == n_inusuales + 1
+    assert patrones['media_gasto'] == pytest.approx(esperado['media_gasto'])
+    assert patrones['desviacion'] == pytest.approx(esperado['desviacion'])
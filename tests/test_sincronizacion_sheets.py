@@ -0,0 +1,60 @@
+"""Guardado por diferencias en Google Sheets (sincronizar_hoja) frente a la copia conocida de la hoja."""
+
+
+def test_diff_con_copia_desfasada_no_corrompe_la_hoja(app, libro, movimientos, hoja):
+    g = app(sheets=True, ESCRITURA_DIFERIDA="0")
+    df = movimientos(30)
+    g["save_all_data"](df)
+    worksheet = libro.hojas[g["SHEET_FINANZAS"]]
+    # Otra persona borra una fila directamente en la hoja: la copia en memoria queda desfasada
+    del worksheet._valores[5]
+
+    editado = df.copy()
+    editado.loc[10, "Concepto"] = "EDITADO"
+    g["save_all_data"](editado)
+    assert hoja.contenido(g, worksheet) == hoja.esperado(g, editado)
+
+    # Con la copia ya al día, el siguiente guardado vuelve a enviar solo la fila cambiada
+    editado.loc[12, "Concepto"] = "OTRO"
+    antes = dict(libro.llamadas)
+    g["save_all_data"](editado)
+    assert libro.llamadas["batch_update"] - antes.get("batch_update", 0) == 1
+    assert libro.llamadas["update"] == antes.get("update", 0)
+    assert hoja.contenido(g, worksheet) == hoja.esperado(g, editado)
+
+
+def test_diff_sobre_una_fila_editada_en_la_hoja_la_reescribe(app, libro, movimientos, hoja):
+    g = app(sheets=True, ESCRITURA_DIFERIDA="0")
+    df = movimientos(30)
+    g["save_all_data"](df)
+    worksheet = libro.hojas[g["SHEET_FINANZAS"]]
+    worksheet._valores[11][3] = "AJENO"
+
+    editado = df.copy()
+    editado.loc[10, "Concepto"] = "EDITADO"
+    g["save_all_data"](editado)
+    assert hoja.contenido(g, worksheet) == hoja.esperado(g, editado)
+
+
+def test_altas_y_bajas_de_filas_descartan_el_worksheet_en_cache(app, libro, movimientos, hoja):
+    g = app(sheets=True, ESCRITURA_DIFERIDA="0")
+    df = movimientos(30)
+    g["save_all_data"](df)
+    titulo = g["SHEET_FINANZAS"]
+    g["get_or_create_worksheet"](g["get_google_sheet"](), titulo, g["COLUMNS"])
+    assert titulo in g["_hojas_resueltas"]()
+
+    # Baja de una fila intermedia: delete_rows cambia row_count
+    editado = df.drop(index=7).reset_index(drop=True)
+    g["save_all_data"](editado)
+    assert "delete_rows" in libro.llamadas
+    assert titulo not in g["_hojas_resueltas"]()
+    assert hoja.contenido(g, libro.hojas[titulo]) == hoja.esperado(g, editado)
+
+    # Alta intermedia: insert_rows
+    g["get_or_create_worksheet"](g["get_google_sheet"](), titulo, g["COLUMNS"])
+    editado = g["pd"].concat([editado.iloc[:3], movimientos(1, inicio=100), editado.iloc[3:]], ignore_index=True)
+    g["save_all_data"](editado)
+    assert "insert_rows" in libro.llamadas
+    assert titulo not in g["_hojas_resueltas"]()
+    assert hoja.contenido(g, libro.hojas[titulo]) == hoja.esperado(g, editado)
@@ -0,0 +1,55 @@
+"""Almacenamiento SQLite: migración de los CSV, errores de inicialización y lectura incremental."""
+import sqlite3
+
+import pytest
+
+
+def test_los_csv_se_importan_una_sola_vez(app, movimientos, tmp_path):
+    csv = movimientos(10)
+    csv["Fecha"] = csv["Fecha"].dt.strftime("%d/%m/%Y")
+    csv.to_csv(tmp_path / "finanzas.csv", index=False)
+    g = app(STORAGE_BACKEND="sqlite", ESCRITURA_DIFERIDA="0")
+    assert len(g["load_data"]()) == 10
+
+    # Borrar todos los movimientos no debe resucitar los del CSV antiguo en el siguiente arranque
+    g["save_all_data"](g["load_data"]().iloc[0:0])
+    g = app(STORAGE_BACKEND="sqlite", ESCRITURA_DIFERIDA="0")
+    assert g["load_data"]().empty
+
+
+def test_un_error_al_inicializar_la_base_se_propaga(app, monkeypatch):
+    g = app(STORAGE_BACKEND="sqlite", ESCRITURA_DIFERIDA="0")
+    g["_inicializar_sqlite"].clear()
+    monkeypatch.setitem(g, "ESQUEMA_SQLITE", "CREATE TABLE (")
+    with pytest.raises(sqlite3.Error):
+        with g["_sqlite"]():
+            pass
+
+
+def test_tras_un_alta_solo_se_leen_las_filas_nuevas(app, movimientos, monkeypatch):
+    g = app(STORAGE_BACKEND="sqlite", ESCRITURA_DIFERIDA="0")
+    g["save_all_data"](movimientos(20))
+    assert len(g["load_data"]()) == 20
+
+    pd = g["pd"]
+    leidas = []
+    read_sql_query = pd.read_sql_query
+
+    def espiar(sql, *args, **kwargs):
+        df = read_sql_query(sql, *args, **kwargs)
+        if "FROM movimientos WHERE id >" in sql:
+            leidas.append(len(df))
+        return df
+
+    monkeypatch.setattr(pd, "read_sql_query", espiar)
+    g["append_movimientos"](movimientos(1, inicio=20))
+    assert set(g["load_data"]()["Concepto"]) == {f"Movimiento {i}" for i in range(21)}
+    assert leidas == [1]
+
+    # Una reescritura (ediciones, bajas) obliga a releer la tabla entera
+    editado = g["load_data"]().drop(index=3).reset_index(drop=True)
+    editado.loc[0, "Concepto"] = "EDITADO"
+    g["save_all_data"](editado)
+    df = g["load_data"]()
+    assert leidas[-1] == 20
+    assert len(df) == 20 and "EDITADO" in set(df["Concepto"]) and "Movimiento 3" not in set(df["Concepto"])